@@ -1,15 +1,120 @@
 # streamlit_app.py
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+_script_started = time.perf_counter()
+
 import streamlit as st
-from helper import SQLChatBot
+from export import EXPORT_FORMATS
+from helper import SQLChatBot, strip_sql_fences
+from history_store import HISTORY_PAGE_ROWS, ChatHistory, get_result_spool
+from llm_scheduler import LLMBusy
+from pool import all_pool_stats
+from result_cache import get_result_cache
+from sql_cache import get_sql_cache
+from telemetry import record_span, run_in_context, start_metrics_server, trace
 
 st.set_page_config(page_title="SQL ChatBot", layout="wide")
 
+# Import + first script run of a session; only the first session of a process pays for the imports
+if "cold_start_seconds" not in st.session_state:
+    st.session_state.cold_start_seconds = time.perf_counter() - _script_started
+    record_span("app.cold_start", st.session_state.cold_start_seconds)
+
+# Prometheus-style /metrics endpoint, once per process
+if os.getenv("METRICS_PORT"):
+    start_metrics_server(int(os.getenv("METRICS_PORT")))
+
+# Exports up to this size are offered as a download button (Streamlit sends the file in one message);
+# larger ones are left in EXPORT_DIR.
+EXPORT_DOWNLOAD_MAX_BYTES = int(os.getenv("EXPORT_DOWNLOAD_MAX_BYTES", str(200 * 1024 * 1024)))
+
+# Runs queries while the explanation streams; shared by all sessions of this process
+_query_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix="app-query")
+
+
+def render_result(target, result):
+    """Shows a query result, or one page of it (or its error message), in a Streamlit element or placeholder."""
+    if isinstance(result, str):  # likely an error message
+        target.error(result)
+        return
+    # A placeholder holds one element: the warning and the table go in a container inside it
+    box = target.container()
+    guard = result.attrs.get("guard")
+    if guard and guard.get("rewritten"):
+        box.warning(f"🛡️ The query was limited before running: {guard['reason']}.")
+    elif result.attrs.get("truncated"):
+        rows = result.attrs.get("rows", len(result))
+        box.warning(f"⚠️ Only the first {rows:,} rows were fetched; the full result was too large.")
+    box.dataframe(result)
+
+
+def _first_page(result):
+    return result if isinstance(result, str) else result.head(HISTORY_PAGE_ROWS)
+
+
+def render_history_result(history, entry, latest):
+    """
+    Shows a history entry's result one page at a time. The result is only
+    read (possibly back from disk) while its "Show result" box is ticked.
+    """
+    if "error" in entry:
+        st.error(entry["error"])
+        return
+    if not st.checkbox(f"📊 Show result ({entry['rows']:,} rows)", value=latest, key=f"show_{entry['id']}"):
+        return
+    pages = max(1, -(-entry["rows"] // HISTORY_PAGE_ROWS))
+    page = 1
+    if pages > 1:
+        page = st.number_input(f"Page (of {pages:,})", min_value=1, max_value=pages, value=1, step=1,
+                               key=f"page_{entry['id']}")
+    frame = history.page(entry, page - 1)
+    render_result(st, frame)
+    if pages > 1:
+        start = (page - 1) * HISTORY_PAGE_ROWS
+        st.caption(f"Rows {start + 1:,}–{start + len(frame):,} of {entry['rows']:,}")
+
+
+def render_export(bot, entry):
+    """
+    Runs an entry's query again without the row cap, streaming every row to
+    a CSV or Parquet file, and offers the file for download.
+    """
+    key = f"export_{entry['id']}"
+    with st.expander("⬇️ Export full result"):
+        output_format = st.radio("Format", EXPORT_FORMATS, horizontal=True, key=f"{key}_format")
+        if st.button("Export", key=f"{key}_button"):
+            status = st.empty()
+
+            def show_progress(progress):
+                status.info(f"⏳ {progress['rows']:,} rows written ({progress['bytes'] / 1e6:,.1f} MB, "
+                            f"{progress['rows_per_second']:,.0f} rows/s)")
+
+            st.session_state[key] = bot.export_query_result(entry["query"], output_format,
+                                                            on_progress=show_progress)
+            status.empty()
+        export = st.session_state.get(key)
+        if isinstance(export, str):
+            st.error(export)
+        elif export and os.path.exists(export["path"]):
+            st.caption(f"✅ {export['rows']:,} rows, {export['bytes'] / 1e6:,.1f} MB in {export['seconds']:.1f}s "
+                       f"({export['rows_per_second']:,.0f} rows/s)")
+            if export["bytes"] <= EXPORT_DOWNLOAD_MAX_BYTES:
+                with open(export["path"], "rb") as f:
+                    st.download_button(f"💾 Download {export['format'].upper()}", f,
+                                       file_name=os.path.basename(export["path"]), key=f"{key}_download")
+            else:
+                st.info(f"The file is too large to download here; it was saved as `{export['path']}`.")
+
+
 # --- Sidebar: SQL Server Connection ---
 st.sidebar.title("🔌 SQL Server Connection")
 server = st.sidebar.text_input("Server", placeholder="e.g. DESKTOP-XXXX\\SQLEXPRESS")
 database = st.sidebar.text_input("Database", placeholder="e.g. RetailDB_RealTime")
 username = st.sidebar.text_input("Username")
 password = st.sidebar.text_input("Password", type="password")
+debug_mode = st.sidebar.checkbox("🐞 Debug mode")
 
 # Initialize session state
 if "bot" not in st.session_state:
@@ -17,13 +122,15 @@ if "bot" not in st.session_state:
 if "connected" not in st.session_state:
     st.session_state.connected = False
 if "chat_history" not in st.session_state:
-    st.session_state.chat_history = []
+    # Results beyond the process-wide memory budget are spilled to disk
+    st.session_state.chat_history = ChatHistory()
 
 # --- Connect Button ---
 if st.sidebar.button("Connect"):
     if all([server, database, username, password]):
         try:
-            st.session_state.bot = SQLChatBot(server, database, username, password)
+            # The schema loads in the background; questions can be asked once its catalog is read
+            st.session_state.bot = SQLChatBot(server, database, username, password, background=True)
             st.session_state.connected = True
             st.sidebar.success("✅ Connected successfully!")
         except Exception as e:
@@ -32,11 +139,39 @@ if st.sidebar.button("Connect"):
     else:
         st.sidebar.warning("⚠️ Please fill in all fields to connect.")
 
+if st.session_state.connected:
+    progress = st.session_state.bot.schema_loader.progress()
+    if progress["phase"] == "error":
+        st.sidebar.error(f"❌ Schema loading failed: {progress['error']}")
+    elif progress["phase"] == "catalog":
+        st.sidebar.info(f"⏳ Reading the schema catalog... ({progress['elapsed_seconds']:.0f}s)")
+    elif progress["phase"] == "sampling":
+        st.sidebar.progress(progress["sampled"] / max(progress["tables"], 1),
+                            text=f"Profiling columns: {progress['sampled']}/{progress['tables']} tables")
+        st.sidebar.caption("You can already ask questions.")
+    else:
+        st.sidebar.caption(f"🗂️ Schema ready: {progress['tables']} tables")
+
 # --- Optional: Clear Chat Button ---
 if st.sidebar.button("Clear Chat History"):
-    st.session_state.chat_history = []
+    st.session_state.chat_history.clear()
     st.success("🧹 Chat history cleared.")
 
+if debug_mode:
+    with st.sidebar.expander("📈 Caches & pool"):
+        startup = {"cold_start_seconds": st.session_state.cold_start_seconds}
+        if st.session_state.connected:
+            progress = st.session_state.bot.schema_loader.progress()
+            startup.update(time_to_interactive_seconds=progress["interactive_seconds"],
+                           schema_ready_seconds=progress["ready_seconds"])
+        st.json({
+            "startup": startup,
+            "sql_cache": get_sql_cache().stats(),
+            "result_cache": get_result_cache().stats(),
+            "history": get_result_spool().stats(),
+            "pools": all_pool_stats()
+        })
+
 # --- Main Interface ---
 st.title("💬 SQL ChatBot for SQL Server")
 
@@ -49,35 +184,85 @@ st.subheader("Ask a question about your data")
 user_question = st.text_input("Your Question", placeholder="e.g. Show me the top 5 selling products")
 
 if st.button("Get Answer") and user_question:
-    with st.spinner("💡 Thinking..."):
-        try:
-            response = st.session_state.bot.get_full_response(user_question)
+    bot = st.session_state.bot
+    timings = {}
+    started = time.perf_counter()
+    live = st.empty()
+    try:
+        # Render the answer progressively while it is produced; it moves into the history below once complete
+        with trace("question") as spans, live.container():
+            st.markdown(f"### 🔹 {user_question}")
+            st.markdown("**✅ SQL Query:**")
+            sql_box = st.empty()
+            sql_text = ""
+            for chunk in bot.stream_sql_query(user_question):
+                if "first_output" not in timings:
+                    timings["first_output"] = time.perf_counter() - started
+                sql_text += chunk
+                sql_box.code(strip_sql_fences(sql_text), language="sql")
+            sql = bot.last_sql
+            sql_box.code(sql, language="sql")
+            timings["sql"] = time.perf_counter() - started
+
+            # The query runs while the explanation streams in
+            st.markdown("**📊 Result:**")
+            result_box = st.empty()
+            result_box.info("⏳ Running query...")
+            result_future = _query_executor.submit(run_in_context(bot.get_query_result), sql)
+            result_shown = False
+
+            st.markdown("**🧠 Explanation:**")
+            explanation_box = st.empty()
+            explanation = ""
+            for chunk in bot.stream_explanation(user_question, sql):
+                explanation += chunk
+                explanation_box.markdown(explanation)
+                if not result_shown and result_future.done():
+                    render_result(result_box, _first_page(result_future.result()))
+                    timings["result"] = time.perf_counter() - started
+                    result_shown = True
+
+            result = result_future.result()
+            if not result_shown:
+                render_result(result_box, _first_page(result))
+                timings["result"] = time.perf_counter() - started
+            timings["total"] = time.perf_counter() - started
 
-            # Save response to history
-            st.session_state.chat_history.append({
-                "question": user_question,
-                "query": response["sql"],
-                "result": response["result"],
-                "explanation": response["explanation"]
-            })
+        # Save response to history
+        st.session_state.chat_history.append(user_question, sql, result, explanation, timings, spans)
+        live.empty()
 
-        except Exception as err:
-            st.error(f"❌ Error: {err}")
+    except LLMBusy as err:
+        st.warning(f"⏳ {err}")
+    except Exception as err:
+        st.error(f"❌ Error: {err}")
 
 # --- Display Chat History ---
-if st.session_state.chat_history:
+history = st.session_state.chat_history
+if len(history):
     st.markdown("## 💬 Chat History")
-    for i, entry in enumerate(reversed(st.session_state.chat_history), 1):
-        st.markdown(f"### 🔹 Question {len(st.session_state.chat_history) - i + 1}: {entry['question']}")
+    for number, entry in reversed(list(enumerate(history, 1))):
+        st.markdown(f"### 🔹 Question {number}: {entry['question']}")
         st.markdown("**✅ SQL Query:**")
         st.code(entry["query"], language="sql")
 
         st.markdown("**📊 Result:**")
-        if isinstance(entry["result"], str):  # likely an error message
-            st.error(entry["result"])
-        else:
-            st.dataframe(entry["result"])
+        render_history_result(history, entry, latest=number == len(history))
+        if "error" not in entry:
+            render_export(st.session_state.bot, entry)
 
         st.markdown("**🧠 Explanation:**")
         st.write(entry["explanation"])
+        if debug_mode and entry.get("timings"):
+            t = entry["timings"]
+            st.caption(
+                f"⏱️ first output {t.get('first_output', 0):.2f}s · SQL {t.get('sql', 0):.2f}s · "
+                f"result {t.get('result', 0):.2f}s · total {t.get('total', 0):.2f}s"
+            )
+        if debug_mode and entry.get("trace"):
+            with st.expander("🐞 Stage timings"):
+                st.table([
+                    {key: value for key, value in s.items() if key not in ("trace_id", "ts")}
+                    for s in entry["trace"]
+                ])
         st.markdown("---")
@@ -0,0 +1,332 @@
+"""
+Answers a file of questions without the UI, e.g. for nightly regression runs.
+
+    python batch.py questions.txt answers.jsonl
+    python batch.py questions.jsonl answers.parquet --llm-concurrency 4 --db-concurrency 2
+    python batch.py questions.csv answers.jsonl --no-explain --retries 3
+
+Questions are read from a .txt file (one per line), a .jsonl file
+({"id": ..., "question": ...} per line) or a .csv file with a "question"
+column (and optionally "id"). Answers are written as each question finishes:
+JSONL output gets one line per question; Parquet output is a directory of
+part files, one per --flush-every answers. Running the same command again
+resumes: questions already answered successfully in the output are skipped.
+
+Connection settings come from --server/--database/--username/--password or
+the SERVER/DATABASE/SQL_USERNAME/SQL_PASSWORD environment variables (.env is read).
+"""
+import argparse
+import asyncio
+import csv
+import glob
+import hashlib
+import json
+import os
+import sys
+import time
+
+from dotenv import load_dotenv
+
+from helper import DB_TIMEOUT, EXPLAIN_TIMEOUT, SQL_TIMEOUT, SQLChatBot
+from llm_scheduler import BATCH, llm_priority
+from telemetry import trace
+
+BATCH_LLM_CONCURRENCY = int(os.getenv("BATCH_LLM_CONCURRENCY", "4"))
+BATCH_DB_CONCURRENCY = int(os.getenv("BATCH_DB_CONCURRENCY", "4"))
+BATCH_RETRIES = int(os.getenv("BATCH_RETRIES", "2"))
+# Seconds before the first retry; doubled for every further attempt.
+BATCH_RETRY_BACKOFF = float(os.getenv("BATCH_RETRY_BACKOFF", "2"))
+# Result rows stored per answer (the row count is always stored).
+BATCH_RESULT_ROWS = int(os.getenv("BATCH_RESULT_ROWS", "1000"))
+
+
+def question_id(question):
+    return hashlib.sha1(question.strip().encode("utf-8")).hexdigest()[:12]
+
+
+def load_questions(path):
+    """Returns [{"id", "question"}] from a .txt, .jsonl or .csv file; ids default to a hash of the text."""
+    if path.endswith(".jsonl"):
+        with open(path, "r", encoding="utf-8") as f:
+            items = [json.loads(line) for line in f if line.strip()]
+    elif path.endswith(".csv"):
+        with open(path, "r", encoding="utf-8", newline="") as f:
+            items = list(csv.DictReader(f))
+    else:
+        with open(path, "r", encoding="utf-8") as f:
+            items = [{"question": line.strip()} for line in f if line.strip() and not line.startswith("#")]
+    questions = []
+    for item in items:
+        question = item["question"].strip()
+        questions.append({"id": str(item.get("id") or question_id(question)), "question": question})
+    return questions
+
+
+def frame_payload(result, max_rows):
+    """(rows, truncated, JSON records) for a result DataFrame."""
+    records = json.loads(result.head(max_rows).to_json(orient="records", date_format="iso", default_handler=str))
+    return len(result), bool(result.attrs.get("truncated")), records
+
+
+class JSONLWriter:
+    """Appends one answer per line and flushes it, so a crash loses at most the line being written."""
+
+    def __init__(self, path, restart=False):
+        self.path = path
+        if restart and os.path.exists(path):
+            os.remove(path)
+        # Drop a half-written last line left behind by a crash
+        if os.path.exists(path):
+            with open(path, "rb+") as f:
+                data = f.read()
+                if data and not data.endswith(b"\n"):
+                    f.truncate(data.rfind(b"\n") + 1)
+        self._file = open(path, "a", encoding="utf-8")
+
+    def done_ids(self):
+        done = set()
+        with open(self.path, "r", encoding="utf-8") as f:
+            for line in f:
+                record = json.loads(line)
+                if record["status"] == "ok":
+                    done.add(record["id"])
+        return done
+
+    def write(self, record):
+        self._file.write(json.dumps(record, default=str) + "\n")
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+
+class ParquetWriter:
+    """
+    Writes answers as a directory of Parquet part files, ``flush_every``
+    answers per part. Parts are written atomically; answers not yet flushed
+    when the process dies are simply answered again on resume.
+    """
+
+    def __init__(self, path, flush_every=50, restart=False):
+        try:
+            import pyarrow  # noqa: F401
+        except ImportError:
+            raise SystemExit("Parquet output needs pyarrow (pip install pyarrow)") from None
+        self.path = path
+        self.flush_every = flush_every
+        self._pending = []
+        os.makedirs(path, exist_ok=True)
+        if restart:
+            for part in glob.glob(os.path.join(path, "part-*.parquet")):
+                os.remove(part)
+        self._part = len(glob.glob(os.path.join(path, "part-*.parquet")))
+
+    def done_ids(self):
+        import pandas as pd
+
+        done = set()
+        for part in sorted(glob.glob(os.path.join(self.path, "part-*.parquet"))):
+            frame = pd.read_parquet(part, columns=["id", "status"])
+            done.update(frame.loc[frame["status"] == "ok", "id"])
+        return done
+
+    def write(self, record):
+        # Nested values don't map onto one column type, so they are stored as JSON text
+        self._pending.append(dict(record, result=json.dumps(record["result"], default=str),
+                                  stages_ms=json.dumps(record["stages_ms"])))
+        if len(self._pending) >= self.flush_every:
+            self.flush()
+
+    def flush(self):
+        import pandas as pd
+
+        if not self._pending:
+            return
+        path = os.path.join(self.path, f"part-{self._part:05d}.parquet")
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        pd.DataFrame(self._pending).to_parquet(tmp_path, index=False)
+        os.replace(tmp_path, path)
+        self._part += 1
+        self._pending = []
+
+    def close(self):
+        self.flush()
+
+
+def open_writer(path, output_format=None, flush_every=50, restart=False):
+    """JSONL or Parquet writer for ``path``; ``restart`` discards answers already there."""
+    output_format = output_format or ("parquet" if path.endswith(".parquet") else "jsonl")
+    if output_format == "parquet":
+        return ParquetWriter(path, flush_every, restart)
+    return JSONLWriter(path, restart)
+
+
+class _Retryable(Exception):
+    """An attempt failed in a way another attempt may fix (LLM error, timeout, SQL error)."""
+
+
+async def _answer_once(worker, question, llm_limit, db_limit, explain, max_rows):
+    async with llm_limit:
+        try:
+            sql = await asyncio.wait_for(worker.aget_sql_query(question), SQL_TIMEOUT)
+        except asyncio.TimeoutError:
+            raise _Retryable(f"SQL generation timed out after {SQL_TIMEOUT:.0f}s") from None
+
+    async def run_query():
+        async with db_limit:
+            return await worker.aget_query_result(sql, timeout=DB_TIMEOUT)
+
+    async def write_explanation():
+        async with llm_limit:
+            return await asyncio.wait_for(worker.aget_explanation(question, sql), EXPLAIN_TIMEOUT)
+
+    if explain:
+        result, explanation = await asyncio.gather(run_query(), write_explanation(), return_exceptions=True)
+        if isinstance(result, BaseException):
+            raise result
+        if isinstance(explanation, asyncio.TimeoutError):
+            explanation = f"⚠️ Explanation unavailable: timed out after {EXPLAIN_TIMEOUT:.0f}s"
+        elif isinstance(explanation, BaseException):
+            explanation = f"⚠️ Explanation unavailable: {explanation}"
+    else:
+        result, explanation = await run_query(), None
+
+    if isinstance(result, str):
+        # Its SQL has already been dropped from the SQL cache by the bot
+        if result.startswith("⛔"):
+            # Blocked by the query guard: deterministic, reported without retrying
+            return {"status": "blocked", "sql": sql, "error": result, "explanation": explanation,
+                    "rows": None, "truncated": None, "result": None}
+        raise _Retryable(result)
+
+    rows, truncated, records = frame_payload(result, max_rows)
+    return {"status": "ok", "sql": sql, "error": None, "explanation": explanation,
+            "rows": rows, "truncated": truncated, "result": records}
+
+
+async def _answer(bot, item, llm_limit, db_limit, explain, retries, backoff, max_rows):
+    """Answers one question with retries; always returns a record, never raises."""
+    started = time.perf_counter()
+    attempt = 0
+    while True:
+        attempt += 1
+        worker = bot.fork()  # every attempt starts without conversation history
+        try:
+            with trace("batch.question", question_id=item["id"]) as spans:
+                answer = await _answer_once(worker, item["question"], llm_limit, db_limit, explain, max_rows)
+            break
+        except Exception as e:
+            error = str(e) if isinstance(e, _Retryable) else f"{e.__class__.__name__}: {e}"
+            if attempt > retries:
+                answer = {"status": "failed", "sql": worker.last_sql, "error": error, "explanation": None,
+                          "rows": None, "truncated": None, "result": None}
+                spans = []
+                break
+            await asyncio.sleep(backoff * 2 ** (attempt - 1))
+
+    stages = {}
+    for span in spans:
+        stages[span["name"]] = round(stages.get(span["name"], 0.0) + span["ms"], 3)
+    return {"id": item["id"], "question": item["question"], **answer, "attempts": attempt,
+            "seconds": round(time.perf_counter() - started, 3), "stages_ms": stages}
+
+
+async def arun_batch(bot, questions, writer, llm_concurrency=BATCH_LLM_CONCURRENCY,
+                     db_concurrency=BATCH_DB_CONCURRENCY, retries=BATCH_RETRIES, backoff=BATCH_RETRY_BACKOFF,
+                     explain=True, max_rows=BATCH_RESULT_ROWS, resume=True, on_record=None):
+    """
+    Answers ``questions`` ([{"id", "question"}]) concurrently and writes every
+    record as soon as it is finished.
+
+    SQL generation and explanations share ``llm_concurrency`` slots; queries
+    use ``db_concurrency`` slots (keep it at or below the pool size). Each
+    question is retried up to ``retries`` times with exponential backoff.
+    With ``resume`` questions already answered successfully in the output
+    are skipped.
+
+    Returns:
+        dict: counts per status plus 'skipped' and 'seconds'
+    """
+    started = time.perf_counter()
+    done = writer.done_ids() if resume else set()
+    pending = [item for item in questions if item["id"] not in done]
+    summary = {"total": len(questions), "skipped": len(questions) - len(pending), "ok": 0, "blocked": 0, "failed": 0}
+
+    llm_limit = asyncio.Semaphore(llm_concurrency)
+    db_limit = asyncio.Semaphore(db_concurrency)
+    # Interactive sessions sharing the process get the model first
+    with llm_priority(BATCH):
+        tasks = [
+            asyncio.ensure_future(_answer(bot, item, llm_limit, db_limit, explain, retries, backoff, max_rows))
+            for item in pending
+        ]
+    try:
+        for future in asyncio.as_completed(tasks):
+            record = await future
+            writer.write(record)
+            summary[record["status"]] += 1
+            if on_record is not None:
+                on_record(record, summary)
+    finally:
+        for task in tasks:
+            task.cancel()
+        writer.close()
+    summary["seconds"] = round(time.perf_counter() - started, 3)
+    return summary
+
+
+def run_batch(bot, questions, writer, **options):
+    """Synchronous wrapper around arun_batch."""
+    return asyncio.run(arun_batch(bot, questions, writer, **options))
+
+
+def _print_progress(record, summary):
+    finished = summary["ok"] + summary["blocked"] + summary["failed"]
+    icon = {"ok": "✅", "blocked": "⛔", "failed": "❌"}[record["status"]]
+    print(f"{icon} [{finished}/{summary['total'] - summary['skipped']}] {record['question'][:80]} "
+          f"({record['seconds']:.1f}s, {record['attempts']} attempt(s))")
+
+
+def main():
+    load_dotenv()
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("questions", help=".txt, .jsonl or .csv file with questions")
+    parser.add_argument("output", help=".jsonl file or .parquet directory for the answers")
+    parser.add_argument("--format", choices=("jsonl", "parquet"), help="output format (default: from the extension)")
+    parser.add_argument("--server", default=os.getenv("SERVER"))
+    parser.add_argument("--database", default=os.getenv("DATABASE"))
+    parser.add_argument("--username", default=os.getenv("SQL_USERNAME"))
+    parser.add_argument("--password", default=os.getenv("SQL_PASSWORD"))
+    parser.add_argument("--llm-concurrency", type=int, default=BATCH_LLM_CONCURRENCY)
+    parser.add_argument("--db-concurrency", type=int, default=BATCH_DB_CONCURRENCY)
+    parser.add_argument("--retries", type=int, default=BATCH_RETRIES, help="extra attempts per failing question")
+    parser.add_argument("--no-explain", action="store_true", help="skip the explanation step")
+    parser.add_argument("--max-result-rows", type=int, default=BATCH_RESULT_ROWS, help="result rows stored per answer")
+    parser.add_argument("--flush-every", type=int, default=50, help="answers per Parquet part file")
+    parser.add_argument("--restart", action="store_true",
+                        help="discard the answers already in the output and answer every question again")
+    args = parser.parse_args()
+
+    if not all([args.server, args.database, args.username, args.password]):
+        parser.error("server, database, username and password are required (arguments or environment)")
+
+    questions = load_questions(args.questions)
+    writer = open_writer(args.output, args.format, args.flush_every, restart=args.restart)
+    bot = SQLChatBot(args.server, args.database, args.username, args.password)
+    summary = run_batch(
+        bot, questions, writer,
+        llm_concurrency=args.llm_concurrency,
+        db_concurrency=args.db_concurrency,
+        retries=args.retries,
+        explain=not args.no_explain,
+        max_rows=args.max_result_rows,
+        resume=not args.restart,
+        on_record=_print_progress
+    )
+    print(f"\n📦 {summary['ok']} answered, {summary['blocked']} blocked, {summary['failed']} failed, "
+          f"{summary['skipped']} already done ({summary['seconds']:.1f}s)")
+    sys.exit(1 if summary["failed"] else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+import asyncio
+import random
+import threading
+import time
+
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+EXPLANATION_MARKER = "SQL Query Business Summary"
+
+
+class FakeRateLimitError(Exception):
+    """What the fake model raises for an injected rate-limit response (like google.api_core's ResourceExhausted)."""
+
+    code = 429
+
+
+_lock = threading.Lock()
+
+
+class FakeSQLChatModel(BaseChatModel):
+    """
+    Deterministic stand-in for ChatGoogleGenerativeAI.
+
+    Answers SQL-generation prompts with ``sql`` and explanation prompts
+    (recognised by the explanation system prompt) with ``explanation``,
+    after ``latency`` seconds (plus up to ``latency_jitter``). Streams the
+    answer in ``chunk_size`` pieces.
+
+    For exercising the LLM scheduler, a call fails with a 429 with
+    probability ``rate_limit_rate``, and whenever more than
+    ``rate_limit_concurrency`` calls (0: no limit) are in progress at once.
+    """
+    sql: str = "SELECT TOP 100 * FROM [dbo].[orders]"
+    explanation: str = "This shows the most recent orders."
+    latency: float = 0.0
+    latency_jitter: float = 0.0
+    rate_limit_rate: float = 0.0
+    rate_limit_concurrency: int = 0
+    chunk_size: int = 8
+    calls: int = 0
+    rate_limited: int = 0
+    in_progress: int = 0
+
+    @property
+    def _llm_type(self):
+        return "fake-sql"
+
+    def _answer(self, messages):
+        self.calls += 1
+        is_explanation = any(EXPLANATION_MARKER in str(m.content) for m in messages)
+        return self.explanation if is_explanation else f"```sql\n{self.sql}\n```"
+
+    def _delay(self):
+        return self.latency + (random.uniform(0, self.latency_jitter) if self.latency_jitter else 0.0)
+
+    def _start(self):
+        """Counts the call as in progress; raises an injected 429."""
+        with _lock:
+            self.in_progress += 1
+            overloaded = self.rate_limit_concurrency and self.in_progress > self.rate_limit_concurrency
+            if overloaded or (self.rate_limit_rate and random.random() < self.rate_limit_rate):
+                self.in_progress -= 1
+                self.rate_limited += 1
+                raise FakeRateLimitError("429 Resource has been exhausted (e.g. check quota).")
+
+    def _end(self):
+        with _lock:
+            self.in_progress -= 1
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        self._start()
+        try:
+            delay = self._delay()
+            if delay:
+                time.sleep(delay)
+            text = self._answer(messages)
+        finally:
+            self._end()
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=text))])
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs):
+        self._start()
+        try:
+            delay = self._delay()
+            if delay:
+                await asyncio.sleep(delay)
+            text = self._answer(messages)
+        finally:
+            self._end()
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=text))])
+
+    def _stream(self, messages, stop=None, run_manager=None, **kwargs):
+        self._start()
+        try:
+            delay = self._delay()
+            if delay:
+                time.sleep(delay)
+        finally:
+            self._end()
+        text = self._answer(messages)
+        for start in range(0, len(text), self.chunk_size):
+            yield ChatGenerationChunk(message=AIMessageChunk(content=text[start:start + self.chunk_size]))
@@ -0,0 +1,221 @@
+"""
+Load test for the HTTP service (service.py).
+
+Against a running service:
+
+    python benchmarks/load_test.py --url http://127.0.0.1:8080 --requests 200 --concurrency 16
+
+Fully offline (synthetic SQLite database and the fake LLM, no key or server
+needed); starts the service itself with the given number of workers:
+
+    python benchmarks/load_test.py --offline --workers 4 --requests 200 --concurrency 16
+
+The fake LLM can be made to answer with 429s, at random (--llm-429-rate) or
+above a number of concurrent calls (--llm-quota-concurrency), to see the LLM
+scheduler queue, back off and retry instead of failing requests:
+
+    python benchmarks/load_test.py --offline --llm-latency 0.5 --llm-quota-concurrency 4 --concurrency 32
+
+Reports latency percentiles, throughput and errors; for --endpoint stream
+also the time to the first event. Each simulated client keeps its own
+client id, so follow-up questions exercise the shared conversation store.
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import socket
+import statistics
+import sys
+import tempfile
+import time
+import urllib.request
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+
+DEFAULT_QUESTIONS = [
+    "Show the most recent orders",
+    "How many customers do we have?",
+    "Which products sold best last month?",
+    "List the orders over 1000",
+]
+
+
+def offline_bot(path, latency, rate_limit_rate=0.0, rate_limit_concurrency=0):
+    """Bot factory for --offline: the synthetic database behind a pool and the fake LLM."""
+    import helper
+    import pool
+    from fake_llm import FakeSQLChatModel
+    from sqlite_adapter import DATABASE_NAME, connect_sqlite
+
+    conn_pool = pool.ConnectionPool(lambda: connect_sqlite(path), name="sqlite:load-test")
+    return helper.SQLChatBot("load-test", DATABASE_NAME, "load-test", "load-test",
+                             llm=FakeSQLChatModel(latency=latency, rate_limit_rate=rate_limit_rate,
+                                                  rate_limit_concurrency=rate_limit_concurrency),
+                             conn=conn_pool, background=True)
+
+
+def _serve_offline(port, workers, tables, latency, rate_limit_rate, rate_limit_concurrency, work_dir):
+    # Runs in a forked process, so the environment is set before the app modules load
+    os.environ["SCHEMA_CACHE_DIR"] = os.path.join(work_dir, "cache")
+    os.environ["SQL_CACHE_PATH"] = os.path.join(work_dir, "cache", "sql_cache.sqlite3")
+    os.environ["LOCAL_STORE_PATH"] = os.path.join(work_dir, "cache", "store.sqlite3")
+    os.environ["SCHEMA_EMBED_MODEL"] = ""
+    sys.path[:0] = [ROOT, BENCH_DIR]
+    import service
+    from sqlite_adapter import build_synthetic_database
+
+    path = os.path.join(work_dir, "load_test.sqlite")
+    build_synthetic_database(path, tables, order_rows=1000)
+    service.serve(lambda: offline_bot(path, latency, rate_limit_rate, rate_limit_concurrency),
+                  host="127.0.0.1", port=port, workers=workers)
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def wait_until_healthy(url, timeout=120):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            with urllib.request.urlopen(f"{url}/health", timeout=5) as response:
+                if json.load(response)["schema"]["phase"] == "ready":
+                    return
+        except OSError:
+            pass
+        time.sleep(0.2)
+    raise SystemExit(f"❌ Service at {url} did not become healthy within {timeout}s")
+
+
+def one_request(url, endpoint, question, client_id, timeout):
+    """Returns {"seconds", "first_event", "error"} for one request."""
+    body = json.dumps({"question": question, "client_id": client_id}).encode("utf-8")
+    request = urllib.request.Request(f"{url}/{endpoint}", data=body,
+                                     headers={"Content-Type": "application/json"})
+    started = time.perf_counter()
+    first_event, error = None, None
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            if endpoint == "stream":
+                for line in response:
+                    if first_event is None:
+                        first_event = time.perf_counter() - started
+                    event = json.loads(line)
+                    if event["event"] == "error":
+                        error = event["error"]
+            else:
+                payload = json.load(response)
+                error = payload["result"].get("error")
+    except Exception as e:
+        error = f"{e.__class__.__name__}: {e}"
+    return {"seconds": time.perf_counter() - started, "first_event": first_event, "error": error}
+
+
+def _summary(values):
+    if len(values) < 2:
+        return {"p50": values[0] if values else None, "p95": None, "p99": None, "mean": values[0] if values else None}
+    cuts = statistics.quantiles(values, n=100)
+    return {"p50": cuts[49], "p95": cuts[94], "p99": cuts[98], "mean": statistics.mean(values)}
+
+
+def run_load(url, endpoint, total, concurrency, questions, timeout=120):
+    clients = [uuid.uuid4().hex[:12] for _ in range(concurrency)]
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        futures = [
+            executor.submit(one_request, url, endpoint, questions[i % len(questions)], clients[i % concurrency], timeout)
+            for i in range(total)
+        ]
+        samples = [future.result() for future in futures]
+    elapsed = time.perf_counter() - started
+
+    errors = [s["error"] for s in samples if s["error"]]
+    report = {
+        "endpoint": endpoint,
+        "requests": total,
+        "concurrency": concurrency,
+        "errors": len(errors),
+        "error_examples": sorted(set(errors))[:5],
+        "elapsed_seconds": elapsed,
+        "throughput_rps": total / elapsed if elapsed else None,
+        "latency_seconds": _summary([s["seconds"] for s in samples if not s["error"]]),
+    }
+    if endpoint == "stream":
+        report["first_event_seconds"] = _summary([s["first_event"] for s in samples if s["first_event"] is not None])
+    return report
+
+
+def _print_report(report):
+    def fmt(value):
+        return "-" if value is None else f"{value * 1000:.1f}ms"
+
+    print(f"\n/{report['endpoint']}: {report['requests']} requests, concurrency {report['concurrency']}")
+    print(f"  throughput  {report['throughput_rps']:.1f} req/s over {report['elapsed_seconds']:.2f}s")
+    for label, key in (("latency", "latency_seconds"), ("first event", "first_event_seconds")):
+        if key in report:
+            stats = report[key]
+            print(f"  {label:<11} p50 {fmt(stats['p50'])}  p95 {fmt(stats['p95'])}  "
+                  f"p99 {fmt(stats['p99'])}  mean {fmt(stats['mean'])}")
+    print(f"  errors      {report['errors']}")
+    for example in report["error_examples"]:
+        print(f"    {example}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default="http://127.0.0.1:8080")
+    parser.add_argument("--endpoint", choices=["ask", "stream"], default="ask")
+    parser.add_argument("--requests", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--questions", help="text file with one question per line")
+    parser.add_argument("--output", help="write the report as JSON")
+    parser.add_argument("--offline", action="store_true", help="start the service against a synthetic database")
+    parser.add_argument("--workers", type=int, default=2, help="service workers for --offline")
+    parser.add_argument("--tables", type=int, default=100, help="synthetic tables for --offline")
+    parser.add_argument("--llm-latency", type=float, default=0.05, help="fake LLM latency (s) for --offline")
+    parser.add_argument("--llm-429-rate", type=float, default=0.0,
+                        help="share of fake LLM calls answered with a 429 for --offline")
+    parser.add_argument("--llm-quota-concurrency", type=int, default=0,
+                        help="fake LLM answers 429 above this many concurrent calls (per worker) for --offline")
+    args = parser.parse_args()
+
+    questions = DEFAULT_QUESTIONS
+    if args.questions:
+        with open(args.questions, encoding="utf-8") as f:
+            questions = [line.strip() for line in f if line.strip()]
+
+    server = None
+    url = args.url.rstrip("/")
+    if args.offline:
+        port = _free_port()
+        url = f"http://127.0.0.1:{port}"
+        server = multiprocessing.get_context("fork").Process(
+            target=_serve_offline,
+            args=(port, args.workers, args.tables, args.llm_latency, args.llm_429_rate, args.llm_quota_concurrency,
+                  tempfile.mkdtemp(prefix="sqlchatbot-load-")),
+            daemon=False
+        )
+        server.start()
+    try:
+        wait_until_healthy(url)
+        report = run_load(url, args.endpoint, args.requests, args.concurrency, questions)
+    finally:
+        if server is not None:
+            server.terminate()
+            server.join(10)
+
+    _print_report(report)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    return 1 if report["errors"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
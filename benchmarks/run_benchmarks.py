@@ -0,0 +1,260 @@
+"""
+Offline end-to-end benchmarks: no Gemini key and no SQL Server needed.
+
+Uses FakeSQLChatModel for the LLM and a SQLite-backed pyodbc stand-in for the
+database, writes a JSON report and compares it with a stored baseline.
+
+    python benchmarks/run_benchmarks.py                 # full run, compare with baseline
+    python benchmarks/run_benchmarks.py --quick         # smaller schemas / results
+    python benchmarks/run_benchmarks.py --update-baseline
+
+Exits with status 1 when a benchmark is slower than baseline * (1 + tolerance)
+and by more than --min-delta seconds.
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+WORK_DIR = tempfile.mkdtemp(prefix="sqlchatbot-bench-")
+
+# Isolate every on-disk cache and force the offline embedder before the app modules load
+os.environ["SCHEMA_CACHE_DIR"] = os.path.join(WORK_DIR, "cache")
+os.environ["SQL_CACHE_PATH"] = os.path.join(WORK_DIR, "cache", "sql_cache.sqlite3")
+os.environ["SCHEMA_EMBED_MODEL"] = ""
+os.environ["TELEMETRY_PATH"] = os.path.join(WORK_DIR, "spans.jsonl")
+sys.path[:0] = [ROOT, BENCH_DIR]
+
+import connect  # noqa: E402
+import helper  # noqa: E402
+import local_store  # noqa: E402
+import pool  # noqa: E402
+import result_cache  # noqa: E402
+import schema_cache  # noqa: E402
+import schema_index  # noqa: E402
+import sql_cache  # noqa: E402
+from fake_llm import FakeSQLChatModel  # noqa: E402
+from sqlite_adapter import DATABASE_NAME, build_synthetic_database, connect_sqlite  # noqa: E402
+
+BASELINE_PATH = os.path.join(BENCH_DIR, "baseline.json")
+
+SCHEMA_SIZES = [10, 100, 1000, 10000]
+QUICK_SCHEMA_SIZES = [10, 100, 1000]
+RESULT_SIZES = [100, 10_000, 100_000]
+QUICK_RESULT_SIZES = [100, 10_000]
+
+
+def measure(fn, repeat):
+    """Runs fn ``repeat`` times; returns the median seconds and the last return value."""
+    timings, value = [], None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        value = fn()
+        timings.append(time.perf_counter() - started)
+    return statistics.median(timings), value
+
+
+def reset_caches():
+    """Forgets every process-wide cache so the next call is a cold one."""
+    shutil.rmtree(os.environ["SCHEMA_CACHE_DIR"], ignore_errors=True)
+    schema_cache._snapshots.clear()
+    schema_index._indexes.clear()
+    sql_cache._shared_cache = None
+    local_store._stores.clear()
+    result_cache._shared_cache = None
+
+
+def make_database(tables, order_rows=0):
+    path = os.path.join(WORK_DIR, f"db_{tables}_{order_rows}.sqlite")
+    if not os.path.exists(path):
+        build_synthetic_database(path, tables, order_rows=order_rows)
+    return path
+
+
+def make_bot(path, llm=None, background=False):
+    conn_pool = pool.ConnectionPool(lambda: connect_sqlite(path), name=f"sqlite:{os.path.basename(path)}")
+    return helper.SQLChatBot("bench", DATABASE_NAME, "bench", "bench",
+                             llm=llm or FakeSQLChatModel(), conn=conn_pool, background=background)
+
+
+def bench_startup(sizes, repeat):
+    """Import cost of the app modules (in a fresh interpreter) and time to interactive after connecting."""
+    results = {}
+
+    def run_python(code):
+        subprocess.run([sys.executable, "-c", code], cwd=ROOT, check=True)
+
+    interpreter, _ = measure(lambda: run_python("pass"), repeat)
+    for module in ("connect", "helper"):
+        seconds, _ = measure(lambda: run_python(f"import {module}"), repeat)
+        results[f"import[{module}]"] = {"seconds": max(seconds - interpreter, 0.0)}
+
+    for tables in sizes:
+        path = make_database(tables)
+        interactive, ready = [], []
+        for _ in range(repeat if tables < 10000 else 1):
+            reset_caches()
+            started = time.perf_counter()
+            bot = make_bot(path, background=True)
+            bot.schema_loader.usable_tables()
+            interactive.append(time.perf_counter() - started)
+            bot.schema_loader.wait()
+            ready.append(time.perf_counter() - started)
+        results[f"time_to_interactive[{tables}]"] = {"seconds": statistics.median(interactive)}
+        results[f"time_to_schema_ready[{tables}]"] = {"seconds": statistics.median(ready)}
+    return results
+
+
+def bench_schema_scan(sizes, repeat):
+    results = {}
+    for tables in sizes:
+        conn = connect_sqlite(make_database(tables))
+        stats = {}
+        seconds, _ = measure(
+            lambda: connect.get_database_schema_with_samples(conn, DATABASE_NAME, stats=stats),
+            repeat if tables < 10000 else 1
+        )
+        conn.close()
+        results[f"schema_scan[{tables}]"] = {"seconds": seconds, "round_trips": stats["round_trips"],
+                                             "tables": stats["tables"]}
+    return results
+
+
+def bench_init(sizes, repeat):
+    results = {}
+    for tables in sizes:
+        path = make_database(tables)
+
+        def cold():
+            reset_caches()
+            return make_bot(path)
+
+        cold_seconds, _ = measure(cold, repeat if tables < 10000 else 1)
+        warm_seconds, _ = measure(lambda: make_bot(path), repeat)
+        results[f"init_cold[{tables}]"] = {"seconds": cold_seconds}
+        results[f"init_warm[{tables}]"] = {"seconds": warm_seconds}
+    return results
+
+
+def bench_execute(sizes, repeat):
+    results = {}
+    path = make_database(10, order_rows=max(sizes))
+    conn = connect_sqlite(path)
+    for rows in sizes:
+        seconds, frame = measure(
+            lambda: connect.ExecuteQuery(conn, f"SELECT TOP {rows} * FROM [dbo].[orders]", max_rows=None),
+            repeat
+        )
+        results[f"execute[{rows}]"] = {"seconds": seconds, "rows": len(frame),
+                                       "rows_per_second": len(frame) / seconds if seconds else None}
+    conn.close()
+    return results
+
+
+def bench_full_response(repeat, questions=20):
+    path = make_database(100, order_rows=10_000)
+    reset_caches()
+    bot = make_bot(path, FakeSQLChatModel(sql="SELECT TOP 1000 * FROM [dbo].[orders]"))
+
+    def cold():
+        sql_cache.get_sql_cache().entries.clear()
+        result_cache.get_result_cache().clear()
+        for i in range(questions):
+            bot.chat_history = []
+            bot.get_full_response(f"show order {i} details")
+
+    def warm():
+        for i in range(questions):
+            bot.chat_history = []
+            bot.get_full_response(f"show order {i} details")
+
+    cold_seconds, _ = measure(cold, repeat)
+    warm_seconds, _ = measure(warm, repeat)
+    return {
+        "full_response_cold": {"seconds": cold_seconds / questions, "questions": questions},
+        "full_response_warm": {"seconds": warm_seconds / questions, "questions": questions},
+        "llm_calls": {"calls": bot.llm.calls}
+    }
+
+
+def compare(report, baseline, tolerance, min_delta=0.0):
+    """
+    Returns a list of human-readable regressions. Slowdowns smaller than
+    ``min_delta`` seconds are ignored; sub-millisecond timings are mostly noise.
+    """
+    regressions = []
+    for name, current in report["benchmarks"].items():
+        previous = baseline.get("benchmarks", {}).get(name)
+        if not previous or "seconds" not in current or not previous.get("seconds"):
+            continue
+        ratio = current["seconds"] / previous["seconds"]
+        current["vs_baseline"] = round(ratio, 3)
+        if ratio > 1 + tolerance and current["seconds"] - previous["seconds"] > min_delta:
+            regressions.append(f"{name}: {current['seconds'] * 1000:.1f} ms vs "
+                               f"{previous['seconds'] * 1000:.1f} ms baseline ({ratio:.2f}x)")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--quick", action="store_true", help="skip the largest schema and result sizes")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per benchmark (median is reported)")
+    parser.add_argument("--output", default="bench_report.json", help="where to write the JSON report")
+    parser.add_argument("--baseline", default=BASELINE_PATH, help="baseline report to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed slowdown before failing")
+    parser.add_argument("--min-delta", type=float, default=0.001,
+                        help="ignore slowdowns smaller than this many seconds")
+    parser.add_argument("--update-baseline", action="store_true", help="store this run as the new baseline")
+    args = parser.parse_args()
+
+    schema_sizes = QUICK_SCHEMA_SIZES if args.quick else SCHEMA_SIZES
+    result_sizes = QUICK_RESULT_SIZES if args.quick else RESULT_SIZES
+
+    benchmarks = {}
+    try:
+        benchmarks.update(bench_schema_scan(schema_sizes, args.repeat))
+        benchmarks.update(bench_init(schema_sizes, args.repeat))
+        benchmarks.update(bench_startup(schema_sizes, args.repeat))
+        benchmarks.update(bench_execute(result_sizes, args.repeat))
+        benchmarks.update(bench_full_response(args.repeat))
+    finally:
+        shutil.rmtree(WORK_DIR, ignore_errors=True)
+
+    report = {
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "environment": {"python": platform.python_version(), "platform": platform.platform(),
+                        "quick": args.quick},
+        "benchmarks": benchmarks
+    }
+
+    regressions = []
+    if not args.update_baseline and os.path.exists(args.baseline):
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            regressions = compare(report, json.load(f), args.tolerance, args.min_delta)
+
+    with open(args.update_baseline and args.baseline or args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+
+    print("\n📊 Benchmark results")
+    for name, values in benchmarks.items():
+        if "seconds" in values:
+            note = f"  ({values['vs_baseline']:.2f}x baseline)" if "vs_baseline" in values else ""
+            print(f"  {name:<28} {values['seconds'] * 1000:10.2f} ms{note}")
+    if regressions:
+        print("\n❌ Regressions:")
+        for line in regressions:
+            print(f"  {line}")
+        sys.exit(1)
+    print("\n✅ No regressions" if os.path.exists(args.baseline) else "\nℹ️ No baseline to compare with")
+
+
+if __name__ == "__main__":
+    main()
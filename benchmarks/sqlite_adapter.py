@@ -0,0 +1,264 @@
+"""
+pyodbc-compatible stand-in for SQL Server backed by SQLite, for offline benchmarks.
+
+User tables live in a SQLite file attached as ``dbo``, so T-SQL names such as
+``[dbo].[orders]`` resolve natively. ``TOP n`` is rewritten to ``LIMIT n``,
+``USE`` and ``SET LOCK_TIMEOUT`` are ignored, ``TABLESAMPLE`` is dropped, and
+the catalog queries issued by connect.py and schema_cache.py are answered
+from sqlite_master / PRAGMA output. SQLite keeps no column statistics, so
+the histogram query returns no rows and every column is profiled from
+sample reads.
+
+``SET SHOWPLAN_XML ON`` is emulated for query_guard.py: each statement returns
+a minimal showplan document whose row estimate is the statement's actual
+row count and whose cost grows linearly with it.
+"""
+import re
+import sqlite3
+from xml.sax.saxutils import quoteattr
+
+import connect
+import schema_cache
+
+DATABASE_NAME = "bench"
+MODIFY_DATE = "2024-01-01T00:00:00"
+
+_TOP = re.compile(r"^\s*SELECT\s+TOP\s*\(?\s*(\d+)\s*\)?\s+(.*)$", re.IGNORECASE | re.DOTALL)
+_USE = re.compile(r"^\s*USE\s+\[?[^\]\s;]+\]?\s*;?\s*$", re.IGNORECASE)
+_LOCK_TIMEOUT = re.compile(r"^\s*SET\s+LOCK_TIMEOUT\s+-?\d+\s*;?\s*$", re.IGNORECASE)
+_TABLESAMPLE = re.compile(r"\s+TABLESAMPLE\s*\([^)]*\)", re.IGNORECASE)
+_DECL_LENGTH = re.compile(r"\((\d+)(?:\s*,\s*(\d+))?\)")
+_SHOWPLAN = re.compile(r"^\s*SET\s+SHOWPLAN_XML\s+(ON|OFF)\s*;?\s*$", re.IGNORECASE)
+
+SHOWPLAN_TEMPLATE = (
+    '<ShowPlanXML xmlns="http://schemas.microsoft.com/sqlserver/2004/07/showplan"><BatchSequence><Batch>'
+    '<Statements><StmtSimple StatementText={text} StatementType={kind} StatementEstRows="{rows}" '
+    'StatementSubTreeCost="{cost}"/></Statements></Batch></BatchSequence></ShowPlanXML>'
+)
+# Optimizer cost units per estimated row in the emulated plans
+SHOWPLAN_COST_PER_ROW = 0.001
+
+
+def _sql_server_type(declared):
+    """Maps a SQLite declared type to (type name, max_length, precision, scale)."""
+    declared = (declared or "").upper()
+    sizes = _DECL_LENGTH.search(declared)
+    if declared.startswith(("DECIMAL", "NUMERIC")):
+        precision, scale = (int(sizes.group(1)), int(sizes.group(2) or 0)) if sizes else (18, 2)
+        return "decimal", 9, precision, scale
+    if "INT" in declared:
+        return "int", 4, 10, 0
+    if declared.startswith(("REAL", "FLOAT", "DOUBLE")):
+        return "float", 8, 53, 0
+    if declared.startswith(("DATE", "TIME")):
+        return "datetime", 8, 23, 3
+    length = int(sizes.group(1)) if sizes else 200
+    return "nvarchar", length * 2, 0, 0
+
+
+def _split_statements(sql):
+    """Splits a batch on semicolons outside string literals."""
+    statements, current, in_string = [], [], False
+    for char in sql:
+        if char == "'":
+            in_string = not in_string
+        if char == ";" and not in_string:
+            statements.append("".join(current))
+            current = []
+        else:
+            current.append(char)
+    statements.append("".join(current))
+    return [s.strip() for s in statements if s.strip()]
+
+
+class SQLiteCursor:
+    """The subset of the pyodbc cursor API the chatbot uses."""
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.description = None
+        self.rowcount = -1
+        self._results = []
+        self._rows = []
+        self._pos = 0
+
+    # --- result-set plumbing -------------------------------------------------
+    def _set_results(self, results):
+        self._results = results
+        self._activate()
+
+    def _activate(self):
+        if not self._results:
+            self.description, self._rows, self._pos = None, [], 0
+            return False
+        names, rows, rowcount = self._results.pop(0)
+        self._rows, self._pos, self.rowcount = rows, 0, rowcount
+        if names is None:
+            self.description = None
+        else:
+            self.description = [(name, self._type_of(rows, idx), None, None, None, None, True)
+                                for idx, name in enumerate(names)]
+        return True
+
+    @staticmethod
+    def _type_of(rows, idx):
+        for row in rows:
+            if row[idx] is not None:
+                return type(row[idx])
+        return str
+
+    # --- pyodbc API ----------------------------------------------------------
+    def execute(self, sql, params=()):
+        if not isinstance(params, (tuple, list)):
+            params = (params,)
+        showplan = _SHOWPLAN.match(sql)
+        if showplan:
+            self.connection.showplan = showplan.group(1).upper() == "ON"
+            self._set_results([])
+            return self
+        catalog = self.connection.catalog_results(sql)
+        if catalog is not None:
+            self._set_results(catalog)
+            return self
+
+        results = []
+        for statement in _split_statements(sql):
+            if _USE.match(statement) or _LOCK_TIMEOUT.match(statement):
+                continue
+            statement = _TABLESAMPLE.sub("", statement)
+            match = _TOP.match(statement)
+            if match:
+                statement = f"SELECT {match.group(2)} LIMIT {match.group(1)}"
+            if self.connection.showplan:
+                results.append((["Microsoft SQL Server 2005 XML Showplan"], [(self.connection.plan(statement),)], -1))
+                continue
+            cursor = self.connection.raw.execute(statement, params)
+            if cursor.description is None:
+                results.append((None, [], cursor.rowcount))
+            else:
+                results.append(([d[0] for d in cursor.description], cursor.fetchall(), -1))
+        self._set_results(results)
+        return self
+
+    def fetchall(self):
+        rows = self._rows[self._pos:]
+        self._pos = len(self._rows)
+        return rows
+
+    def fetchmany(self, size=1):
+        rows = self._rows[self._pos:self._pos + size]
+        self._pos += len(rows)
+        return rows
+
+    def fetchone(self):
+        rows = self.fetchmany(1)
+        return rows[0] if rows else None
+
+    def nextset(self):
+        return self._activate()
+
+    def cancel(self):
+        self._results, self._rows = [], []
+
+    def close(self):
+        self._results, self._rows = [], []
+
+
+class SQLiteConnection:
+    """pyodbc.Connection look-alike over a SQLite file attached as ``dbo``."""
+
+    def __init__(self, path):
+        self.raw = sqlite3.connect(":memory:", check_same_thread=False, isolation_level=None)
+        self.raw.execute("ATTACH DATABASE ? AS dbo", (path,))
+        self.closed = False
+        self.showplan = False
+
+    def cursor(self):
+        if self.closed:
+            raise sqlite3.ProgrammingError("connection is closed")
+        return SQLiteCursor(self)
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        self.closed = True
+        self.raw.close()
+
+    def plan(self, statement):
+        """Showplan XML for one statement, estimating its rows by counting them."""
+        kind = statement.split(None, 1)[0].upper() if statement.strip() else "SELECT"
+        rows = 0
+        if kind == "SELECT":
+            rows = self.raw.execute(f"SELECT COUNT(*) FROM ({statement})").fetchone()[0]
+        return SHOWPLAN_TEMPLATE.format(text=quoteattr(statement), kind=quoteattr(kind), rows=rows,
+                                        cost=0.0033 + rows * SHOWPLAN_COST_PER_ROW)
+
+    # --- catalog emulation ---------------------------------------------------
+    def _tables(self):
+        return [row[0] for row in self.raw.execute(
+            "SELECT name FROM dbo.sqlite_master WHERE type = 'table' ORDER BY name"
+        )]
+
+    def catalog_results(self, sql):
+        """Result sets for the known catalog queries, or None for ordinary SQL."""
+        text = sql.strip()
+        if text == (connect.CATALOG_COLUMNS_SQL + connect.CATALOG_FOREIGN_KEYS_SQL).strip():
+            columns, foreign_keys = [], []
+            for table in self._tables():
+                for _, name, declared, _, _, pk in self.raw.execute(f"PRAGMA dbo.table_info([{table}])"):
+                    type_name, max_length, precision, scale = _sql_server_type(declared)
+                    # table_info's pk is the column's position in the key, like key_ordinal
+                    columns.append(("dbo", table, name, type_name, max_length, precision, scale, pk))
+                for fk in self.raw.execute(f"PRAGMA dbo.foreign_key_list([{table}])"):
+                    foreign_keys.append(("dbo", table, fk[3], "dbo", fk[2], fk[4]))
+            return [(["schema", "table", "column", "type", "max_length", "precision", "scale", "pk_ordinal"], columns, -1),
+                    (["schema", "table", "column", "ref_schema", "ref_table", "ref_column"], foreign_keys, -1)]
+        if text == schema_cache.TABLE_VERSIONS_SQL.strip():
+            return [(["schema", "table", "modify_date"],
+                     [("dbo", table, MODIFY_DATE) for table in self._tables()], -1)]
+        if text == connect.PROFILE_ROW_COUNTS_SQL.strip():
+            return [(["schema", "table", "rows"],
+                     [("dbo", table, self.raw.execute(f"SELECT COUNT(*) FROM dbo.[{table}]").fetchone()[0])
+                      for table in self._tables()], -1)]
+        if text == connect.PROFILE_HISTOGRAMS_SQL.strip():
+            return [(["schema", "table", "column", "rows", "distinct", "step", "last_step", "top_rank", "key",
+                      "equal_rows"], [], -1)]
+        if text == connect.USER_DATABASES_SQL.strip():
+            return [(["name"], [(DATABASE_NAME,)], -1)]
+        return None
+
+
+def connect_sqlite(path):
+    """Factory with the same contract as connect.connect_to_database."""
+    return SQLiteConnection(path)
+
+
+def build_synthetic_database(path, tables, rows_per_table=3, order_rows=0):
+    """
+    Creates ``tables`` linked tables (each referencing the previous one) with a
+    few rows each, plus an ``orders`` table of ``order_rows`` rows for query
+    benchmarks.
+    """
+    raw = sqlite3.connect(path, isolation_level=None)
+    raw.execute("BEGIN")
+    for i in range(tables):
+        parent = f", parent_id INTEGER REFERENCES t_{i - 1:05d}(id)" if i else ""
+        raw.execute(f"CREATE TABLE t_{i:05d} (id INTEGER PRIMARY KEY, name VARCHAR(50), "
+                    f"amount DECIMAL(10,2), created DATETIME{parent})")
+        raw.executemany(
+            f"INSERT INTO t_{i:05d} (id, name, amount, created) VALUES (?, ?, ?, ?)",
+            [(r, f"name {r}", r * 1.5, "2024-01-01 00:00:00") for r in range(rows_per_table)]
+        )
+    raw.execute("CREATE TABLE orders (order_id INTEGER PRIMARY KEY, customer VARCHAR(50), "
+                "total DECIMAL(10,2), status VARCHAR(20))")
+    raw.executemany(
+        "INSERT INTO orders VALUES (?, ?, ?, ?)",
+        ((r, f"customer {r % 997}", (r % 1000) / 4 + 0.01, "shipped" if r % 3 else "open")
+         for r in range(order_rows))
+    )
+    raw.execute("COMMIT")
+    raw.close()
@@ -1,6 +1,17 @@
+import datetime
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from decimal import Decimal
+
 import pyodbc
 from tabulate import tabulate
-import pandas as pd
+
+from pool import ConnectionPool, borrow
+from telemetry import record_span, run_in_context
+from tsql import is_independent_read, split_batches, split_statements
+
 def connect_to_database(server, database, username, password, encrypt=True, trust_cert=True, driver="ODBC Driver 17 for SQL Server"):
     """
     Connects to a SQL Server instance using SQL Authentication.
@@ -156,141 +167,781 @@ def connect_to_database(server, database, username, password, encrypt=True, trus
 
 #     return schema_info
 
-def get_database_schema_with_samples(conn, database=None):
+# Set-based catalog queries. Both are sent as a single batch so a whole
+# database is described in one round trip, regardless of the table count.
+CATALOG_COLUMNS_SQL = """
+    SELECT s.name, t.name, c.name, ty.name,
+           c.max_length, c.precision, c.scale,
+           ISNULL(ic.key_ordinal, 0) AS pk_ordinal
+    FROM sys.tables t
+    JOIN sys.schemas s ON s.schema_id = t.schema_id
+    JOIN sys.columns c ON c.object_id = t.object_id
+    JOIN sys.types ty ON ty.user_type_id = c.user_type_id
+    LEFT JOIN sys.indexes i
+           ON i.object_id = t.object_id AND i.is_primary_key = 1
+    LEFT JOIN sys.index_columns ic
+           ON ic.object_id = i.object_id AND ic.index_id = i.index_id
+          AND ic.column_id = c.column_id
+    WHERE t.is_ms_shipped = 0
+    ORDER BY s.name, t.name, c.column_id;
+"""
+
+CATALOG_FOREIGN_KEYS_SQL = """
+    SELECT ps.name, pt.name, pc.name, rs.name, rt.name, rc.name
+    FROM sys.foreign_key_columns fkc
+    JOIN sys.tables pt ON pt.object_id = fkc.parent_object_id
+    JOIN sys.schemas ps ON ps.schema_id = pt.schema_id
+    JOIN sys.columns pc ON pc.object_id = fkc.parent_object_id
+                       AND pc.column_id = fkc.parent_column_id
+    JOIN sys.tables rt ON rt.object_id = fkc.referenced_object_id
+    JOIN sys.schemas rs ON rs.schema_id = rt.schema_id
+    JOIN sys.columns rc ON rc.object_id = fkc.referenced_object_id
+                       AND rc.column_id = fkc.referenced_column_id
+    ORDER BY ps.name, pt.name, fkc.constraint_object_id, fkc.constraint_column_id;
+"""
+
+USER_DATABASES_SQL = """
+    SELECT name
+    FROM sys.databases
+    WHERE name NOT IN ('master', 'tempdb', 'model', 'msdb');  -- Exclude system DBs
+"""
+
+# Catalog statistics for profiling, two statements per database: row counts
+# from the partition stats, then for every column leading a statistics object
+# (the most thoroughly sampled one) a summary of its histogram: the distinct
+# estimate, the first and last step (min / max) and the steps with the most
+# equal rows (top values). Needs sys.dm_db_stats_histogram (SQL Server 2016
+# SP1 CU2+); older servers fall back to row counts only.
+PROFILE_ROW_COUNTS_SQL = """
+    SELECT s.name, t.name, SUM(p.row_count)
+    FROM sys.dm_db_partition_stats p
+    JOIN sys.tables t ON t.object_id = p.object_id
+    JOIN sys.schemas s ON s.schema_id = t.schema_id
+    WHERE p.index_id IN (0, 1) AND t.is_ms_shipped = 0
+    GROUP BY s.name, t.name;
+"""
+
+PROFILE_HISTOGRAMS_SQL = """
+    WITH column_stats AS (
+        SELECT st.object_id, st.stats_id, sc.column_id, sp.rows,
+               ROW_NUMBER() OVER (PARTITION BY st.object_id, sc.column_id
+                                  ORDER BY sp.rows_sampled DESC, sp.last_updated DESC) AS pick
+        FROM sys.stats st
+        JOIN sys.stats_columns sc
+          ON sc.object_id = st.object_id AND sc.stats_id = st.stats_id AND sc.stats_column_id = 1
+        JOIN sys.tables t ON t.object_id = st.object_id AND t.is_ms_shipped = 0
+        CROSS APPLY sys.dm_db_stats_properties(st.object_id, st.stats_id) sp
+    ), steps AS (
+        SELECT cs.object_id, cs.column_id, cs.rows, h.step_number, h.range_high_key, h.equal_rows,
+               COUNT(*) OVER (PARTITION BY cs.object_id, cs.column_id)
+                 + SUM(h.distinct_range_rows) OVER (PARTITION BY cs.object_id, cs.column_id) AS distinct_estimate,
+               MAX(h.step_number) OVER (PARTITION BY cs.object_id, cs.column_id) AS last_step,
+               ROW_NUMBER() OVER (PARTITION BY cs.object_id, cs.column_id ORDER BY h.equal_rows DESC) AS top_rank
+        FROM column_stats cs
+        CROSS APPLY sys.dm_db_stats_histogram(cs.object_id, cs.stats_id) h
+        WHERE cs.pick = 1
+    )
+    SELECT s.name, t.name, c.name, st.rows, st.distinct_estimate, st.step_number, st.last_step,
+           st.top_rank, CONVERT(nvarchar(200), st.range_high_key, 121), st.equal_rows
+    FROM steps st
+    JOIN sys.tables t ON t.object_id = st.object_id
+    JOIN sys.schemas s ON s.schema_id = t.schema_id
+    JOIN sys.columns c ON c.object_id = st.object_id AND c.column_id = st.column_id
+    WHERE st.step_number = 1 OR st.step_number = st.last_step OR st.top_rank <= 3
+    ORDER BY s.name, t.name, c.name, st.step_number;
+"""
+
+# Rows read per table to profile the columns that have no statistics, and
+# the number of those (column-pruned) reads packed into one batch.
+PROFILE_SAMPLE_ROWS = 1000
+SAMPLE_BATCH_SIZE = 200
+# Tables above this many times PROFILE_SAMPLE_ROWS are read with TABLESAMPLE
+# (random pages) instead of their first rows.
+TABLESAMPLE_FACTOR = 10
+# Milliseconds a profiling read waits for a lock before giving up on the table.
+PROFILE_LOCK_TIMEOUT_MS = 1000
+# Seconds a single table's profiling read may take when it is retried alone.
+PROFILE_TABLE_TIMEOUT = 5.0
+PROFILE_TOP_VALUES = 3
+
+# Types never read for profiling (besides any (MAX) column)
+_UNPROFILED_TYPES = {"text", "ntext", "image", "xml", "geography", "geometry", "hierarchyid", "sql_variant",
+                     "binary", "varbinary", "timestamp", "rowversion"}
+_RANGE_TYPES = {"tinyint", "smallint", "int", "bigint", "decimal", "numeric", "float", "real", "money",
+                "smallmoney", "date", "datetime", "datetime2", "smalldatetime", "datetimeoffset", "time"}
+
+
+def _execute(cursor, sql, stats, params=()):
+    """Executes a statement and counts it as one round trip."""
+    stats["round_trips"] += 1
+    return cursor.execute(sql, params) if params else cursor.execute(sql)
+
+
+def _format_column(col_name, data_type, max_length, precision, scale):
+    """Renders one column line of the CREATE TABLE statement."""
+    if data_type in ("varchar", "nvarchar", "char", "nchar", "varbinary", "binary"):
+        if max_length == -1:
+            length = "MAX"
+        elif data_type in ("nvarchar", "nchar"):
+            length = max_length // 2  # sys.columns stores bytes, not characters
+        else:
+            length = max_length
+        return f"    [{col_name}] {data_type.upper()}({length})"
+    if data_type in ("decimal", "numeric"):
+        return f"    [{col_name}] {data_type.upper()}({precision},{scale})"
+    return f"    [{col_name}] {data_type.upper()}"
+
+
+def _build_ddl(schema, table, columns, pk_cols, fks):
     """
-    Returns a dictionary with fully qualified table names (schema.table) as keys, and values as:
-    - 'schema': SQL Server-style CREATE TABLE statement
-    - 'sample_rows': up to 3 row dictionaries per table
-    If database is None, scans all databases.
+    Builds the SQL Server-style CREATE TABLE statement for a table.
+
+    Args:
+        schema (str): Schema name
+        table (str): Table name
+        columns (list): (name, type, max_length, precision, scale) tuples
+        pk_cols (list): Primary key column names, in key order
+        fks (list): (column, ref_schema, ref_table, ref_column) tuples
     """
-    schema_info = {}
-    cursor = conn.cursor()
+    lines = [_format_column(*col) for col in columns]
+    if pk_cols:
+        lines.append("    PRIMARY KEY (" + ", ".join(f"[{c}]" for c in pk_cols) + ")")
+    for col, ref_schema, ref_table, ref_col in fks:
+        lines.append(f"    FOREIGN KEY ([{col}]) REFERENCES {ref_schema}.{ref_table}([{ref_col}])")
+    return f"CREATE TABLE {schema}.{table} (\n" + ",\n".join(lines) + "\n);"
+
 
+def _fetch_catalog(cursor, stats):
+    """
+    Reads columns, types, primary keys and foreign keys of the current database
+    in a single batch.
+
+    Returns:
+        tuple: (tables, foreign_keys) where tables maps (schema, table) to
+        {"columns": [...], "pk": [...]} and foreign_keys maps (schema, table)
+        to a list of (column, ref_schema, ref_table, ref_column).
+    """
+    _execute(cursor, CATALOG_COLUMNS_SQL + CATALOG_FOREIGN_KEYS_SQL, stats)
+
+    tables = {}
+    for schema, table, col, data_type, max_length, precision, scale, pk_ordinal in cursor.fetchall():
+        entry = tables.setdefault((schema, table), {"columns": [], "pk": []})
+        entry["columns"].append((col, data_type, max_length, precision, scale))
+        if pk_ordinal:
+            entry["pk"].append((pk_ordinal, col))
+    # Rows come in column order; a composite key is listed in key order
+    for entry in tables.values():
+        entry["pk"] = [col for _, col in sorted(entry["pk"])]
+
+    foreign_keys = {}
+    if cursor.nextset():
+        for schema, table, col, ref_schema, ref_table, ref_col in cursor.fetchall():
+            foreign_keys.setdefault((schema, table), []).append((col, ref_schema, ref_table, ref_col))
+
+    return tables, foreign_keys
+
+
+def _profiled_columns(columns):
+    """Names and types of the columns worth profiling: no LOBs, no binary or spatial data."""
+    return [(name, data_type) for name, data_type, max_length, _, _ in columns
+            if max_length != -1 and data_type not in _UNPROFILED_TYPES]
+
+
+def _fetch_statistics(cursor, stats):
+    """
+    Reads row counts and histogram summaries of the current database.
+
+    Returns:
+        tuple: (row_counts, column_profiles) where row_counts maps (schema, table)
+        to a row count (empty when the login may not read them: counts are then
+        unknown) and column_profiles maps (schema, table) to {column: profile}
+        for the columns that have statistics.
+    """
+    column_profiles = {}
     try:
-        # Get target databases
-        if database:
-            databases = [database]
-        else:
-            cursor.execute("""
-                SELECT name 
-                FROM sys.databases
-                WHERE name NOT IN ('master', 'tempdb', 'model', 'msdb');  -- Exclude system DBs
-            """)
-            databases = [row[0] for row in cursor.fetchall()]
-
-        for db_name in databases:
-            print(f"\n🔍 Scanning database: {db_name}")
+        # sys.dm_db_partition_stats needs VIEW DATABASE STATE
+        _execute(cursor, PROFILE_ROW_COUNTS_SQL, stats)
+        row_counts = {(schema, table): int(rows or 0) for schema, table, rows in cursor.fetchall()}
+    except Exception as e:
+        print(f"⚠️ Row counts unavailable, leaving them unknown: {e}")
+        row_counts = {}
+
+    try:
+        _execute(cursor, PROFILE_HISTOGRAMS_SQL, stats)
+        rows = cursor.fetchall()
+    except Exception as e:
+        print(f"⚠️ Column statistics unavailable, profiling from samples only: {e}")
+        return row_counts, column_profiles
+
+    for schema, table, column, total, distinct, step, last_step, top_rank, key, equal_rows in rows:
+        profile = column_profiles.setdefault((schema, table), {}).setdefault(column, {
+            "distinct": int(distinct or 0), "exact": False, "top": []
+        })
+        if key is None:
+            continue  # the NULL step
+        if step == 1:
+            profile["min"] = key
+        if step == last_step:
+            profile["max"] = key
+        if top_rank <= PROFILE_TOP_VALUES and equal_rows and total:
+            profile["top"].append([key, round(float(equal_rows) / float(total), 3)])
+    for profiles in column_profiles.values():
+        for profile in profiles.values():
+            profile["top"].sort(key=lambda item: -item[1])
+    return row_counts, column_profiles
+
+
+def _sample_sql(schema, table, columns, row_count, sample_rows):
+    names = ", ".join(f"[{name}]" for name in columns)
+    sample = (f" TABLESAMPLE ({sample_rows} ROWS)"
+              if row_count is not None and row_count > sample_rows * TABLESAMPLE_FACTOR else "")
+    return f"SELECT TOP ({sample_rows}) {names} FROM [{schema}].[{table}]{sample};"
+
+
+def _profile_from_rows(values, data_type, complete):
+    """
+    Profile of one column from sampled values; ``complete`` when the sample
+    is the whole table. Values are kept as text, like the statistics ones.
+    """
+    counts = Counter(values)
+    nulls = counts.pop(None, 0)
+    profile = {"distinct": len(counts), "exact": complete}
+    if counts:
+        top = counts.most_common(PROFILE_TOP_VALUES)
+        if top[0][1] == 1:
+            top = top[:1]  # every value unique: one example is enough
+        profile["top"] = [[str(value), round(count / len(values), 3)] for value, count in top]
+        if data_type in _RANGE_TYPES:
+            try:
+                profile["min"], profile["max"] = str(min(counts)), str(max(counts))
+            except TypeError:
+                pass
+    if nulls:
+        profile["nulls"] = round(nulls / len(values), 3)
+    return profile
+
+
+def _fetch_profiles(cursor, plan, stats, sample_rows=PROFILE_SAMPLE_ROWS, on_batch=None):
+    """
+    Reads sample rows for the columns that have no statistics and profiles
+    them. ``plan`` is a list of ((schema, table), [(column, type)], row_count).
+    Each read selects only those columns, uses TABLESAMPLE on large tables and
+    gives up on a lock after PROFILE_LOCK_TIMEOUT_MS. Many reads are packed
+    into one batch walked with nextset(); a batch that fails is retried table
+    by table with a PROFILE_TABLE_TIMEOUT each. ``on_batch`` is called with
+    {(schema, table): {column: profile}} after every batch.
+
+    Returns:
+        dict: (schema, table) -> {column: profile}
+    """
+    profiles = {}
+
+    def profile_rows(key, columns, row_count, rows):
+        complete = len(rows) < sample_rows or (row_count is not None and len(rows) >= row_count)
+        if not rows:
+            profiles[key] = {name: {"distinct": 0, "exact": complete} for name, _ in columns}
+            return
+        profiles[key] = {
+            name: _profile_from_rows(values, data_type, complete)
+            for (name, data_type), values in zip(columns, zip(*rows))
+        }
+
+    _execute(cursor, f"SET LOCK_TIMEOUT {PROFILE_LOCK_TIMEOUT_MS}", stats)
+    try:
+        for start in range(0, len(plan), SAMPLE_BATCH_SIZE):
+            chunk = plan[start:start + SAMPLE_BATCH_SIZE]
+            batch = "\n".join(_sample_sql(*key, [name for name, _ in columns], row_count, sample_rows)
+                              for key, columns, row_count in chunk)
             try:
-                cursor.execute(f"USE [{db_name}]")
-
-                cursor.execute("""
-                    SELECT TABLE_SCHEMA, TABLE_NAME
-                    FROM INFORMATION_SCHEMA.TABLES
-                    WHERE TABLE_TYPE = 'BASE TABLE'
-                    ORDER BY TABLE_SCHEMA, TABLE_NAME;
-                """)
-                tables = cursor.fetchall()
-
-                for schema, table in tables:
-                    full_table_name = f"{db_name}.{schema}.{table}"
-                    print(f"📄 Processing table: {full_table_name}")
-
-                    # Get column definitions
-                    cursor.execute("""
-                        SELECT COLUMN_NAME, DATA_TYPE, CHARACTER_MAXIMUM_LENGTH,
-                               NUMERIC_PRECISION, NUMERIC_SCALE
-                        FROM INFORMATION_SCHEMA.COLUMNS
-                        WHERE TABLE_SCHEMA = ? AND TABLE_NAME = ?
-                        ORDER BY ORDINAL_POSITION;
-                    """, (schema, table))
-                    columns = cursor.fetchall()
-
-                    ddl = f"CREATE TABLE {schema}.{table} (\n"
-                    col_defs = []
-
-                    for col_name, data_type, char_len, num_precision, num_scale in columns:
-                        if data_type in ("varchar", "nvarchar", "char", "nchar"):
-                            col_def = f"    [{col_name}] {data_type.upper()}({char_len})"
-                        elif data_type in ("decimal", "numeric"):
-                            col_def = f"    [{col_name}] {data_type.upper()}({num_precision},{num_scale})"
-                        else:
-                            col_def = f"    [{col_name}] {data_type.upper()}"
-                        col_defs.append(col_def)
-
-                    ddl += ",\n".join(col_defs) + "\n);"
-
-                    # Fetch sample rows
+                _execute(cursor, batch, stats)
+                for idx, (key, columns, row_count) in enumerate(chunk):
+                    if idx and not cursor.nextset():
+                        break
+                    profile_rows(key, columns, row_count, cursor.fetchall())
+            except Exception as batch_err:
+                print(f"⚠️ Profile batch failed, retrying per table: {batch_err}")
+                for key, columns, row_count in chunk:
+                    if key in profiles:
+                        continue
+                    timed_out = threading.Event()
+                    timer = _cancel_timer(cursor, PROFILE_TABLE_TIMEOUT, timed_out)
                     try:
-                        cursor.execute(f"SELECT TOP 3 * FROM [{schema}].[{table}]")
-                        rows = cursor.fetchall()
-                        col_names = [desc[0] for desc in cursor.description]
-                        sample_rows = [dict(zip(col_names, row)) for row in rows]
+                        _execute(cursor, _sample_sql(*key, [name for name, _ in columns], row_count, sample_rows),
+                                 stats)
+                        profile_rows(key, columns, row_count, cursor.fetchall())
                     except Exception as fetch_err:
-                        sample_rows = []
-                        print(f"⚠️ Could not fetch rows from {full_table_name}: {fetch_err}")
+                        profiles[key] = {}
+                        reason = f"timed out after {PROFILE_TABLE_TIMEOUT:g}s" if timed_out.is_set() else fetch_err
+                        print(f"⚠️ Could not profile {key[0]}.{key[1]}: {reason}")
+                    finally:
+                        timer.cancel()
+            if on_batch is not None:
+                on_batch({key: profiles.get(key, {}) for key, _, _ in chunk})
+    finally:
+        _execute(cursor, "SET LOCK_TIMEOUT -1", stats)
+    return profiles
+
+
+def _introspect_database(cursor, db_name, stats, sample_size=PROFILE_SAMPLE_ROWS, only_tables=None,
+                         on_progress=None):
+    """
+    Describes the user tables of the database the cursor points at. The
+    catalog batch always covers the whole database; ``only_tables`` (a set
+    of (schema, table)) limits which tables are profiled and returned.
+
+    Each table gets a "profile": its row count and per-column summaries,
+    taken from the optimizer statistics where they exist and from a
+    ``sample_size``-row read of the remaining columns otherwise (0 disables
+    profiling).
+
+    ``on_progress(schema_info, profiled)`` is called once every table has its
+    DDL (right after the catalog batch), after the statistics batch and
+    after each sample batch. Entries are replaced, never mutated, so a copy
+    of ``schema_info`` taken in the callback stays consistent.
+    """
+    tables, foreign_keys = _fetch_catalog(cursor, stats)
+    table_keys = [key for key in tables if only_tables is None or key in only_tables]
 
-                    schema_info[full_table_name] = {
-                        "schema": ddl,
-                        "sample_rows": sample_rows
-                    }
+    schema_info = {}
+    for schema, table in table_keys:
+        entry = tables[(schema, table)]
+        schema_info[f"{db_name}.{schema}.{table}"] = {
+            "schema": _build_ddl(schema, table, entry["columns"], entry["pk"],
+                                 foreign_keys.get((schema, table), [])),
+            "profile": None
+        }
+
+    profiled = 0
+    if on_progress is not None:
+        on_progress(schema_info, profiled)
+    if not sample_size:
+        return schema_info
+
+    def set_profile(key, rows, columns):
+        name = f"{db_name}.{key[0]}.{key[1]}"
+        schema_info[name] = {"schema": schema_info[name]["schema"], "profile": {"rows": rows, "columns": columns}}
+
+    row_counts, column_profiles = _fetch_statistics(cursor, stats)
+    plan = []
+    for key in table_keys:
+        from_statistics = column_profiles.get(key, {})
+        missing = [col for col in _profiled_columns(tables[key]["columns"]) if col[0] not in from_statistics]
+        set_profile(key, row_counts.get(key), from_statistics)
+        if missing and row_counts.get(key) != 0:
+            plan.append((key, missing, row_counts.get(key)))
+        else:
+            profiled += 1
+    if on_progress is not None:
+        on_progress(schema_info, profiled)
+
+    def add_profiles(batch):
+        nonlocal profiled
+        for key, columns in batch.items():
+            merged = {**columns, **column_profiles.get(key, {})}
+            order = [name for name, *_ in tables[key]["columns"]]
+            set_profile(key, row_counts.get(key), {name: merged[name] for name in order if name in merged})
+        profiled += len(batch)
+        if on_progress is not None:
+            on_progress(schema_info, profiled)
+
+    if plan:
+        _fetch_profiles(cursor, plan, stats, sample_size, on_batch=add_profiles)
+    return schema_info
 
-            except Exception as db_err:
-                print(f"❌ Failed to process database {db_name}: {db_err}")
 
-    except Exception as e:
-        print("❌ Unexpected error:", e)
+def _scan_with_own_connection(conn_factory, db_name, sample_size):
+    """Worker: opens a dedicated connection to one database and scans it."""
+    stats = {"round_trips": 0}
+    conn = conn_factory(db_name)
+    if conn is None:
+        raise ConnectionError(f"Could not open a connection to database '{db_name}'")
+    try:
+        return _introspect_database(conn.cursor(), db_name, stats, sample_size), stats
+    finally:
+        conn.close()
+
+
+def get_database_schema_with_samples(conn, database=None, conn_factory=None, max_workers=4,
+                                     sample_size=PROFILE_SAMPLE_ROWS, stats=None, tables=None, on_progress=None):
+    """
+    Returns a dictionary with fully qualified table names (db.schema.table) as keys, and values as:
+    - 'schema': SQL Server-style CREATE TABLE statement (with primary and foreign keys)
+    - 'profile': {"rows": row count, "columns": {column: {"distinct", "exact", and when known
+      "min", "max", "top": [[value, share], ...], "nulls"}}}, or None when profiling is disabled
+    If database is None, scans all databases.
+
+    Each database is described with one set-based catalog batch, one batch
+    of catalog statistics and, for the columns without statistics, one
+    batch of column-pruned sample reads per SAMPLE_BATCH_SIZE tables. When several
+    databases are scanned and ``conn_factory`` is given, they are scanned
+    concurrently, each on its own connection.
+
+    Args:
+        conn: Active pyodbc connection or ConnectionPool
+        database (str): Database to scan, or None for every user database
+        conn_factory (callable): Optional ``f(db_name) -> connection`` used for parallel scans
+        max_workers (int): Maximum number of databases scanned at the same time
+        sample_size (int): Rows read per table to profile columns without statistics (0 disables profiling)
+        stats (dict): Optional dict that receives 'round_trips', 'databases', 'tables' and 'seconds'
+        tables (iterable): Optional (schema, table) pairs to limit a single-database scan to
+        on_progress (callable): Optional ``f(schema_info, sampled)`` for single-database
+            scans, called when the DDL of every table is known and as profiles arrive
+    """
+    schema_info = {}
+    stats = stats if stats is not None else {}
+    stats.update({"round_trips": 0, "databases": 0, "tables": 0, "seconds": 0.0})
+    started = time.perf_counter()
+    with borrow(conn) as conn:
+        cursor = conn.cursor()
+        only_tables = set(tables) if tables is not None else None
+
+        try:
+            # Get target databases
+            if database:
+                databases = [database]
+            else:
+                _execute(cursor, USER_DATABASES_SQL, stats)
+                databases = [row[0] for row in cursor.fetchall()]
+
+            if conn_factory is not None and len(databases) > 1:
+                with ThreadPoolExecutor(max_workers=max_workers) as pool:
+                    futures = {
+                        pool.submit(_scan_with_own_connection, conn_factory, db_name, sample_size): db_name
+                        for db_name in databases
+                    }
+                    for future in as_completed(futures):
+                        db_name = futures[future]
+                        try:
+                            db_info, db_stats = future.result()
+                            schema_info.update(db_info)
+                            stats["round_trips"] += db_stats["round_trips"]
+                            stats["databases"] += 1
+                        except Exception as db_err:
+                            print(f"❌ Failed to process database {db_name}: {db_err}")
+            else:
+                for db_name in databases:
+                    print(f"\n🔍 Scanning database: {db_name}")
+                    try:
+                        _execute(cursor, f"USE [{db_name}]", stats)
+                        schema_info.update(_introspect_database(cursor, db_name, stats, sample_size, only_tables,
+                                                                on_progress if len(databases) == 1 else None))
+                        stats["databases"] += 1
+                    except Exception as db_err:
+                        print(f"❌ Failed to process database {db_name}: {db_err}")
+
+        except Exception as e:
+            print("❌ Unexpected error:", e)
 
+    stats["tables"] = len(schema_info)
+    stats["seconds"] = time.perf_counter() - started
+    print(f"📚 Described {stats['tables']} tables in {stats['databases']} database(s) "
+          f"using {stats['round_trips']} round trips ({stats['seconds']:.2f}s)")
     return schema_info
 
 
 def ExecuteQueryInTables(conn, cleaned_query):
     """
-    Executes one or more SQL statements and prints result sets (if any) in tabular format.
-    
+    Executes one or more SQL statements and returns their result sets (if any) in tabular format.
+
     Args:
-        conn: Active pyodbc connection
-        cleaned_query: SQL script string with one or more queries separated by ';'
+        conn: Active pyodbc connection or ConnectionPool
+        cleaned_query: SQL script with one or more statements, batches separated by GO lines
     """
-    cursor = conn.cursor()
+    return format_results(ExecuteBatch(conn, cleaned_query))
+
+
+# Hard caps for interactive queries; a result hitting either is cut off and
+# flagged with result.attrs["truncated"] = True.
+MAX_RESULT_ROWS = 100_000
+MAX_RESULT_BYTES = 256 * 1024 * 1024
+FETCH_BATCH_SIZE = 5_000
 
-    # Split by semicolon but keep statements clean
-    queries = [q.strip() for q in cleaned_query.split(";") if q.strip()]
-    result_output = []
 
-    for idx, query in enumerate(queries, 1):
+def _to_column(values, type_code):
+    """
+    Converts one column of a fetched batch in a single step, using the Python
+    type pyodbc reports for it in cursor.description.
+    """
+    import numpy as np
+    import pandas as pd
+
+    has_nulls = any(v is None for v in values)
+    if type_code in (Decimal, float):
+        # Decimal -> float64 for the whole column, NULL -> NaN
+        return np.array(values, dtype=np.float64)
+    if type_code is int:
+        return pd.array(values, dtype="Int64") if has_nulls else np.array(values, dtype=np.int64)
+    if type_code is bool:
+        return pd.array(values, dtype="boolean") if has_nulls else np.array(values, dtype=bool)
+    if type_code in (datetime.datetime, datetime.date):
+        try:
+            return pd.to_datetime(pd.Series(values, dtype=object)).array
+        except (ValueError, OverflowError, pd.errors.OutOfBoundsDatetime):
+            pass  # e.g. datetime2 values before 1677; keep them as Python objects
+    return np.array(values, dtype=object)
+
+
+def _batch_to_frame(rows, columns, type_codes):
+    import numpy as np
+    import pandas as pd
+
+    if not rows:
+        return pd.DataFrame({name: np.array([], dtype=object) for name in columns}, columns=columns)
+    data = zip(*rows)
+    return pd.DataFrame(
+        {idx: _to_column(list(values), type_code) for idx, (values, type_code) in enumerate(zip(data, type_codes))}
+    ).set_axis(columns, axis=1)
+
+
+def iter_query_batches(conn, query, batch_size=FETCH_BATCH_SIZE):
+    """
+    Executes a query and yields its result as typed DataFrames of up to
+    ``batch_size`` rows, reading with fetchmany so callers can stream
+    results without holding them all in memory.
+
+    Args:
+        conn: Active pyodbc connection or ConnectionPool
+        query (str): SQL to execute
+        batch_size (int): Rows per fetchmany call
+    """
+    with borrow(conn) as conn:
+        cursor = conn.cursor()
         try:
             cursor.execute(query)
+            if cursor.description is None:
+                return
+            columns = [col[0] for col in cursor.description]
+            type_codes = [col[1] for col in cursor.description]
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                yield _batch_to_frame(rows, columns, type_codes)
+        finally:
+            cursor.close()
+
+
+def _cancel_timer(cursor, timeout, timed_out):
+    """Starts a daemon timer that cancels the cursor's statement after ``timeout`` seconds."""
+    def cancel():
+        timed_out.set()
+        try:
+            cursor.cancel()
+        except Exception:
+            pass
 
-            # Try to fetch rows only if the query returns rows
-            try:
-                rows = cursor.fetchall()
-                columns = [desc[0] for desc in cursor.description]
-                table = tabulate(rows, headers=columns, tablefmt="grid")
-                result_output.append(f"\n📄 Result {idx}:\n{table}")
-            except pyodbc.ProgrammingError:
-                # No result set (e.g., DDL or UPDATE/INSERT)
-                affected = cursor.rowcount
-                result_output.append(f"\n✅ Statement {idx} executed successfully. Rows affected: {affected}")
+    timer = threading.Timer(timeout, cancel)
+    timer.daemon = True
+    timer.start()
+    return timer
+
+
+def ExecuteQuery(conn, query, max_rows=MAX_RESULT_ROWS, max_bytes=MAX_RESULT_BYTES, batch_size=FETCH_BATCH_SIZE,
+                 on_cursor=None, timeout=None):
+    """
+    Executes a query and returns the result as a DataFrame.
+
+    Rows are read in fetchmany batches and converted column by column. Once
+    ``max_rows`` or ``max_bytes`` is reached the query is cancelled and the
+    DataFrame is returned with attrs["truncated"] set.
+
+    Args:
+        conn: Active pyodbc connection or ConnectionPool
+        query (str): SQL to execute
+        max_rows (int): Row cap, None for no limit
+        max_bytes (int): Approximate in-memory size cap, None for no limit
+        batch_size (int): Rows per fetchmany call
+        on_cursor (callable): Optional hook called with the cursor before the query
+            runs, so another thread can cancel it with cursor.cancel()
+        timeout (float): Seconds after which the statement is cancelled on the server
+            and TimeoutError is raised; None for no limit
+
+    Returns:
+        pandas.DataFrame with attrs 'truncated', 'rows', 'bytes' and 'seconds' (execution and fetch time)
+    """
+    # pandas is imported on first use so importing this module stays cheap
+    import pandas as pd
+
+    with borrow(conn) as conn:
+        cursor = conn.cursor()
+        if on_cursor is not None:
+            on_cursor(cursor)
+        timed_out = threading.Event()
+        timer = _cancel_timer(cursor, timeout, timed_out) if timeout else None
+        try:
+            started = time.perf_counter()
+            cursor.execute(query)
+            record_span("db.execute", time.perf_counter() - started)
+            if cursor.description is None:
+                # Statement without a result set (e.g. UPDATE); report the row count instead
+                result = pd.DataFrame()
+                result.attrs.update({"truncated": False, "rows": 0, "bytes": 0, "rows_affected": cursor.rowcount,
+                                     "seconds": time.perf_counter() - started})
+                return result
+
+            result = _fetch_frame(cursor, max_rows, max_bytes, batch_size)
+            result.attrs["seconds"] = time.perf_counter() - started
+            if timed_out.is_set():
+                raise TimeoutError(f"query cancelled after {timeout:g}s")
+            if result.attrs["truncated"]:
+                try:
+                    cursor.cancel()
+                except Exception:
+                    pass
         except Exception as e:
-            result_output.append(f"\n❌ Error in statement {idx}:\n{e}")
+            if timed_out.is_set() and not isinstance(e, TimeoutError):
+                raise TimeoutError(f"query cancelled after {timeout:g}s") from e
+            raise
+        finally:
+            if timer is not None:
+                timer.cancel()
+            cursor.close()
+    return result
 
-    return "\n".join(result_output)
-from decimal import Decimal
 
-def ExecuteQuery(conn, query):
-    cursor = conn.cursor()
-    cursor.execute(query)
+def _fetch_frame(cursor, max_rows, max_bytes, batch_size):
+    """
+    Reads the cursor's current result set into a DataFrame, in fetchmany
+    batches converted column by column, stopping at ``max_rows`` /
+    ``max_bytes``. Leaves the cursor on the same result set.
+    """
+    import pandas as pd
+
+    frames = []
+    total_rows = 0
+    total_bytes = 0
+    truncated = False
+    fetch_seconds = build_seconds = 0.0
     columns = [col[0] for col in cursor.description]
-    rows = cursor.fetchall()
-    cursor.close()
+    type_codes = [col[1] for col in cursor.description]
+    while True:
+        size = batch_size if max_rows is None else min(batch_size, max_rows - total_rows + 1)
+        started = time.perf_counter()
+        rows = cursor.fetchmany(size)
+        fetch_seconds += time.perf_counter() - started
+        if not rows:
+            break
+        if max_rows is not None and total_rows + len(rows) > max_rows:
+            rows = rows[:max_rows - total_rows]
+            truncated = True
+        started = time.perf_counter()
+        frame = _batch_to_frame(rows, columns, type_codes)
+        build_seconds += time.perf_counter() - started
+        frames.append(frame)
+        total_rows += len(frame)
+        total_bytes += int(frame.memory_usage(index=False, deep=True).sum())
+        if truncated or (max_bytes is not None and total_bytes >= max_bytes):
+            truncated = truncated or bool(cursor.fetchmany(1))
+            break
+
+    started = time.perf_counter()
+    if frames:
+        result = pd.concat(frames, ignore_index=True) if len(frames) > 1 else frames[0]
+    else:
+        result = _batch_to_frame([], columns, type_codes)
+    build_seconds += time.perf_counter() - started
+    record_span("db.fetch", fetch_seconds, rows=total_rows, bytes=total_bytes, truncated=truncated)
+    record_span("dataframe.build", build_seconds, rows=total_rows)
+    result.attrs.update({"truncated": truncated, "rows": total_rows, "bytes": total_bytes})
+    return result
+
+
+def _run_batch(conn, batch, batch_no, max_rows, max_bytes, batch_size, timeout):
+    """
+    Sends one batch in a single round trip and collects every result set with
+    nextset(). A failing statement ends the batch with an error entry, as it
+    does in SQL Server tools.
+    """
+    entries = []
 
-    # Convert Decimal to float in each row
-    cleaned_rows = []
-    for row in rows:
-        cleaned_row = [float(val) if isinstance(val, Decimal) else val for val in row]
-        cleaned_rows.append(cleaned_row)
+    def add(**entry):
+        entries.append({"batch": batch_no, "index": len(entries) + 1, "sql": batch, "result": None,
+                        "rows_affected": None, "error": None, **entry})
 
-    return pd.DataFrame(cleaned_rows, columns=columns)
+    with borrow(conn) as conn:
+        cursor = conn.cursor()
+        timed_out = threading.Event()
+        timer = _cancel_timer(cursor, timeout, timed_out) if timeout else None
+        try:
+            started = time.perf_counter()
+            cursor.execute(batch)
+            record_span("db.execute", time.perf_counter() - started, batch=batch_no)
+            while True:
+                if cursor.description is not None:
+                    add(result=_fetch_frame(cursor, max_rows, max_bytes, batch_size))
+                elif cursor.rowcount != -1:
+                    add(rows_affected=cursor.rowcount)
+                # nextset() also skips rows left behind by a truncated result
+                if not cursor.nextset():
+                    break
+        except Exception as e:
+            message = f"query cancelled after {timeout:g}s" if timed_out.is_set() else str(e)
+            add(error=message)
+        finally:
+            if timer is not None:
+                timer.cancel()
+            cursor.close()
+    return entries
+
+
+def ExecuteBatch(conn, script, parallel=False, max_workers=4, max_rows=MAX_RESULT_ROWS, max_bytes=MAX_RESULT_BYTES,
+                 batch_size=FETCH_BATCH_SIZE, timeout=None):
+    """
+    Executes a T-SQL script and returns every result set as structured data.
+
+    The script is split on GO lines (tsql.split_batches) and each batch is
+    sent once, its result sets read with cursor.nextset(). With
+    ``parallel=True`` and a ConnectionPool, a batch made only of independent
+    reads (tsql.is_independent_read) is split on its semicolons and the
+    statements run concurrently on pooled connections; results keep script
+    order.
+
+    Args:
+        conn: Active pyodbc connection or ConnectionPool
+        script (str): One or more batches / statements
+        parallel (bool): Run independent SELECTs of a batch concurrently
+        max_workers (int): Concurrent statements in parallel mode
+        max_rows, max_bytes, batch_size: Per result set, as in ExecuteQuery
+        timeout (float): Seconds after which a batch is cancelled; None for no limit
+
+    Returns:
+        list of dicts {"batch", "index", "sql", "result" (DataFrame or None),
+        "rows_affected", "error"}; format with format_results()
+    """
+    entries = []
+    for batch_no, batch in enumerate(split_batches(script), 1):
+        statements = split_statements(batch) if parallel and isinstance(conn, ConnectionPool) else [batch]
+        if len(statements) > 1 and all(is_independent_read(s) for s in statements):
+            with ThreadPoolExecutor(max_workers=min(max_workers, len(statements))) as executor:
+                runs = [
+                    executor.submit(run_in_context(_run_batch), conn, statement, batch_no, max_rows, max_bytes,
+                                    batch_size, timeout)
+                    for statement in statements
+                ]
+                batch_entries = [entry for run in runs for entry in run.result()]
+            for index, entry in enumerate(batch_entries, 1):
+                entry["index"] = index
+        else:
+            batch_entries = _run_batch(conn, batch, batch_no, max_rows, max_bytes, batch_size, timeout)
+        entries.extend(batch_entries)
+    return entries
+
+
+def format_results(entries):
+    """Renders ExecuteBatch entries as text, result sets as grid tables."""
+    output = []
+    for entry in entries:
+        label = f"{entry['batch']}.{entry['index']}"
+        if entry["error"] is not None:
+            output.append(f"\n❌ Error in batch {entry['batch']}:\n{entry['error']}")
+        elif entry["result"] is not None:
+            frame = entry["result"]
+            table = tabulate(frame.itertuples(index=False, name=None), headers=list(frame.columns), tablefmt="grid")
+            note = "\n(truncated)" if frame.attrs.get("truncated") else ""
+            output.append(f"\n📄 Result {label}:\n{table}{note}")
+        else:
+            output.append(f"\n✅ Statement {label} executed successfully. Rows affected: {entry['rows_affected']}")
+    return "\n".join(output)
 
 # import pandas as pd
 
@@ -302,18 +953,7 @@ def ExecuteQuery(conn, query):
 #     cursor.close()
 #     return pd.DataFrame(rows, columns=columns)
 
-server = "DESKTOP-EQGHQH9\\SQLEXPRESS"
-database = "master"
-username = 'sa'
-password = 'ssmsMurari@157'
-
-# # conn = connect_to_database(server, database, username, password)
-conn = connect_to_database(
-    server= server,
-    database= database,
-    username=username,
-    password=password
-)
+# conn = connect_to_database(server, database, username, password)
 
 # ExecuteQuery(query="SELECT name FROM sys.databases;")
 
@@ -324,4 +964,4 @@ conn = connect_to_database(
 #         print(info["schema"])
 #         print("🔍 Sample Rows:")
 #         for row in info["sample_rows"]:
-#             print(row)
\ No newline at end of file
+#             print(row)
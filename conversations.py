@@ -0,0 +1,65 @@
+import json
+import os
+import threading
+import time
+
+from local_store import get_local_store
+
+# Seconds of inactivity after which a client's conversation is forgotten.
+CONVERSATION_TTL = float(os.getenv("CONVERSATION_TTL", str(24 * 3600)))
+
+
+class ConversationStore:
+    """
+    Chat history per client id, so any worker process can continue a client's
+    conversation. Kept in the LocalStore when one is configured, otherwise in
+    process memory. History entries are the (role, text) pairs SQLChatBot uses.
+    """
+
+    STORE_NAMESPACE = "conversation"
+
+    def __init__(self, store=None, ttl=CONVERSATION_TTL):
+        self.store = store
+        self.ttl = ttl
+        self._memory = {}
+        self._lock = threading.Lock()
+
+    def load(self, client_id):
+        if self.store is not None:
+            data = self.store.get(self.STORE_NAMESPACE, client_id)
+            history = json.loads(data) if data else []
+        else:
+            with self._lock:
+                expires, history = self._memory.get(client_id, (0, []))
+                if expires < time.time():
+                    history = []
+        return [tuple(entry) for entry in history]
+
+    def save(self, client_id, history):
+        if self.store is not None:
+            self.store.put(self.STORE_NAMESPACE, client_id, json.dumps(history).encode("utf-8"), ttl=self.ttl)
+            return
+        with self._lock:
+            now = time.time()
+            self._memory = {key: value for key, value in self._memory.items() if value[0] >= now}
+            self._memory[client_id] = (now + self.ttl, list(history))
+
+    def clear(self, client_id):
+        if self.store is not None:
+            self.store.delete(self.STORE_NAMESPACE, client_id)
+            return
+        with self._lock:
+            self._memory.pop(client_id, None)
+
+
+_shared_store = None
+_shared_lock = threading.Lock()
+
+
+def get_conversation_store():
+    """Returns the process-wide ConversationStore."""
+    global _shared_store
+    with _shared_lock:
+        if _shared_store is None:
+            _shared_store = ConversationStore(get_local_store())
+        return _shared_store
@@ -0,0 +1,352 @@
+import os
+import re
+import threading
+from collections import OrderedDict
+
+from local_store import get_local_store
+from result_cache import normalize_sql
+
+EXPLANATION_CACHE_MAX_ENTRIES = int(os.getenv("EXPLANATION_CACHE_MAX_ENTRIES", "2000"))
+# Simple queries are explained from their parsed SQL instead of by the model.
+EXPLAIN_LOCALLY = os.getenv("EXPLAIN_LOCALLY", "1").lower() in ("1", "true", "yes")
+
+# Where an explanation came from
+SOURCES = ("cache", "local", "llm")
+
+
+class ExplanationCache:
+    """
+    Normalized SQL -> explanation, evicted least recently used beyond
+    ``max_entries``. With a LocalStore the entries are shared by every
+    process using it. Also counts where the explanations handed out came from.
+    """
+
+    STORE_NAMESPACE = "explanation"
+
+    def __init__(self, max_entries=EXPLANATION_CACHE_MAX_ENTRIES, store=None):
+        self.max_entries = max_entries
+        self.store = store
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.served = dict.fromkeys(SOURCES, 0)
+        self._lock = threading.Lock()
+
+    def get(self, sql):
+        key = normalize_sql(sql)
+        if self.store is not None:
+            data = self.store.get(self.STORE_NAMESPACE, key)
+            text = data.decode("utf-8") if data is not None else None
+        else:
+            with self._lock:
+                text = self.entries.get(key)
+                if text is not None:
+                    self.entries.move_to_end(key)
+        with self._lock:
+            if text is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return text
+
+    def put(self, sql, text):
+        key = normalize_sql(sql)
+        if self.store is not None:
+            self.store.put(self.STORE_NAMESPACE, key, text.encode("utf-8"))
+            self.store.trim(self.STORE_NAMESPACE, max_entries=self.max_entries)
+            return
+        with self._lock:
+            self.entries[key] = text
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def count(self, source):
+        """Records that an explanation was served from ``source`` ('cache', 'local' or 'llm')."""
+        with self._lock:
+            self.served[source] += 1
+
+    def stats(self):
+        with self._lock:
+            entries = self.store.stats(self.STORE_NAMESPACE)["entries"] if self.store is not None \
+                else len(self.entries)
+            total = sum(self.served.values())
+            return {
+                "entries": entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                **{f"served_{source}": count for source, count in self.served.items()},
+                "without_llm_ratio": (total - self.served["llm"]) / total if total else 0.0
+            }
+
+
+_shared_cache = None
+_shared_lock = threading.Lock()
+
+
+def get_explanation_cache():
+    """Returns the process-wide ExplanationCache, backed by the LocalStore when one is configured."""
+    global _shared_cache
+    with _shared_lock:
+        if _shared_cache is None:
+            _shared_cache = ExplanationCache(store=get_local_store())
+        return _shared_cache
+
+
+# --- Local explainer ----------------------------------------------------
+
+_DATE_VALUE = re.compile(r"^\d{4}-\d{2}-\d{2}")
+_DATE_WORDS = {"date", "time", "day", "month", "year", "created", "updated", "timestamp"}
+
+
+class _TooComplex(Exception):
+    """The statement is outside what the local explainer describes."""
+
+
+def _words(name):
+    """'SaleDate' / 'sale_date' / '[Sale Date]' -> 'sale date'."""
+    name = re.sub(r"(?<=[a-z0-9])(?=[A-Z])|(?<=[A-Z])(?=[A-Z][a-z])", " ", name.strip("[]\""))
+    return re.sub(r"[_\s]+", " ", name).strip().lower()
+
+
+def _series(items, conjunction="and"):
+    items = list(dict.fromkeys(items))
+    if len(items) < 2:
+        return "".join(items)
+    return f"{', '.join(items[:-1])} {conjunction} {items[-1]}"
+
+
+def _is_date(words, value=None):
+    return bool(_DATE_WORDS & set(words.split())) or bool(value and _DATE_VALUE.match(value))
+
+
+class _Explainer:
+    """Describes one simple SELECT in plain language (see explain_locally)."""
+
+    _AGGREGATES = {"Sum": "the total {}", "Avg": "the average {}", "Min": "the lowest {}", "Max": "the highest {}"}
+    _COMPARISONS = {"EQ": "is", "NEQ": "is not", "GT": "is greater than", "GTE": "is at least",
+                    "LT": "is less than", "LTE": "is at most"}
+    _DATE_COMPARISONS = {"GT": "is after", "GTE": "is on or after", "LT": "is before", "LTE": "is on or before"}
+
+    def __init__(self, exp, select):
+        self.exp = exp
+        self.select = select
+        self.aliases = {}
+
+    def table(self, table):
+        if not isinstance(table, self.exp.Table) or not isinstance(table.this, self.exp.Identifier):
+            raise _TooComplex()
+        return _words(table.name)
+
+    def value(self, node):
+        exp = self.exp
+        if isinstance(node, exp.Literal):
+            return f"'{node.this}'" if node.is_string else node.this
+        if isinstance(node, exp.Boolean):
+            return "true" if node.this else "false"
+        if isinstance(node, exp.Neg) and isinstance(node.this, exp.Literal):
+            return f"-{node.this.this}"
+        raise _TooComplex()
+
+    def operand(self, node, entity):
+        """A column, an aggregate or a select alias in words."""
+        exp = self.exp
+        if isinstance(node, exp.Paren):
+            return self.operand(node.this, entity)
+        if isinstance(node, exp.Column):
+            return self.aliases.get(node.name.lower()) or _words(node.name)
+        if isinstance(node, exp.Count):
+            arg = node.this
+            if isinstance(arg, exp.Star) or isinstance(arg, exp.Literal):
+                return f"the number of {entity}"
+            if isinstance(arg, exp.Distinct) and len(arg.expressions) == 1 \
+                    and isinstance(arg.expressions[0], exp.Column):
+                return f"the number of different {_words(arg.expressions[0].name)} values"
+            if isinstance(arg, exp.Column):
+                return f"the number of {entity} with a {_words(arg.name)}"
+            raise _TooComplex()
+        template = self._AGGREGATES.get(node.__class__.__name__)
+        if template is not None and isinstance(node.this, exp.Column):
+            return template.format(_words(node.this.name))
+        raise _TooComplex()
+
+    def condition(self, node, entity):
+        exp = self.exp
+        name = node.__class__.__name__
+        if isinstance(node, exp.Paren):
+            return self.condition(node.this, entity)
+        if isinstance(node, (exp.And, exp.Or)):
+            conjunction = "and" if isinstance(node, exp.And) else "or"
+            left, right = (self.clause(side, entity, node) for side in (node.this, node.expression))
+            return f"{left} {conjunction} {right}"
+        if isinstance(node, exp.Not):
+            inner = node.this
+            if isinstance(inner, exp.Is):
+                return f"{self.operand(inner.this, entity)} is filled in"
+            if isinstance(inner, exp.In):
+                return self.membership(inner, entity, negated=True)
+            raise _TooComplex()
+        if isinstance(node, exp.Is) and isinstance(node.expression, exp.Null):
+            return f"{self.operand(node.this, entity)} is missing"
+        if isinstance(node, exp.Between):
+            left = self.operand(node.this, entity)
+            return f"{left} is between {self.value(node.args['low'])} and {self.value(node.args['high'])}"
+        if isinstance(node, exp.In):
+            return self.membership(node, entity)
+        if isinstance(node, exp.Like) and isinstance(node.expression, exp.Literal):
+            left, pattern = self.operand(node.this, entity), node.expression.this
+            core = pattern.strip("%")
+            if "%" in core or "_" in core or not core:
+                raise _TooComplex()
+            if pattern.startswith("%") and pattern.endswith("%"):
+                return f"{left} contains '{core}'"
+            if pattern.endswith("%"):
+                return f"{left} starts with '{core}'"
+            if pattern.startswith("%"):
+                return f"{left} ends with '{core}'"
+            return f"{left} is '{core}'"
+        if name in self._COMPARISONS:
+            left = self.operand(node.this, entity)
+            if isinstance(node.expression, exp.Column):
+                return f"{left} {self._COMPARISONS[name]} {self.operand(node.expression, entity)}"
+            right = self.value(node.expression)
+            phrase = self._COMPARISONS[name]
+            if name in self._DATE_COMPARISONS and _is_date(left, right.strip("'")):
+                phrase = self._DATE_COMPARISONS[name]
+            return f"{left} {phrase} {right}"
+        raise _TooComplex()
+
+    def clause(self, node, entity, parent):
+        """
+        One side of an AND / OR. A side joined with the other connective is
+        bracketed, so "a or b and c" keeps SQL's precedence: "a or (b and c)".
+        """
+        exp = self.exp
+        inner = node
+        while isinstance(inner, exp.Paren):
+            inner = inner.this
+        text = self.condition(inner, entity)
+        if isinstance(inner, (exp.And, exp.Or)) and type(inner) is not type(parent):
+            return f"({text})"
+        return text
+
+    def membership(self, node, entity, negated=False):
+        if node.args.get("query") or not node.expressions:
+            raise _TooComplex()
+        values = [self.value(value) for value in node.expressions]
+        return f"{self.operand(node.this, entity)} is {'not ' if negated else ''}one of {_series(values, 'or')}"
+
+    def explain(self):
+        exp, select = self.exp, self.select
+        if select.args.get("with") or select.args.get("into") or len(list(select.find_all(exp.Select))) > 1 \
+                or select.find(exp.Window) or select.find(exp.Case) or select.find(exp.Anonymous):
+            raise _TooComplex()
+
+        source = select.args.get("from_") or select.args.get("from")
+        if source is None:
+            raise _TooComplex()
+        entity = self.table(source.this)
+        joined = []
+        for join in select.args.get("joins") or []:
+            side, kind = (join.side or "").upper(), (join.kind or "").upper()
+            if side not in ("", "LEFT") or kind not in ("", "INNER", "OUTER") or not join.args.get("on"):
+                raise _TooComplex()
+            name = self.table(join.this)
+            joined.append(f"any matching {name}" if side == "LEFT" else f"the matching {name}")
+
+        measures, columns, star = [], [], False
+        for projection in select.expressions:
+            node = projection.this if isinstance(projection, exp.Alias) else projection
+            if isinstance(node, exp.Star) or (isinstance(node, exp.Column) and isinstance(node.this, exp.Star)):
+                star = True
+                continue
+            text = self.operand(node, entity)
+            (columns if isinstance(node, exp.Column) else measures).append(text)
+            if isinstance(projection, exp.Alias):
+                self.aliases[projection.alias.lower()] = text
+
+        group = select.args.get("group")
+        dimensions = [self.operand(node, entity) for node in group.expressions] if group else []
+        if group and not all(isinstance(node, exp.Column) for node in group.expressions):
+            raise _TooComplex()
+
+        # What is shown
+        if measures:
+            sentence = f"This shows {_series(measures)}"
+            if dimensions:
+                sentence += f" for each {_series(dimensions)}"
+            if not all(measure == f"the number of {entity}" for measure in measures):
+                sentence += f" across {entity}"
+        elif star and not columns:
+            sentence = f"This lists {entity} with all their details"
+        else:
+            shown = _series(columns + (["all other details"] if star else []))
+            if select.args.get("distinct"):
+                sentence = f"This lists each different {shown} found in {entity}"
+            else:
+                sentence = f"This lists the {shown} of {entity}"
+        if joined:
+            sentence += f", together with {_series(joined)}"
+
+        where = select.args.get("where")
+        if where is not None:
+            sentence += f", limited to records where {self.condition(where.this, entity)}"
+        having = select.args.get("having")
+        if having is not None:
+            sentence += f", keeping only groups where {self.condition(having.this, entity)}"
+        sentences = [sentence + "."]
+
+        # How much of it and in which order
+        order = select.args.get("order")
+        ranking = None
+        if order is not None:
+            keys = []
+            for ordered in order.expressions:
+                words = self.operand(ordered.this, entity)
+                descending = bool(ordered.args.get("desc"))
+                if _is_date(words):
+                    keys.append(f"{words} ({'most recent' if descending else 'oldest'} first)")
+                else:
+                    keys.append(f"{words} ({'highest' if descending else 'lowest'} first)")
+            ranking = _series(keys)
+
+        limit = select.args.get("limit")
+        count = None
+        if limit is not None:
+            count = self.value(limit.expression)
+            options = limit.args.get("limit_options")
+            if options is not None and options.args.get("percent"):
+                count = f"{count} percent"
+        if count and ranking:
+            sentences.append(f"Only the top {count} are shown, ranked by {ranking}.")
+        elif count:
+            sentences.append(f"Only {count} {'of them are' if 'percent' in str(count) else 'rows are'} shown.")
+        elif ranking:
+            sentences.append(f"Results are ordered by {ranking}.")
+        return " ".join(sentences)
+
+
+def explain_locally(sql):
+    """
+    Plain-language explanation of a simple SELECT, written from the parsed
+    SQL: which figures or details are shown, from which tables (and joined
+    ones), the filters, grouping, ordering and row limit. Returns None for
+    anything more involved (CTEs, subqueries, window functions, CASE, set
+    operations, unfamiliar functions, several statements) or when sqlglot
+    isn't installed; those are left to the model.
+    """
+    try:
+        import sqlglot
+        from sqlglot import exp
+    except ImportError:
+        return None
+    try:
+        statements = [s for s in sqlglot.parse(sql, read="tsql") if s is not None and not isinstance(s, exp.Use)]
+    except sqlglot.errors.ParseError:
+        return None
+    if len(statements) != 1 or not isinstance(statements[0], exp.Select):
+        return None
+    try:
+        return _Explainer(exp, statements[0]).explain()
+    except _TooComplex:
+        return None
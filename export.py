@@ -0,0 +1,244 @@
+"""
+Full-result exports: a query's rows are streamed from the cursor with
+fetchmany straight into a CSV or Parquet file, one batch at a time, so an
+extract of millions of rows is written with constant memory (no DataFrame
+is built).
+
+    stats = export_query(pool, "SELECT * FROM dbo.orders", export_path("parquet"), "parquet")
+"""
+import csv
+import datetime
+import os
+import threading
+import time
+import uuid
+from decimal import Decimal
+
+from connect import _cancel_timer
+from pool import borrow
+from schema_cache import SCHEMA_CACHE_DIR
+from telemetry import increment, record_span
+
+EXPORT_DIR = os.getenv("EXPORT_DIR", os.path.join(SCHEMA_CACHE_DIR, "exports"))
+# Rows per fetchmany call; one CSV write / Parquet row group each.
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", "10000"))
+# Exports skip the interactive row cap (GUARD_MAX_ROWS) but keep a cost limit
+# and a (longer) statement timeout.
+EXPORT_MAX_COST = float(os.getenv("EXPORT_MAX_COST", "5000"))
+EXPORT_TIMEOUT = float(os.getenv("EXPORT_TIMEOUT", "3600"))
+# Export files older than this (seconds) are deleted when a new export starts.
+EXPORT_RETENTION_SECONDS = float(os.getenv("EXPORT_RETENTION_SECONDS", str(24 * 3600)))
+EXPORT_FORMATS = ("csv", "parquet")
+
+
+class ExportCancelled(Exception):
+    """Raised by export_query when its ``cancelled`` event is set between batches."""
+
+
+def prune_exports(export_dir=EXPORT_DIR, max_age=EXPORT_RETENTION_SECONDS):
+    """Deletes export files (and leftover partial files) older than ``max_age`` seconds."""
+    cutoff = time.time() - max_age
+    try:
+        names = os.listdir(export_dir)
+    except FileNotFoundError:
+        return
+    for name in names:
+        path = os.path.join(export_dir, name)
+        try:
+            if os.path.getmtime(path) < cutoff:
+                os.remove(path)
+        except OSError:
+            pass
+
+
+def export_path(output_format, export_dir=EXPORT_DIR):
+    """A new file name for an export in ``export_dir`` (created if needed); old exports are pruned."""
+    if output_format not in EXPORT_FORMATS:
+        raise ValueError(f"unknown export format {output_format!r} (expected one of {', '.join(EXPORT_FORMATS)})")
+    os.makedirs(export_dir, exist_ok=True)
+    prune_exports(export_dir)
+    name = f"export-{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:8]}.{output_format}"
+    return os.path.join(export_dir, name)
+
+
+class _CSVWriter:
+    """Writes fetched rows as UTF-8 CSV with a header line; NULL is an empty field, binary is hex."""
+
+    def __init__(self, path, description):
+        self._file = open(path, "w", newline="", encoding="utf-8")
+        self._writer = csv.writer(self._file)
+        self._writer.writerow([col[0] for col in description])
+        self._binary = [idx for idx, col in enumerate(description) if col[1] in (bytes, bytearray)]
+
+    def write(self, rows):
+        if self._binary:
+            rows = [list(row) for row in rows]
+            for row in rows:
+                for idx in self._binary:
+                    if row[idx] is not None:
+                        row[idx] = bytes(row[idx]).hex()
+        self._writer.writerows(rows)
+
+    def close(self):
+        self._file.close()
+
+
+def _arrow_type(type_code):
+    """Arrow column type for the Python type pyodbc reports in cursor.description."""
+    import pyarrow as pa
+
+    return {
+        int: pa.int64(), float: pa.float64(), Decimal: pa.float64(), bool: pa.bool_(),
+        datetime.datetime: pa.timestamp("us"), datetime.date: pa.date32(), datetime.time: pa.time64("us"),
+        bytes: pa.binary(), bytearray: pa.binary()
+    }.get(type_code, pa.string())
+
+
+class _ParquetWriter:
+    """
+    Writes fetched rows to one Parquet file, a row group per batch. The
+    schema comes from cursor.description, so every batch gets the same
+    column types whatever NULLs it holds; Decimal is stored as float64, as in
+    ExecuteQuery.
+    """
+
+    def __init__(self, path, description):
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise RuntimeError("Parquet export needs pyarrow (pip install pyarrow)") from None
+        self._pa = pa
+        self._types = [_arrow_type(col[1]) for col in description]
+        self._schema = pa.schema([pa.field(str(col[0]), arrow_type)
+                                  for col, arrow_type in zip(description, self._types)])
+        self._writer = pq.ParquetWriter(path, self._schema)
+
+    def _column(self, values, arrow_type):
+        pa = self._pa
+        if arrow_type == pa.float64():
+            values = [None if v is None else float(v) for v in values]
+        elif arrow_type == pa.string():
+            values = [v if v is None or isinstance(v, str) else str(v) for v in values]
+        try:
+            return pa.array(values, type=arrow_type)
+        except (pa.ArrowInvalid, pa.ArrowTypeError, OverflowError) as e:
+            raise TypeError(f"a column can't be written as {arrow_type}: {e}") from e
+
+    def write(self, rows):
+        columns = [self._column(list(values), arrow_type) for values, arrow_type in zip(zip(*rows), self._types)]
+        self._writer.write_table(self._pa.Table.from_arrays(columns, schema=self._schema))
+
+    def close(self):
+        self._writer.close()
+
+
+_WRITERS = {"csv": _CSVWriter, "parquet": _ParquetWriter}
+
+
+def export_query(conn, query, path, output_format="csv", batch_size=EXPORT_BATCH_SIZE, on_progress=None,
+                 on_cursor=None, cancelled=None, timeout=None):
+    """
+    Executes a query and streams every row of its result set into ``path``.
+
+    Rows are read with fetchmany(``batch_size``) and each batch is written
+    before the next is fetched, so memory use does not grow with the result.
+    The file is written under a temporary name and renamed once complete;
+    a failed or cancelled export leaves nothing behind.
+
+    Args:
+        conn: Active pyodbc connection or ConnectionPool
+        query (str): SQL to execute (a single result set)
+        path (str): File to write
+        output_format (str): "csv" or "parquet"
+        batch_size (int): Rows per fetchmany call
+        on_progress (callable): Called after every batch with
+            {"rows", "bytes", "seconds", "rows_per_second"}
+        on_cursor (callable): Optional hook called with the cursor before the query
+            runs, so another thread can cancel it with cursor.cancel()
+        cancelled (threading.Event): Checked between batches; when set, the
+            statement is cancelled and ExportCancelled is raised
+        timeout (float): Seconds after which the statement is cancelled on the server
+            and TimeoutError is raised; None for no limit
+
+    Returns:
+        dict: {"path", "format", "columns", "rows", "bytes", "seconds", "rows_per_second"}
+    """
+    writer_class = _WRITERS.get(output_format)
+    if writer_class is None:
+        raise ValueError(f"unknown export format {output_format!r} (expected one of {', '.join(EXPORT_FORMATS)})")
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    started = time.perf_counter()
+    rows = 0
+    fetch_seconds = write_seconds = 0.0
+    writer = None
+    with borrow(conn) as conn:
+        cursor = conn.cursor()
+        if on_cursor is not None:
+            on_cursor(cursor)
+        timed_out = threading.Event()
+        timer = _cancel_timer(cursor, timeout, timed_out) if timeout else None
+        try:
+            cursor.execute(query)
+            if cursor.description is None:
+                raise ValueError("the statement returned no result set to export")
+            columns = [col[0] for col in cursor.description]
+            writer = writer_class(tmp_path, cursor.description)
+            while True:
+                if cancelled is not None and cancelled.is_set():
+                    raise ExportCancelled(f"export cancelled after {rows:,} rows")
+                fetch_started = time.perf_counter()
+                batch = cursor.fetchmany(batch_size)
+                fetch_seconds += time.perf_counter() - fetch_started
+                if not batch:
+                    # A cancelled statement may just stop returning rows
+                    if timed_out.is_set():
+                        raise TimeoutError(f"export cancelled after {timeout:g}s")
+                    break
+                write_started = time.perf_counter()
+                writer.write(batch)
+                write_seconds += time.perf_counter() - write_started
+                rows += len(batch)
+                if on_progress is not None:
+                    on_progress(_progress(rows, tmp_path, started))
+            writer.close()
+            writer = None
+            os.replace(tmp_path, path)
+        except Exception as e:
+            try:
+                cursor.cancel()
+            except Exception:
+                pass
+            if timed_out.is_set() and not isinstance(e, TimeoutError):
+                raise TimeoutError(f"export cancelled after {timeout:g}s") from e
+            raise
+        finally:
+            if timer is not None:
+                timer.cancel()
+            if writer is not None:
+                try:
+                    writer.close()
+                except Exception:
+                    pass
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            cursor.close()
+
+    stats = dict(_progress(rows, path, started), path=path, format=output_format, columns=columns)
+    record_span("db.export", stats["seconds"], format=output_format, rows=rows, bytes=stats["bytes"],
+                rows_per_second=stats["rows_per_second"], fetch_seconds=round(fetch_seconds, 6),
+                write_seconds=round(write_seconds, 6))
+    increment("exports_total")
+    increment("export_rows_total", rows)
+    increment("export_bytes_total", stats["bytes"])
+    return stats
+
+
+def _progress(rows, path, started):
+    seconds = time.perf_counter() - started
+    return {
+        "rows": rows,
+        "bytes": os.path.getsize(path),
+        "seconds": round(seconds, 3),
+        "rows_per_second": round(rows / seconds, 1) if seconds > 0 else 0.0
+    }
@@ -1,13 +1,86 @@
+import asyncio
+import copy
 import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
-from connect import connect_to_database, get_database_schema_with_samples, ExecuteQuery
-from langchain_google_genai import ChatGoogleGenerativeAI
-from langchain_core.messages import HumanMessage, AIMessage
-from langchain_core.prompts import ChatPromptTemplate
-from prompt import SQLprompt, explanation_prompt
+from connect import connect_to_database
+from explanations import EXPLAIN_LOCALLY, explain_locally, get_explanation_cache
+from export import EXPORT_MAX_COST, EXPORT_TIMEOUT, export_path, export_query
+from llm_scheduler import get_llm_scheduler
+from pool import POOL_MAX_SIZE, all_pool_stats, get_pool
+from schema_cache import SCHEMA_CHECK_INTERVAL, announced_at
+from schema_index import SchemaIndex, load_or_build_index, prune_schema
+from schema_loader import SCHEMA_WAIT_TIMEOUT, SchemaLoader
+from sql_cache import get_sql_cache, is_context_dependent, normalize_question
+from result_cache import get_result_cache, is_write_statement, normalize_sql
+from query_guard import QueryBlocked, QueryGuard
+from prompt import SQLprompt, explanation_prompt, sql_repair_prompt
+from prompt_builder import build_sql_prompt, count_tokens
+from single_flight import FlightAbandoned, all_single_flight_stats, get_single_flight
+from sql_validator import SchemaCatalog, validate_sql
+from telemetry import increment, record_span, register_source, run_in_context, span, trace
+from workload import log_query
 
 load_dotenv()
 
+# Per-stage timeouts (seconds) for aget_full_response
+SQL_TIMEOUT = float(os.getenv("SQL_TIMEOUT", "60"))
+DB_TIMEOUT = float(os.getenv("DB_TIMEOUT", "120"))
+EXPLAIN_TIMEOUT = float(os.getenv("EXPLAIN_TIMEOUT", "60"))
+
+# Generated SQL is checked against the schema before it is sent to the server;
+# SQL that fails the check goes back to the model this many times to be fixed.
+SQL_VALIDATION = os.getenv("SQL_VALIDATION", "1").lower() in ("1", "true", "yes")
+SQL_REPAIR_ATTEMPTS = int(os.getenv("SQL_REPAIR_ATTEMPTS", "2"))
+
+MAX_HISTORY_ENTRIES = 50
+
+register_source("sql_cache", lambda: get_sql_cache().stats())
+register_source("result_cache", lambda: get_result_cache().stats())
+register_source("explanations", lambda: get_explanation_cache().stats())
+register_source("pool", all_pool_stats)
+register_source("single_flight", all_single_flight_stats)
+register_source("llm_scheduler", lambda: get_llm_scheduler().stats())
+
+# Identical questions (and queries) asked by several sessions at once share one
+# LLM call (and one execution)
+_sql_flights = get_single_flight("sql")
+_query_flights = get_single_flight("query")
+
+# DB calls are blocking (pyodbc), so async callers run them here
+_db_executor = ThreadPoolExecutor(max_workers=POOL_MAX_SIZE, thread_name_prefix="sql-db")
+
+
+def _token_usage(usage, prompt_estimate, content):
+    """(prompt, response) tokens: provider-reported usage when available, else estimates."""
+    if usage and usage.get("input_tokens") is not None:
+        return usage["input_tokens"], usage.get("output_tokens")
+    return prompt_estimate, count_tokens(content)
+
+
+def _chat_prompt(messages):
+    """ChatPromptTemplate.from_messages; langchain_core is imported on first use to keep startup fast."""
+    from langchain_core.prompts import ChatPromptTemplate
+    return ChatPromptTemplate.from_messages(messages)
+
+
+def strip_sql_fences(text):
+    """Removes the ```sql markdown fence the model tends to wrap its SQL in."""
+    return text.strip().removeprefix("```sql").removesuffix("```").strip()
+
+
+def _run_sync(coro):
+    """Runs a coroutine to completion, also when called from inside a running event loop."""
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(coro)
+    with ThreadPoolExecutor(max_workers=1) as runner:
+        return runner.submit(asyncio.run, coro).result()
+
+
 class SQLChatBot:
     # def __init__(self, server, database, username, password):
     #     self.llm = ChatGoogleGenerativeAI(model="gemini-1.5-flash")
@@ -18,14 +91,62 @@ class SQLChatBot:
 
     #     if self.conn:
     #         self.schema_data = get_database_schema_with_samples(self.conn, self.database)
-    def __init__(self, server, database, username, password):
-        self.llm = ChatGoogleGenerativeAI(model="gemini-1.5-flash")
-        self.conn = connect_to_database(server, database, username, password)
-        if self.conn is None:
-            raise ConnectionError(f"Failed to connect to database '{database}' on server '{server}'. Please check your credentials and network.")
+    def __init__(self, server, database, username, password, llm=None, conn=None, background=False, guard=None,
+                 scheduler=None):
+        # llm / conn / guard / scheduler let callers (e.g. the offline benchmarks) supply a chat model, a
+        # connection or pool, a QueryGuard with their own limits or plan provider, and an LLMScheduler
+        if llm is None:
+            # Imported here: the Gemini client is slow to import and unused when a model is passed in
+            from langchain_google_genai import ChatGoogleGenerativeAI
+            # max_retries=1 is a single attempt: retries and backoff are left to the scheduler
+            llm = ChatGoogleGenerativeAI(model="gemini-1.5-flash", max_retries=1)
+        self.llm = llm
+        # Every model call goes through the process-wide scheduler (rate limits, priority, retries)
+        self.llm_scheduler = scheduler or get_llm_scheduler()
+        # Connections are borrowed per call from a pool shared by every session on this server/database/user
+        try:
+            self.conn = conn or get_pool(server, database, username, password)
+        except Exception as e:
+            raise ConnectionError(f"Failed to connect to database '{database}' on server '{server}'. Please check your credentials and network.") from e
         self.database = database
+        # Cached results and in-flight queries are only shared within one server and login
+        self.server = server
+        self.username = username
+        # Generated SQL is checked against its estimated plan before it runs
+        self.guard = guard or QueryGuard()
         self.chat_history = []
-        self.schema_data = get_database_schema_with_samples(self.conn, self.database)
+        self.snapshot = None
+        self.schema_version = None
+        self.schema_data = {}
+        self.full_schema_chars = 0
+        self.schema_index = None
+        self._schema_revision = None
+        # When the loaded snapshot was last re-checked, and the latest announcement acted on
+        self._schema_checked_at = time.time()
+        self._schema_announced = None
+        # Validation catalog for the current schema revision; shared with forks
+        self._catalogs = {}
+        # Shared, persisted snapshot: warm connects skip the catalog scan entirely.
+        # It loads on a background thread; with background=True the constructor
+        # returns right away and the first question waits only for the catalog.
+        self.schema_loader = SchemaLoader(
+            self.conn,
+            server,
+            self.database,
+            conn_factory=lambda db: connect_to_database(server, db, username, password)
+        ).start(background)
+        self.schema_stats = self.schema_loader.stats
+        if not background:
+            self.schema_loader.wait()
+            self._ensure_schema()
+        self.last_prompt_stats = {}
+        self.last_sql = None
+        self.last_validation = None
+        self.last_trace = []
+        self._sql_origin = None
+        self.sql_cache = get_sql_cache()
+        self.result_cache = get_result_cache()
+        self.explanation_cache = get_explanation_cache()
 
     # def get_sql_query(self, question):
     #     prompt = ChatPromptTemplate.from_messages([
@@ -48,60 +169,628 @@ class SQLChatBot:
     #         self.chat_history = self.chat_history[-10:]
 
     #     return query
-    def get_sql_query(self, question):
-        prompt = ChatPromptTemplate.from_messages([
+    def refresh_schema(self, background=False):
+        """
+        Rescans the schema, ignoring the cached snapshot, and switches to it.
+        With background=True this returns at once and questions wait for the
+        new catalog like they do after connecting.
+        """
+        old = self.schema_loader
+        self.schema_loader = SchemaLoader(old.conn, old.server, old.database, conn_factory=old.conn_factory,
+                                          refresh=True).start(background)
+        self.schema_stats = self.schema_loader.stats
+        self.snapshot = None
+        self.schema_version = None
+        self.schema_index = None
+        self._schema_revision = None
+        if not background:
+            self.schema_loader.wait()
+            self._ensure_schema()
+        return self.schema_loader
+
+    def fork(self):
+        """
+        A bot that shares this one's model, pool, guard, schema and caches but
+        has its own conversation, for answering independent questions concurrently.
+        """
+        worker = copy.copy(self)
+        worker.chat_history = []
+        worker.last_prompt_stats = {}
+        worker.last_sql = None
+        worker.last_validation = None
+        worker.last_trace = []
+        worker._sql_origin = None
+        return worker
+
+    def _ensure_schema(self, timeout=SCHEMA_WAIT_TIMEOUT):
+        """
+        Brings schema_data / schema_index up to date with the schema loader.
+
+        Only waits until every table's DDL is known. While column profiles
+        are still loading, an in-memory index over the DDL is used and
+        schema_version stays None, so nothing is cached against a partial
+        schema.
+        """
+        if self.snapshot is not None:
+            self._check_schema()
+            return
+        tables, revision, snapshot = self.schema_loader.usable_tables(timeout)
+        if revision == self._schema_revision:
+            return
+        if snapshot is not None:
+            self._use_snapshot(snapshot)
+            self._schema_revision = revision
+            return
+        if self.schema_index is None:
+            # The index only looks at the DDL, which doesn't change while profiles load
+            with span("schema.index", tables=len(tables), partial=True):
+                self.schema_index = SchemaIndex.build(tables)
+        self.schema_data = tables
+        self.full_schema_chars = len(str(tables))
+        self._schema_revision = revision
+
+    def _use_snapshot(self, snapshot):
+        if snapshot["version"] != self.schema_version or self.snapshot is None:
+            with span("schema.index", tables=len(snapshot["tables"])):
+                self.schema_index = load_or_build_index(snapshot)
+        if snapshot["tables"] is not self.schema_data:
+            self.schema_data = snapshot["tables"]
+            self.full_schema_chars = len(str(snapshot["tables"]))
+        self.snapshot = snapshot
+        self.schema_version = snapshot["version"]
+
+    def _check_schema(self):
+        """
+        Keeps a loaded snapshot current without making questions wait: once it
+        is older than SCHEMA_CHECK_INTERVAL, or another process sharing the
+        LocalStore announced a newer one (e.g. after POST /schema/refresh),
+        the modify_dates are compared again on a background loader, and its
+        snapshot replaces this one when it is ready.
+        """
+        loader = self.schema_loader
+        if loader.snapshot is not None and loader.snapshot is not self.snapshot:
+            self._use_snapshot(loader.snapshot)
+            return
+        if loader.snapshot is None and loader.error is None:
+            return  # a check is still running
+        announced = announced_at(loader.server, loader.database)
+        if time.time() - self._schema_checked_at < SCHEMA_CHECK_INTERVAL and (
+                announced is None or announced <= self.snapshot["checked_at"] or announced == self._schema_announced):
+            return
+        self._schema_checked_at = time.time()
+        self._schema_announced = announced
+        self.schema_loader = SchemaLoader(loader.conn, loader.server, loader.database,
+                                          conn_factory=loader.conn_factory).start(background=True)
+        self.schema_stats = self.schema_loader.stats
+
+    async def _aensure_schema(self):
+        if self.snapshot is not None:
+            self._check_schema()
+        else:
+            await asyncio.get_running_loop().run_in_executor(_db_executor, self._ensure_schema)
+
+    def _cached_sql(self, question):
+        """Returns (use_cache, cached_sql) for a question."""
+        # Repeat questions are answered from the shared cache without calling the model
+        use_cache = self.schema_version is not None and not (self.chat_history and is_context_dependent(question))
+        cached = self.sql_cache.get(question, self.schema_version) if use_cache else None
+        if cached is not None:
+            record_span("llm.sql", 0.0, cached=True)
+        return use_cache, cached
+
+    def _sql_chain(self, question):
+        """Builds the SQL generation chain, its inputs and the prompt size stats."""
+        started = time.perf_counter()
+        # Only the tables relevant to this question (plus join partners) go into the prompt
+        schema_data, prompt_stats = prune_schema(self.schema_data, self.schema_index, question)
+        prompt_stats["full_schema_chars"] = self.full_schema_chars
+
+        # Fit history and schema into the token budget, newest turns and most relevant tables first
+        history, schema_text, prompt_stats["tokens"] = build_sql_prompt(
+            SQLprompt, self.chat_history, question, schema_data
+        )
+        prompt_stats["schema_chars"] = len(schema_text)
+
+        prompt = _chat_prompt([
             ("system", SQLprompt),
-            *self.chat_history,
+            *history,
             ("human", "{question}\nSchema:\n{schema_data}")
         ])
 
         chain = prompt | self.llm
-        response = chain.invoke({
+        inputs = {
             "question": question,
-            "schema_data": self.schema_data
-        })
+            "schema_data": schema_text
+        }
+        record_span("prompt.build", time.perf_counter() - started,
+                    prompt_tokens=prompt_stats["tokens"]["total"], tables=prompt_stats["tables_in_prompt"])
+        return chain, inputs, prompt_stats
+
+    def _record_sql(self, content, prompt_stats, started, usage=None):
+        """Records the SQL generation call and returns the SQL extracted from the response."""
+        prompt_stats["llm_ms"] = (time.perf_counter() - started) * 1000
+        self.last_prompt_stats = prompt_stats
+        prompt_tokens, response_tokens = _token_usage(usage, prompt_stats["tokens"]["total"], content)
+        record_span("llm.sql", prompt_stats["llm_ms"] / 1000, cached=False,
+                    prompt_tokens=prompt_tokens, response_tokens=response_tokens,
+                    first_token_ms=prompt_stats.get("first_token_ms"))
+        print(f"📏 Prompt schema: {prompt_stats['tables_in_prompt']}/{prompt_stats['tables_total']} tables, "
+              f"{prompt_stats['schema_chars']} of {prompt_stats['full_schema_chars']} chars, "
+              f"{prompt_stats['tokens']['total']}/{prompt_stats['tokens']['budget']} tokens, "
+              f"retrieval {prompt_stats['retrieval_ms']:.1f} ms, LLM {prompt_stats['llm_ms']:.0f} ms")
 
         # Extract the SQL from the response
-        query = response.content.strip().removeprefix("```sql").removesuffix("```").strip()
+        return strip_sql_fences(content)
+
+    def _cache_sql(self, question, query, use_cache, validation):
+        # SQL that failed validation is shown but never cached
+        if use_cache and (validation is None or validation["status"] != "invalid"):
+            self.sql_cache.put(question, self.schema_version, query)
+        return query, validation
+
+    def _finish_sql(self, question, query, validation):
+        self._remember(question, query)
+        self.last_sql = query
+        self.last_validation = validation
+        return query
+
+    def _flight_key(self, question):
+        # Same key as the SQL cache: questions that would share a cache entry share a call
+        return self.schema_version, normalize_question(question)
+
+    def _catalog(self):
+        """The SchemaCatalog of the loaded schema revision, or None before the schema is loaded."""
+        if not self.schema_data:
+            return None
+        key = (id(self.schema_loader), self._schema_revision)
+        catalog = self._catalogs.get(key)
+        if catalog is None:
+            catalog = SchemaCatalog(self.schema_data)
+            self._catalogs.clear()
+            self._catalogs[key] = catalog
+        return catalog
+
+    def _validate(self, query):
+        """
+        Checks SQL against the loaded schema (sql_validator.validate_sql).
+        Returns None when validation is off or no schema is loaded yet.
+        """
+        if not SQL_VALIDATION or not self.schema_data:
+            return None
+        validation = dict(validate_sql(query, self._catalog()), sql=query)
+        increment(f"sql_validation_{validation['status']}_total")
+        if validation["status"] == "invalid":
+            # Each SQL caught here is a failing statement that never reached the server
+            increment("sql_server_round_trips_saved_total")
+        self.last_validation = validation
+        return validation
+
+    def _repair_chain(self, inputs, query, problems):
+        """
+        The chain that asks the model to fix SQL that failed validation: the
+        original question and schema, its answer, then the problems found.
+        """
+        prompt = _chat_prompt([
+            ("system", SQLprompt),
+            ("human", "{question}\nSchema:\n{schema_data}"),
+            ("ai", "{query}"),
+            ("human", sql_repair_prompt)
+        ])
+        return prompt | self.llm, {**inputs, "query": query, "problems": "\n".join(f"- {p}" for p in problems)}
+
+    def _record_repair(self, attempt, validation, content, prompt_stats, started, usage=None):
+        prompt_estimate = prompt_stats["tokens"]["total"] + count_tokens(validation["sql"])
+        prompt_tokens, response_tokens = _token_usage(usage, prompt_estimate, content)
+        record_span("llm.repair", time.perf_counter() - started, attempt=attempt,
+                    problems=len(validation["problems"]), prompt_tokens=prompt_tokens,
+                    response_tokens=response_tokens)
+        print(f"🔧 Repairing SQL (attempt {attempt}/{SQL_REPAIR_ATTEMPTS}): {'; '.join(validation['problems'])}")
+        return strip_sql_fences(content)
+
+    def _record_repairs(self, attempts, validation):
+        if attempts:
+            increment("sql_repair_attempts_total", attempts)
+            increment("sql_repaired_total" if validation["status"] != "invalid" else "sql_repair_failed_total")
+        if validation is not None:
+            validation["repairs"] = attempts
 
+    def _checked_sql(self, query, inputs, prompt_stats):
+        """Validates generated SQL, asking the model to fix it up to SQL_REPAIR_ATTEMPTS times."""
+        validation = self._validate(query)
+        attempts = 0
+        while validation is not None and validation["status"] == "invalid" and attempts < SQL_REPAIR_ATTEMPTS:
+            attempts += 1
+            chain, repair_inputs = self._repair_chain(inputs, query, validation["problems"])
+            started = time.perf_counter()
+            response = self.llm_scheduler.call(lambda: chain.invoke(repair_inputs),
+                                               prompt_stats["tokens"]["total"] + count_tokens(query))
+            query = self._record_repair(attempts, validation, response.content, prompt_stats, started,
+                                        getattr(response, "usage_metadata", None))
+            validation = self._validate(query)
+        self._record_repairs(attempts, validation)
+        return query, validation
+
+    async def _achecked_sql(self, query, inputs, prompt_stats):
+        validation = self._validate(query)
+        attempts = 0
+        while validation is not None and validation["status"] == "invalid" and attempts < SQL_REPAIR_ATTEMPTS:
+            attempts += 1
+            chain, repair_inputs = self._repair_chain(inputs, query, validation["problems"])
+            started = time.perf_counter()
+            response = await self.llm_scheduler.acall(lambda: chain.ainvoke(repair_inputs),
+                                                      prompt_stats["tokens"]["total"] + count_tokens(query))
+            query = self._record_repair(attempts, validation, response.content, prompt_stats, started,
+                                        getattr(response, "usage_metadata", None))
+            validation = self._validate(query)
+        self._record_repairs(attempts, validation)
+        return query, validation
+
+    def _generate_sql(self, question, use_cache):
+        """Asks the model for SQL, validates (and repairs) it and caches it; returns (query, validation)."""
+        chain, inputs, prompt_stats = self._sql_chain(question)
+        started = time.perf_counter()
+        response = self.llm_scheduler.call(lambda: chain.invoke(inputs), prompt_stats["tokens"]["total"])
+        query = self._record_sql(response.content, prompt_stats, started, getattr(response, "usage_metadata", None))
+        query, validation = self._checked_sql(query, inputs, prompt_stats)
+        return self._cache_sql(question, query, use_cache, validation)
+
+    async def _agenerate_sql(self, question, use_cache):
+        chain, inputs, prompt_stats = self._sql_chain(question)
+        started = time.perf_counter()
+        response = await self.llm_scheduler.acall(lambda: chain.ainvoke(inputs), prompt_stats["tokens"]["total"])
+        query = self._record_sql(response.content, prompt_stats, started, getattr(response, "usage_metadata", None))
+        query, validation = await self._achecked_sql(query, inputs, prompt_stats)
+        return self._cache_sql(question, query, use_cache, validation)
+
+    def get_sql_query(self, question):
+        self._ensure_schema()
+        use_cache, cached = self._cached_sql(question)
+        if cached is not None:
+            self._remember(question, cached)
+            self.last_sql = cached
+            return cached
+
+        if use_cache:
+            query, validation = _sql_flights.do(self._flight_key(question),
+                                                lambda: self._generate_sql(question, use_cache))
+        else:
+            query, validation = self._generate_sql(question, use_cache)
+        return self._finish_sql(question, query, validation)
+
+    async def aget_sql_query(self, question):
+        await self._aensure_schema()
+        use_cache, cached = self._cached_sql(question)
+        if cached is not None:
+            self._remember(question, cached)
+            self.last_sql = cached
+            return cached
+
+        if use_cache:
+            query, validation = await _sql_flights.ado(self._flight_key(question),
+                                                       lambda: self._agenerate_sql(question, use_cache))
+        else:
+            query, validation = await self._agenerate_sql(question, use_cache)
+        return self._finish_sql(question, query, validation)
+
+    def stream_sql_query(self, question):
+        """
+        Yields the SQL text as the model writes it. Once the generator is
+        exhausted the cleaned SQL is available as ``self.last_sql``; it
+        differs from the streamed text when the SQL had to be repaired.
+        When another session is already generating SQL for the same question,
+        its SQL is awaited and yielded in one piece.
+        """
+        self._ensure_schema()
+        use_cache, cached = self._cached_sql(question)
+        if cached is not None:
+            self._remember(question, cached)
+            self.last_sql = cached
+            yield cached
+            return
+
+        flight = None
+        if use_cache:
+            flight, leader = _sql_flights.join(self._flight_key(question))
+            if not leader:
+                try:
+                    query, validation = flight.result()
+                except FlightAbandoned:
+                    # The other session stopped; generate here, without coalescing
+                    flight = None
+                else:
+                    self._finish_sql(question, query, validation)
+                    yield query
+                    return
+
+        try:
+            chain, inputs, prompt_stats = self._sql_chain(question)
+            started = time.perf_counter()
+            parts = []
+            for chunk in self.llm_scheduler.stream(lambda: chain.stream(inputs), prompt_stats["tokens"]["total"]):
+                if chunk.content:
+                    if not parts:
+                        prompt_stats["first_token_ms"] = (time.perf_counter() - started) * 1000
+                    parts.append(chunk.content)
+                    yield chunk.content
+            query = self._record_sql("".join(parts), prompt_stats, started)
+            query, validation = self._checked_sql(query, inputs, prompt_stats)
+            self._cache_sql(question, query, use_cache, validation)
+        except BaseException as e:
+            # Includes GeneratorExit when the consumer stops reading: followers then retry
+            if flight is not None:
+                flight.fail(e)
+            raise
+        if flight is not None:
+            flight.resolve((query, validation))
+        self._finish_sql(question, query, validation)
+
+    def _remember(self, question, query):
         # ✅ FIX: Use strings instead of message objects
         self.chat_history.append(("human", question))
         self.chat_history.append(("ai", query))
+        # Where the SQL may have come from in the SQL cache, to drop it if it fails to run
+        self._sql_origin = (question, self.schema_version, query)
 
-        if len(self.chat_history) > 10:
-            self.chat_history = self.chat_history[-10:]
+        # The prompt builder trims history by tokens; this only bounds memory
+        if len(self.chat_history) > MAX_HISTORY_ENTRIES:
+            self.chat_history = self.chat_history[-MAX_HISTORY_ENTRIES:]
 
-        return query
+    def _forget_sql(self, query):
+        """Drops SQL that failed to run from the SQL cache, so it is not served again."""
+        origin = self._sql_origin
+        if origin is not None and origin[2] == query and origin[1] is not None:
+            self.sql_cache.invalidate(origin[0], origin[1], sql=query)
 
-    def get_query_result(self, query):
+    def _run(self, query, on_cursor=None):
+        """Runs a statement through the guard and adds it to the workload log (blocked ones never ran)."""
+        started = time.perf_counter()
         try:
-            return ExecuteQuery(self.conn, query)
+            result = self.guard.execute(self.conn, query, on_cursor=on_cursor)
+        except QueryBlocked:
+            raise
         except Exception as e:
-            return f"❌ SQL Execution Error: {e}"
+            log_query(self.database, query, time.perf_counter() - started, status="error",
+                      catalog=self._catalog(), schema_version=self.schema_version, error=str(e))
+            raise
+        guard = result.attrs.get("guard") or {}
+        rows = result.attrs.get("rows_affected") if "rows_affected" in result.attrs else result.attrs.get("rows")
+        log_query(self.database, guard.get("sql") or query, result.attrs.get("seconds", time.perf_counter() - started),
+                  rows=rows, catalog=self._catalog(), schema_version=self.schema_version)
+        return result
 
-    def get_explanation(self, question, query):
-        explanation_prompt_template = ChatPromptTemplate.from_messages([
+    def _execute(self, query, on_cursor=None, cancelled=None):
+        """Runs a read through the guard and caches its result."""
+        try:
+            result = self._run(query, on_cursor)
+        except Exception as e:
+            if cancelled is not None and cancelled.is_set():
+                # Cancelled by this caller's timeout: sessions waiting on it run the query themselves
+                raise FlightAbandoned(str(e)) from e
+            raise
+        self.result_cache.put(query, self.database, result, server=self.server, login=self.username)
+        return result
+
+    def get_query_result(self, query, on_cursor=None, cancelled=None):
+        """
+        Runs the query (or returns its cached result). Identical reads running
+        in other sessions are waited for rather than sent again. ``cancelled``
+        is a threading.Event set when the caller cancels the statement.
+        Returns an error message instead of a frame when the query could not
+        run; its SQL is then dropped from the SQL cache.
+        """
+        result = self._query_result(query, on_cursor, cancelled)
+        if isinstance(result, str):
+            self._forget_sql(query)
+        return result
+
+    def _query_result(self, query, on_cursor=None, cancelled=None):
+        validation = self.last_validation
+        if validation is not None and validation["sql"] == query and validation["status"] == "invalid":
+            record_span("db.query", 0.0, cached=False, blocked="validation")
+            return f"❌ SQL validation failed: {'; '.join(validation['problems'])}"
+        cached = self.result_cache.get(query, self.database, server=self.server, login=self.username)
+        if cached is not None:
+            record_span("db.query", 0.0, cached=True, rows=len(cached))
+            return cached
+        with span("db.query", cached=False) as query_span:
+            try:
+                if is_write_statement(query):
+                    result = self._run(query, on_cursor)
+                else:
+                    key = ((self.server or "").lower(), self.username or "", self.database.lower(),
+                           normalize_sql(query))
+                    result = _query_flights.do(key, lambda: self._execute(query, on_cursor, cancelled))
+            except QueryBlocked as e:
+                query_span["blocked"] = str(e)
+                return f"⛔ Query blocked: {e}"
+            except Exception as e:
+                query_span["error"] = str(e)
+                return f"❌ SQL Execution Error: {e}"
+            finally:
+                if is_write_statement(query):
+                    self.result_cache.invalidate_statement(query, self.database, server=self.server)
+            query_span.update(rows=result.attrs.get("rows"), truncated=result.attrs.get("truncated"))
+        return result
+
+    async def aget_query_result(self, query, timeout=DB_TIMEOUT):
+        """
+        Runs get_query_result on the DB thread pool. On timeout or cancellation
+        the running statement is cancelled on the server so its pooled
+        connection is freed.
+        """
+        cursors = []
+        cancelled = threading.Event()
+        loop = asyncio.get_running_loop()
+        future = loop.run_in_executor(
+            _db_executor,
+            run_in_context(lambda: self.get_query_result(query, on_cursor=cursors.append, cancelled=cancelled))
+        )
+        try:
+            return await asyncio.wait_for(future, timeout)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            cancelled.set()
+            for cursor in cursors:
+                try:
+                    cursor.cancel()
+                except Exception:
+                    pass
+            if isinstance(e, asyncio.CancelledError):
+                raise
+            self._forget_sql(query)
+            return f"❌ SQL Execution Error: query timed out after {timeout:.0f}s"
+
+    def export_query_result(self, query, output_format="csv", path=None, on_progress=None, cancelled=None):
+        """
+        Runs the query without the interactive row cap and streams every row
+        into a CSV or Parquet file (export.export_query), with constant memory.
+        The query still goes through the guard: writes are refused and plans
+        above EXPORT_MAX_COST are blocked. Returns the export stats
+        ({"path", "rows", "bytes", "seconds", "rows_per_second", ...}) or an
+        error message, as get_query_result does.
+        """
+        validation = self.last_validation
+        if validation is not None and validation["sql"] == query and validation["status"] == "invalid":
+            return f"❌ SQL validation failed: {'; '.join(validation['problems'])}"
+        guard = QueryGuard(self.guard.plan_provider, max_rows=None, max_cost=EXPORT_MAX_COST,
+                           timeout=EXPORT_TIMEOUT, allow_writes=False)
+        decision = guard.check(self.conn, query)
+        if not decision["allowed"]:
+            return f"⛔ Export blocked: {decision['reason']}"
+        started = time.perf_counter()
+        try:
+            export = export_query(self.conn, decision["sql"], path or export_path(output_format), output_format,
+                                  on_progress=on_progress, cancelled=cancelled, timeout=guard.timeout)
+        except Exception as e:
+            log_query(self.database, decision["sql"], time.perf_counter() - started, status="error", kind="export",
+                      catalog=self._catalog(), schema_version=self.schema_version, error=str(e))
+            return f"❌ Export failed: {e}"
+        log_query(self.database, decision["sql"], export["seconds"], rows=export["rows"], kind="export",
+                  catalog=self._catalog(), schema_version=self.schema_version)
+        return export
+
+    def _explanation_chain(self, question, query):
+        explanation_prompt_template = _chat_prompt([
             ("system", explanation_prompt),
             ("human", "User Question: {question}\nSQL Query:\n{query}")
         ])
         chain = explanation_prompt_template | self.llm
-        response = chain.invoke({
+        inputs = {
             "question": question,
             "query": query
-        })
+        }
+        return chain, inputs
+
+    @staticmethod
+    def _explanation_tokens(inputs):
+        return count_tokens(explanation_prompt) + count_tokens(inputs["question"] + inputs["query"])
+
+    def _known_explanation(self, query):
+        """
+        The explanation from the cache or, for simple SQL, from the local
+        explainer; None when the model has to write it.
+        """
+        started = time.perf_counter()
+        source, text = "cache", self.explanation_cache.get(query)
+        if text is None and EXPLAIN_LOCALLY:
+            source, text = "local", explain_locally(query)
+            if text is not None:
+                self.explanation_cache.put(query, text)
+        if text is not None:
+            self.explanation_cache.count(source)
+            record_span("llm.explanation", time.perf_counter() - started, source=source)
+        return text
+
+    def _record_explanation(self, inputs, content, started, usage=None):
+        prompt_tokens, response_tokens = _token_usage(usage, self._explanation_tokens(inputs), content)
+        record_span("llm.explanation", time.perf_counter() - started, source="llm",
+                    prompt_tokens=prompt_tokens, response_tokens=response_tokens)
+        self.explanation_cache.count("llm")
+        if content.strip():
+            self.explanation_cache.put(inputs["query"], content)
+
+    def get_explanation(self, question, query):
+        known = self._known_explanation(query)
+        if known is not None:
+            return known
+        chain, inputs = self._explanation_chain(question, query)
+        started = time.perf_counter()
+        response = self.llm_scheduler.call(lambda: chain.invoke(inputs), self._explanation_tokens(inputs))
+        self._record_explanation(inputs, response.content, started, getattr(response, "usage_metadata", None))
         return response.content
 
+    def stream_explanation(self, question, query):
+        """Yields the explanation text as the model writes it (in one piece when it is already known)."""
+        known = self._known_explanation(query)
+        if known is not None:
+            yield known
+            return
+        chain, inputs = self._explanation_chain(question, query)
+        started = time.perf_counter()
+        parts = []
+        for chunk in self.llm_scheduler.stream(lambda: chain.stream(inputs), self._explanation_tokens(inputs)):
+            if chunk.content:
+                parts.append(chunk.content)
+                yield chunk.content
+        self._record_explanation(inputs, "".join(parts), started)
 
-    def get_full_response(self, question):
-        sql = self.get_sql_query(question)
-        result = self.get_query_result(sql)
-        explanation = self.get_explanation(question, sql)
+    async def aget_explanation(self, question, query):
+        known = self._known_explanation(query)
+        if known is not None:
+            return known
+        chain, inputs = self._explanation_chain(question, query)
+        started = time.perf_counter()
+        response = await self.llm_scheduler.acall(lambda: chain.ainvoke(inputs), self._explanation_tokens(inputs))
+        self._record_explanation(inputs, response.content, started, getattr(response, "usage_metadata", None))
+        return response.content
+
+    async def aget_full_response(self, question, sql_timeout=SQL_TIMEOUT, db_timeout=DB_TIMEOUT,
+                                 explain_timeout=EXPLAIN_TIMEOUT):
+        """
+        Generates the SQL, then runs the query and writes the explanation
+        concurrently (the explanation only needs the question and the SQL).
+        Each stage has its own timeout; cancelling this coroutine cancels
+        both branches, including the statement running on the server.
+        The timing spans of every stage are returned under "trace".
+        """
+        with trace("question") as spans:
+            response = await self._aget_full_response(question, sql_timeout, db_timeout, explain_timeout)
+        self.last_trace = spans
+        response["trace"] = spans
+        return response
+
+    async def _aget_full_response(self, question, sql_timeout, db_timeout, explain_timeout):
+        try:
+            sql = await asyncio.wait_for(self.aget_sql_query(question), sql_timeout)
+        except asyncio.TimeoutError:
+            raise TimeoutError(f"SQL generation timed out after {sql_timeout:.0f}s") from None
+
+        result_task = asyncio.ensure_future(self.aget_query_result(sql, timeout=db_timeout))
+        explanation_task = asyncio.ensure_future(
+            asyncio.wait_for(self.aget_explanation(question, sql), explain_timeout)
+        )
+        try:
+            result, explanation = await asyncio.gather(result_task, explanation_task, return_exceptions=True)
+        except asyncio.CancelledError:
+            result_task.cancel()
+            explanation_task.cancel()
+            raise
+
+        if isinstance(result, BaseException):
+            result = f"❌ SQL Execution Error: {result}"
+            self._forget_sql(sql)
+        if isinstance(explanation, asyncio.TimeoutError):
+            explanation = f"⚠️ Explanation unavailable: timed out after {explain_timeout:.0f}s"
+        elif isinstance(explanation, BaseException):
+            explanation = f"⚠️ Explanation unavailable: {explanation}"
 
         return {
             "sql": sql,
             "result": result,
             "explanation": explanation
         }
+
+    def get_full_response(self, question):
+        return _run_sync(self.aget_full_response(question))
     # def get_full_response(self, user_question):
     #     # Get the raw response from the LLM
     #     raw_response = self.llm_chain.run(user_question)
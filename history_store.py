@@ -0,0 +1,298 @@
+import atexit
+import os
+import pickle
+import shutil
+import tempfile
+import threading
+import uuid
+import weakref
+from collections import OrderedDict
+
+from result_cache import _frame_bytes
+from schema_cache import SCHEMA_CACHE_DIR
+
+# Bytes of result DataFrames kept in memory across all chat sessions of the
+# process; older results beyond it are spilled to disk.
+HISTORY_MEMORY_BYTES = int(os.getenv("HISTORY_MEMORY_BYTES", str(128 * 1024 * 1024)))
+# Answers kept per chat session; older ones are forgotten (and their files deleted).
+HISTORY_MAX_ENTRIES = int(os.getenv("HISTORY_MAX_ENTRIES", "100"))
+# Rows shown per page when a result is displayed.
+HISTORY_PAGE_ROWS = int(os.getenv("HISTORY_PAGE_ROWS", "500"))
+HISTORY_SPILL_DIR = os.getenv("HISTORY_SPILL_DIR", os.path.join(SCHEMA_CACHE_DIR, "history"))
+
+
+def _write_spill(frame, path):
+    """
+    Writes the frame as uncompressed Feather (readable memory-mapped, one
+    column at a time) and returns the format used. Columns are stored under
+    positional names, so duplicate or non-string names survive; frames Arrow
+    can't represent (e.g. mixed-type object columns) are pickled instead.
+    """
+    try:
+        import pyarrow as pa
+        import pyarrow.feather as feather
+
+        table = pa.Table.from_pandas(frame.set_axis([f"c{i}" for i in range(frame.shape[1])], axis=1),
+                                     preserve_index=False)
+        feather.write_feather(table, path, compression="uncompressed")
+        return "feather"
+    except Exception:
+        frame.to_pickle(path)
+        return "pickle"
+
+
+class ResultSpool:
+    """
+    Process-wide home of the result DataFrames shown in chat histories.
+
+    Results are kept in memory up to ``memory_bytes`` in total (across every
+    session); beyond that the least recently used ones are written to files in
+    ``spill_dir`` and read back memory-mapped when they are shown again. A page
+    of a spilled result is read without loading the rest of it.
+    Returned frames are shared and must not be mutated.
+    """
+
+    def __init__(self, memory_bytes=HISTORY_MEMORY_BYTES, spill_dir=HISTORY_SPILL_DIR):
+        self.memory_bytes = memory_bytes
+        self.spill_root = spill_dir
+        self._spill_dir = None
+        self._frames = OrderedDict()
+        self._writing = {}
+        self._meta = {}
+        self.memory_used = 0
+        self.spilled = 0
+        self.loaded = 0
+        self._lock = threading.Lock()
+
+    def _path(self, result_id):
+        if self._spill_dir is None:
+            os.makedirs(self.spill_root, exist_ok=True)
+            # One directory per process; it is removed when the process exits
+            self._spill_dir = tempfile.mkdtemp(prefix=f"{os.getpid()}-", dir=self.spill_root)
+            atexit.register(shutil.rmtree, self._spill_dir, True)
+        return os.path.join(self._spill_dir, result_id)
+
+    def _evict(self, keep=None):
+        """
+        Takes least recently used frames out of memory until it is under
+        budget. Called with the lock held; returns the (result_id, frame, path)
+        still to be written with _spill once the lock is released.
+        """
+        pending = []
+        for result_id in list(self._frames):
+            if self.memory_used <= self.memory_bytes:
+                break
+            if result_id == keep:
+                continue
+            meta = self._meta[result_id]
+            frame = self._frames.pop(result_id)
+            self.memory_used -= meta["bytes"]
+            if meta["path"] is None:
+                meta["path"] = self._path(result_id)
+                # Still served from here until its file is complete
+                self._writing[result_id] = frame
+                pending.append((result_id, frame, meta["path"]))
+        return pending
+
+    def _spill(self, pending):
+        """Writes evicted frames to disk without holding the lock."""
+        for result_id, frame, path in pending:
+            spill_format = _write_spill(frame, path)
+            with self._lock:
+                del self._writing[result_id]
+                meta = self._meta.get(result_id)
+                if meta is not None:
+                    meta["format"] = spill_format
+                    self.spilled += 1
+                    continue
+            # Released while it was being written
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def put(self, frame):
+        """Takes ownership of a result DataFrame; returns its id."""
+        result_id = uuid.uuid4().hex
+        size = _frame_bytes(frame)
+        with self._lock:
+            self._meta[result_id] = {
+                "bytes": size,
+                "rows": len(frame),
+                "columns": list(frame.columns),
+                "attrs": dict(frame.attrs),
+                "path": None,
+                "format": None
+            }
+            self._frames[result_id] = frame
+            self.memory_used += size
+            pending = self._evict()
+        self._spill(pending)
+        return result_id
+
+    def _read(self, meta, start=None, stop=None):
+        if meta["format"] == "pickle":
+            import pandas as pd
+
+            frame = pd.read_pickle(meta["path"])
+            return frame if start is None else frame.iloc[start:stop]
+
+        import pyarrow.feather as feather
+
+        table = feather.read_table(meta["path"], memory_map=True)
+        if start is not None:
+            table = table.slice(start, stop - start)
+        frame = table.to_pandas()
+        frame.columns = meta["columns"]
+        if start:
+            frame.index = range(start, start + len(frame))
+        frame.attrs = dict(meta["attrs"])
+        return frame
+
+    def _in_memory(self, result_id):
+        """The frame when it is in memory (or still being spilled); lock held."""
+        frame = self._frames.get(result_id)
+        if frame is not None:
+            self._frames.move_to_end(result_id)
+            return frame
+        return self._writing.get(result_id)
+
+    def get(self, result_id):
+        """The whole result; a spilled one is read back into memory (outside the lock)."""
+        with self._lock:
+            meta = self._meta[result_id]
+            frame = self._in_memory(result_id)
+            if frame is not None:
+                return frame
+        frame = self._read(meta)
+        with self._lock:
+            self.loaded += 1
+            if result_id in self._frames or result_id not in self._meta:
+                return self._frames.get(result_id, frame)  # loaded by another caller, or released
+            self._frames[result_id] = frame
+            self.memory_used += meta["bytes"]
+            pending = self._evict(keep=result_id)
+        self._spill(pending)
+        return frame
+
+    def page(self, result_id, page, page_rows=HISTORY_PAGE_ROWS):
+        """Rows [page * page_rows, (page + 1) * page_rows) of a result, without loading a spilled one whole."""
+        start = page * page_rows
+        with self._lock:
+            meta = self._meta[result_id]
+            stop = min(start + page_rows, meta["rows"])
+            frame = self._in_memory(result_id)
+            if frame is not None:
+                return frame.iloc[start:stop]
+        return self._read(meta, start, max(stop, start))
+
+    def info(self, result_id):
+        """{"rows", "columns", "attrs", "spilled"} without touching the data."""
+        with self._lock:
+            meta = self._meta[result_id]
+            return {"rows": meta["rows"], "columns": meta["columns"], "attrs": meta["attrs"],
+                    "spilled": result_id not in self._frames}
+
+    def release(self, result_ids):
+        """Forgets results (and deletes their files)."""
+        with self._lock:
+            for result_id in list(result_ids):
+                meta = self._meta.pop(result_id, None)
+                if meta is None:
+                    continue
+                if self._frames.pop(result_id, None) is not None:
+                    self.memory_used -= meta["bytes"]
+                if meta["path"] is not None:
+                    try:
+                        os.remove(meta["path"])
+                    except OSError:
+                        pass
+
+    def stats(self):
+        with self._lock:
+            return {
+                "results": len(self._meta),
+                "in_memory": len(self._frames),
+                "memory_bytes": self.memory_used,
+                "memory_budget": self.memory_bytes,
+                "spilled": self.spilled,
+                "loaded_back": self.loaded
+            }
+
+
+class ChatHistory:
+    """
+    One session's answers, newest last, bounded to ``max_entries``. Entries
+    are dicts with the question, query, explanation, timings and trace; the
+    result DataFrame lives in the ResultSpool and is fetched with ``result``
+    or ``page``. Error results (strings) are kept in the entry as "error".
+    """
+
+    def __init__(self, spool=None, max_entries=HISTORY_MAX_ENTRIES):
+        self.spool = spool or get_result_spool()
+        self.max_entries = max_entries
+        self.entries = []
+        self._result_ids = set()
+        # A session that is simply abandoned still gives its results back
+        weakref.finalize(self, self.spool.release, self._result_ids)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __iter__(self):
+        return iter(self.entries)
+
+    def append(self, question, query, result, explanation, timings=None, trace=None):
+        entry = {
+            "id": uuid.uuid4().hex[:12],
+            "question": question,
+            "query": query,
+            "explanation": explanation,
+            "timings": timings or {},
+            "trace": trace or []
+        }
+        if isinstance(result, str):
+            entry["error"] = result
+        else:
+            entry["result_id"] = self.spool.put(result)
+            entry["rows"] = len(result)
+            self._result_ids.add(entry["result_id"])
+        self.entries.append(entry)
+        while len(self.entries) > self.max_entries:
+            self._forget(self.entries.pop(0))
+        return entry
+
+    def _forget(self, entry):
+        if "result_id" in entry:
+            self.spool.release([entry["result_id"]])
+            self._result_ids.discard(entry["result_id"])
+
+    def result(self, entry):
+        """The entry's result DataFrame, or its error message."""
+        if "error" in entry:
+            return entry["error"]
+        return self.spool.get(entry["result_id"])
+
+    def page(self, entry, page, page_rows=HISTORY_PAGE_ROWS):
+        """One page of the entry's result, or its error message."""
+        if "error" in entry:
+            return entry["error"]
+        return self.spool.page(entry["result_id"], page, page_rows)
+
+    def clear(self):
+        for entry in self.entries:
+            self._forget(entry)
+        self.entries = []
+
+
+_shared_spool = None
+_shared_lock = threading.Lock()
+
+
+def get_result_spool():
+    """Returns the process-wide ResultSpool."""
+    global _shared_spool
+    with _shared_lock:
+        if _shared_spool is None:
+            _shared_spool = ResultSpool()
+        return _shared_spool
@@ -0,0 +1,536 @@
+"""
+Recommends indexes for the queries the bot actually runs, from the workload
+log (workload.py).
+
+    python index_advisor.py                          # from the log alone
+    python index_advisor.py --connect --top 10       # also asks SQL Server (DMVs, plans, existing indexes)
+    python index_advisor.py --database RetailDB --json advice.json
+
+Query shapes (statements that differ only in their literals) are ranked by
+total time, i.e. calls x average duration. For the hottest shapes a covering
+index is proposed per table: equality and join columns first, then one range
+column (or else the GROUP BY / ORDER BY columns), with the other columns the
+query reads as INCLUDE columns. Proposals that share a key prefix are merged.
+
+With --connect, SQL Server's own suggestions are added: the missing-index
+DMVs and the MissingIndexes of each hot shape's estimated plan (with the
+tables it scans). Proposals an existing index already covers are dropped.
+Aggregating shapes over inner joins also get an indexed view.
+
+Nothing is created: the report lists the CREATE statements to review.
+Connection settings come from --server/--database/--username/--password or
+the SERVER/DATABASE/SQL_USERNAME/SQL_PASSWORD environment variables (.env is read).
+"""
+import argparse
+import json
+import os
+import sys
+import time
+import xml.etree.ElementTree as ET
+
+from dotenv import load_dotenv
+from tabulate import tabulate
+
+from connect import connect_to_database
+from pool import borrow
+from query_guard import SHOWPLAN_NS, parse_showplan, showplan_xml
+from sql_validator import _parser, _table_name
+from workload import ROLES, WORKLOAD_LOG_PATH, plan_statement, read_workload
+
+# Hottest shapes the recommendations are made for.
+ADVISOR_TOP_SHAPES = int(os.getenv("ADVISOR_TOP_SHAPES", "10"))
+# INCLUDE lists wider than this are left out: the index would copy most of the table.
+ADVISOR_MAX_INCLUDE = int(os.getenv("ADVISOR_MAX_INCLUDE", "8"))
+
+_MISSING_INDEXES_SQL = """
+    SELECT s.name, t.name, d.equality_columns, d.inequality_columns, d.included_columns,
+           gs.user_seeks, gs.user_scans, gs.avg_total_user_cost, gs.avg_user_impact
+    FROM sys.dm_db_missing_index_details d
+    JOIN sys.dm_db_missing_index_groups g ON g.index_handle = d.index_handle
+    JOIN sys.dm_db_missing_index_group_stats gs ON gs.group_handle = g.index_group_handle
+    JOIN sys.tables t ON t.object_id = d.object_id
+    JOIN sys.schemas s ON s.schema_id = t.schema_id
+    WHERE d.database_id = DB_ID();
+"""
+
+_EXISTING_INDEXES_SQL = """
+    SELECT s.name, t.name, i.name, i.type, c.name, ic.key_ordinal, ic.is_included_column
+    FROM sys.indexes i
+    JOIN sys.index_columns ic ON ic.object_id = i.object_id AND ic.index_id = i.index_id
+    JOIN sys.columns c ON c.object_id = ic.object_id AND c.column_id = ic.column_id
+    JOIN sys.tables t ON t.object_id = i.object_id AND t.is_ms_shipped = 0
+    JOIN sys.schemas s ON s.schema_id = t.schema_id
+    WHERE i.type IN (1, 2) AND i.is_disabled = 0 AND i.is_hypothetical = 0
+    ORDER BY s.name, t.name, i.name, ic.key_ordinal;
+"""
+
+_SCAN_OPERATORS = {"Table Scan", "Clustered Index Scan", "Index Scan"}
+
+
+def _unique(values):
+    return list(dict.fromkeys(values))
+
+
+def summarize_shapes(records, database=None, since=None):
+    """
+    Groups logged statements by (database, shape), most total time first.
+
+    Returns:
+        list of {"shape_id", "database", "shape", "calls", "errors", "total_ms", "avg_ms", "max_ms", "avg_rows", "share",
+        "tables", "columns": {"schema.table": {role: [...], "star"}}}
+    """
+    shapes = {}
+    for record in records:
+        if database and (record.get("database") or "").lower() != database.lower():
+            continue
+        if since and record.get("ts", 0) < since:
+            continue
+        key = ((record.get("database") or "").lower(), record["shape_id"])
+        shape = shapes.get(key)
+        if shape is None:
+            shape = shapes[key] = {
+                "shape_id": record["shape_id"], "database": record.get("database"), "shape": record["shape"],
+                "calls": 0, "errors": 0, "total_ms": 0.0, "max_ms": 0.0, "rows": 0,
+                "tables": set(), "columns": {}
+            }
+        shape["calls"] += 1
+        ms = record.get("ms") or 0.0
+        shape["total_ms"] += ms
+        shape["max_ms"] = max(shape["max_ms"], ms)
+        shape["rows"] += record.get("rows") or 0
+        if record.get("status") == "error":
+            shape["errors"] += 1
+        shape["tables"].update(record.get("tables", ()))
+        for table, usage in (record.get("columns") or {}).items():
+            merged = shape["columns"].setdefault(table, {"star": False})
+            merged["star"] = merged["star"] or usage.get("star", False)
+            for role in ROLES:
+                if usage.get(role):
+                    merged[role] = _unique(merged.get(role, []) + usage[role])
+
+    total_ms = sum(shape["total_ms"] for shape in shapes.values()) or 1.0
+    for shape in shapes.values():
+        shape["avg_ms"] = shape["total_ms"] / shape["calls"]
+        shape["avg_rows"] = shape.pop("rows") / shape["calls"]
+        shape["share"] = shape["total_ms"] / total_ms
+        shape["tables"] = sorted(shape["tables"])
+    return sorted(shapes.values(), key=lambda shape: shape["total_ms"], reverse=True)
+
+
+def _column_list(text):
+    """'[a], [b]' as returned by the missing-index DMVs -> ['a', 'b']."""
+    return [name.strip().strip("[]").lower() for name in text.split(",")] if text else []
+
+
+def fetch_missing_indexes(conn):
+    """
+    SQL Server's missing-index suggestions for the current database, as
+    {"table", "keys" (equality then inequality columns), "include", "impact",
+    "improvement"}; improvement is the usual seeks x cost x impact measure.
+    """
+    suggestions = []
+    with borrow(conn) as conn:
+        cursor = conn.cursor()
+        try:
+            cursor.execute(_MISSING_INDEXES_SQL)
+            rows = cursor.fetchall()
+        finally:
+            cursor.close()
+    for schema, table, equality, inequality, included, seeks, scans, cost, impact in rows:
+        suggestions.append({
+            "table": f"{schema.lower()}.{table.lower()}",
+            "keys": _column_list(equality) + _column_list(inequality),
+            "include": _column_list(included),
+            "impact": float(impact or 0),
+            "improvement": float(cost or 0) * float(impact or 0) / 100 * ((seeks or 0) + (scans or 0))
+        })
+    return suggestions
+
+
+def fetch_existing_indexes(conn):
+    """
+    Clustered and nonclustered indexes per table, as {"schema.table":
+    [{"name", "keys", "include"}]}; a clustered index includes "*".
+    """
+    indexes = {}
+    with borrow(conn) as conn:
+        cursor = conn.cursor()
+        try:
+            cursor.execute(_EXISTING_INDEXES_SQL)
+            rows = cursor.fetchall()
+        finally:
+            cursor.close()
+    for schema, table, name, index_type, column, key_ordinal, is_included in rows:
+        table_indexes = indexes.setdefault(f"{schema.lower()}.{table.lower()}", {})
+        index = table_indexes.setdefault(name, {"name": name, "keys": [], "include": "*" if index_type == 1 else set()})
+        if is_included:
+            index["include"].add(column.lower())
+        elif key_ordinal:
+            index["keys"].append(column.lower())
+    return {table: list(table_indexes.values()) for table, table_indexes in indexes.items()}
+
+
+def _plan_table(element):
+    schema, table = element.get("Schema"), element.get("Table")
+    if not table:
+        return None
+    return f"{(schema or '[dbo]').strip('[]').lower()}.{table.strip('[]').lower()}"
+
+
+def plan_details(xml_text):
+    """
+    What an estimated plan says about indexing: {"cost", "rows", "scans"
+    (tables read by a scan operator), "missing" (its MissingIndexes, in the
+    form fetch_missing_indexes uses)}.
+    """
+    root = ET.fromstring(xml_text)
+    statements = parse_showplan(xml_text)
+    scans = []
+    for operator in root.iter(f"{SHOWPLAN_NS}RelOp"):
+        if operator.get("PhysicalOp") in _SCAN_OPERATORS:
+            target = operator.find(f".//{SHOWPLAN_NS}Object")
+            table = _plan_table(target) if target is not None else None
+            if table:
+                scans.append(table)
+    missing = []
+    for group in root.iter(f"{SHOWPLAN_NS}MissingIndexGroup"):
+        impact = float(group.get("Impact") or 0)
+        for index in group.iter(f"{SHOWPLAN_NS}MissingIndex"):
+            usage = {"EQUALITY": [], "INEQUALITY": [], "INCLUDE": []}
+            for column_group in index.iter(f"{SHOWPLAN_NS}ColumnGroup"):
+                usage.setdefault(column_group.get("Usage"), []).extend(
+                    column.get("Name").strip("[]").lower() for column in column_group.iter(f"{SHOWPLAN_NS}Column"))
+            missing.append({"table": _plan_table(index), "keys": usage["EQUALITY"] + usage["INEQUALITY"],
+                            "include": usage["INCLUDE"], "impact": impact})
+    return {
+        "cost": sum(statement["cost"] for statement in statements),
+        "rows": max((statement["rows"] for statement in statements), default=0.0),
+        "scans": _unique(scans),
+        "missing": missing
+    }
+
+
+def fetch_plans(conn, shapes):
+    """
+    plan_details of each shape, compiled with its literals as parameters
+    (workload.plan_statement), keyed by shape id; shapes whose plan fails
+    are skipped.
+    """
+    plans = {}
+    for shape in shapes:
+        try:
+            details = [plan_details(plan) for plan in showplan_xml(conn, *plan_statement(shape["shape"]))]
+        except Exception as e:
+            print(f"⚠️ No plan for shape {shape['shape_id']}: {e}")
+            continue
+        plans[shape["shape_id"]] = {
+            "cost": sum(d["cost"] for d in details),
+            "rows": max((d["rows"] for d in details), default=0.0),
+            "scans": _unique(table for d in details for table in d["scans"]),
+            "missing": [index for d in details for index in d["missing"]]
+        }
+    return plans
+
+
+def workload_index(table, usage):
+    """
+    The index a shape's use of a table asks for, or None when it has no
+    seekable or ordered column: {"table", "keys", "include" (None after SELECT *)}.
+    """
+    keys = _unique(usage.get("equality", []) + usage.get("join", []))
+    ranges = [column for column in usage.get("range", []) if column not in keys]
+    if ranges:
+        keys.append(ranges[0])
+    else:
+        keys = _unique(keys + usage.get("group", []) + usage.get("order", []))
+    if not keys:
+        return None
+    include = None
+    if not usage.get("star"):
+        include = [column for column in _unique(c for role in ROLES for c in usage.get(role, [])) if column not in keys]
+    return {"table": table, "keys": keys, "include": include}
+
+
+def _merge(recommendations, candidate, shape, source):
+    """Adds a candidate index for a shape, folding it into a recommendation with the same key prefix."""
+    keys, include = candidate["keys"], candidate.get("include")
+    for recommendation in recommendations:
+        if recommendation["table"] != candidate["table"]:
+            continue
+        shorter, longer = sorted((recommendation["keys"], keys), key=len)
+        if longer[:len(shorter)] != shorter:
+            continue
+        recommendation["keys"] = list(longer)
+        break
+    else:
+        recommendation = {"table": candidate["table"], "keys": list(keys), "include": [], "star": False,
+                          "sources": [], "shapes": [], "calls": 0, "total_ms": 0.0, "impact": 0.0,
+                          "improvement": 0.0}
+        recommendations.append(recommendation)
+    if include is None:
+        recommendation["star"] = True
+    recommendation["include"] = [column for column in _unique(recommendation["include"] + (include or []))
+                                 if column not in recommendation["keys"]]
+    recommendation["sources"] = _unique(recommendation["sources"] + [source])
+    recommendation["impact"] = max(recommendation["impact"], candidate.get("impact", 0.0))
+    recommendation["improvement"] += candidate.get("improvement", 0.0)
+    if shape is not None and shape["shape_id"] not in recommendation["shapes"]:
+        recommendation["shapes"].append(shape["shape_id"])
+        recommendation["calls"] += shape["calls"]
+        recommendation["total_ms"] += shape["total_ms"]
+
+
+def _covering_index(recommendation, indexes):
+    """(name, covers) of an existing index whose leading keys are the recommendation's keys."""
+    keys = recommendation["keys"]
+    for index in indexes:
+        if set(index["keys"][:len(keys)]) != set(keys):
+            continue
+        if index["include"] == "*" or set(recommendation["include"]) <= set(index["keys"]) | index["include"]:
+            return index["name"], True
+        return index["name"], False
+    return None, False
+
+
+def index_ddl(recommendation):
+    schema, table = recommendation["table"].split(".", 1)
+    name = f"IX_{table}_{'_'.join(recommendation['keys'])}"[:128]
+    sql = (f"CREATE NONCLUSTERED INDEX [{name}] ON [{schema}].[{table}] "
+           f"({', '.join(f'[{column}]' for column in recommendation['keys'])})")
+    if recommendation["include"]:
+        sql += f" INCLUDE ({', '.join(f'[{column}]' for column in recommendation['include'])})"
+    return sql + ";"
+
+
+def indexed_view(shape):
+    """
+    An indexed view pre-aggregating an aggregating shape: CREATE VIEW ... WITH
+    SCHEMABINDING plus its unique clustered index, or None when the shape
+    doesn't qualify (needs sqlglot, one SELECT with GROUP BY over inner joins
+    of tables, SUM / COUNT / AVG only, no subqueries, DISTINCT or window
+    functions). WHERE columns are added to the grouping, so the query can
+    still filter the view on any values.
+    """
+    sqlglot = _parser()
+    if not sqlglot:
+        return None
+    from sqlglot import exp
+
+    try:
+        statements = sqlglot.parse(shape["shape"], read="tsql")
+    except sqlglot.errors.ParseError:
+        return None
+    select = statements[0] if len(statements) == 1 else None
+    if not isinstance(select, exp.Select) or not select.args.get("group") or select.args.get("with") \
+            or select.args.get("distinct"):
+        return None
+    if any(node is not select for node in select.find_all(exp.Query)) or select.find(exp.Window) \
+            or select.find(exp.CurrentTimestamp, exp.CurrentDate, exp.Rand, exp.Anonymous):
+        return None
+    if any(node.find_ancestor(exp.Where) is None for node in select.find_all(exp.Placeholder)):
+        return None  # a value outside WHERE, which the logged shape doesn't have
+    for join in select.args.get("joins") or []:
+        if join.side or join.kind not in ("", "INNER") or not join.args.get("on"):
+            return None
+    for table in select.find_all(exp.Table):
+        if not isinstance(table.this, exp.Identifier) or _table_name(table).startswith(("#", "@")) or table.catalog:
+            return None
+        if not table.db:
+            # Schema-bound views need two-part names
+            table.set("db", exp.to_identifier("dbo"))
+
+    groups = {node.sql(dialect="tsql"): node for node in select.args["group"].expressions}
+    measures = []
+    for projection in select.expressions:
+        node = projection.unalias()
+        aggregate = node.find(exp.AggFunc)
+        if aggregate is None:
+            if node.sql(dialect="tsql") not in groups:
+                return None
+            continue
+        if aggregate is not node or not isinstance(node, (exp.Sum, exp.Count, exp.Avg)) \
+                or node.find(exp.Distinct):
+            return None
+        argument = node.this
+        if isinstance(node, exp.Count):
+            if not isinstance(argument, exp.Star):
+                measures.append(f"SUM(CASE WHEN {argument.sql(dialect='tsql')} IS NULL THEN 0 ELSE 1 END)")
+        else:
+            # Indexed views can't SUM a nullable expression
+            measures.append(f"SUM(ISNULL({argument.sql(dialect='tsql')}, 0))")
+    where = select.args.get("where")
+    for column in (where.find_all(exp.Column) if where else ()):
+        groups.setdefault(column.sql(dialect="tsql"), column)
+
+    names, grouping = set(), []
+    for index, (text, node) in enumerate(groups.items()):
+        name = node.name.lower() if isinstance(node, exp.Column) else f"group_{index + 1}"
+        if name in names:
+            qualified = isinstance(node, exp.Column) and node.table
+            name = f"{node.table.lower()}_{name}" if qualified else f"group_{index + 1}"
+        names.add(name)
+        grouping.append((text, name))
+    measures = _unique(measures)
+
+    view = f"v_{shape['shape_id']}"
+    columns = [f"{text} AS [{name}]" for text, name in grouping]
+    columns += [f"{measure} AS [measure_{index + 1}]" for index, measure in enumerate(measures)]
+    columns.append("COUNT_BIG(*) AS [row_count]")
+    source = select.args.get("from_") or select.args.get("from")  # renamed in newer sqlglot
+    joins = " ".join(join.sql(dialect="tsql") for join in select.args.get("joins") or [])
+    return (f"CREATE VIEW [dbo].[{view}] WITH SCHEMABINDING AS\n"
+            f"SELECT {', '.join(columns)}\n"
+            f"{source.sql(dialect='tsql')}{' ' + joins if joins else ''}\n"
+            f"GROUP BY {', '.join(text for text, _ in grouping)};\n"
+            f"GO\n"
+            f"CREATE UNIQUE CLUSTERED INDEX [IX_{view}] ON [dbo].[{view}] "
+            f"({', '.join(f'[{name}]' for _, name in grouping)});")
+
+
+def advise(shapes, top=ADVISOR_TOP_SHAPES, missing=(), plans=None, existing=None):
+    """
+    Recommendations for the ``top`` hottest shapes (summarize_shapes order),
+    combining the workload's column usage with SQL Server's missing-index
+    suggestions (``missing``, ``plans``) and skipping what ``existing``
+    indexes already cover.
+
+    Returns:
+        dict: {"shapes", "indexes": [{"table", "keys", "include", "ddl", "sources", "shapes", "calls",
+        "total_ms", "impact", "improvement", "notes"}], "views": [{"shape_id", "ddl"}], "covered": [...]}
+    """
+    hot = shapes[:top]
+    plans = plans or {}
+    recommendations = []
+    for shape in hot:
+        if shape["errors"] == shape["calls"]:
+            continue  # never ran successfully; nothing to tune
+        for table, usage in shape["columns"].items():
+            candidate = workload_index(table, usage)
+            if candidate is not None:
+                _merge(recommendations, candidate, shape, "workload")
+        for suggestion in plans.get(shape["shape_id"], {}).get("missing", []):
+            if suggestion["table"]:
+                _merge(recommendations, suggestion, shape, "plan")
+    for suggestion in missing:
+        # Only the DMV suggestions the bot's own queries would use
+        for shape in hot:
+            usage = shape["columns"].get(suggestion["table"])
+            used = {column for role in ROLES for column in (usage or {}).get(role, [])}
+            if usage is not None and set(suggestion["keys"]) <= used:
+                _merge(recommendations, suggestion, shape, "dmv")
+
+    indexes, covered = [], []
+    for recommendation in recommendations:
+        notes = []
+        name, covers = _covering_index(recommendation, (existing or {}).get(recommendation["table"], []))
+        if covers:
+            covered.append({"table": recommendation["table"], "keys": recommendation["keys"], "index": name})
+            continue
+        if name:
+            notes.append(f"or add the INCLUDE columns to the existing index {name}")
+        if recommendation["star"]:
+            notes.append("a SELECT * shape reads this table, so the index can't cover it")
+        if len(recommendation["include"]) > ADVISOR_MAX_INCLUDE:
+            notes.append(f"INCLUDE left out: the queries read {len(recommendation['include'])} columns")
+            recommendation["include"] = []
+        for shape in hot:
+            plan = plans.get(shape["shape_id"])
+            if plan and shape["shape_id"] in recommendation["shapes"] and recommendation["table"] in plan["scans"]:
+                notes.append(f"the plan of {shape['shape_id']} scans this table")
+                break
+        del recommendation["star"]
+        indexes.append(dict(recommendation, ddl=index_ddl(recommendation), notes=notes))
+    indexes.sort(key=lambda index: (index["total_ms"], index["improvement"]), reverse=True)
+
+    views = []
+    for shape in hot:
+        ddl = indexed_view(shape)
+        if ddl is not None:
+            views.append({"shape_id": shape["shape_id"], "calls": shape["calls"], "total_ms": shape["total_ms"],
+                          "ddl": ddl})
+    return {"shapes": hot, "indexes": indexes, "views": views, "covered": covered}
+
+
+def format_report(advice, total_calls):
+    lines = [f"📊 {total_calls:,} logged statements; top {len(advice['shapes'])} shapes by total time:", ""]
+    lines.append(tabulate(
+        [(shape["shape_id"], shape["calls"], f"{shape['total_ms'] / 1000:,.2f}", f"{shape['share']:.0%}",
+          f"{shape['avg_ms']:,.1f}", f"{shape['avg_rows']:,.0f}", shape["shape"][:90])
+         for shape in advice["shapes"]],
+        headers=["shape", "calls", "total s", "share", "avg ms", "avg rows", "SQL"], tablefmt="simple",
+        disable_numparse=True
+    ))
+    lines.append("")
+    if not advice["indexes"] and not advice["views"]:
+        lines.append("✅ No index recommendations for these shapes.")
+    for number, index in enumerate(advice["indexes"], 1):
+        detail = (f"{len(index['shapes'])} shape(s), {index['calls']:,} calls, "
+                  f"{index['total_ms'] / 1000:,.2f}s of query time; from {', '.join(index['sources'])}")
+        if index["impact"]:
+            detail += f", estimated impact {index['impact']:.0f}%"
+        lines.append(f"💡 {number}. {index['ddl']}")
+        lines.append(f"     {detail}")
+        for note in index["notes"]:
+            lines.append(f"     note: {note}")
+    for view in advice["views"]:
+        lines.append(f"\n🧮 Indexed view for shape {view['shape_id']} ({view['calls']:,} calls); pays off when its "
+                     f"tables are read far more often than written (use WITH (NOEXPAND) outside Enterprise edition):")
+        lines.append(view["ddl"])
+    for entry in advice["covered"]:
+        lines.append(f"✔️ {entry['table']} ({', '.join(entry['keys'])}) is already covered by {entry['index']}")
+    return "\n".join(lines)
+
+
+def _fetch_or_warn(label, fetch, conn):
+    try:
+        return fetch(conn)
+    except Exception as e:
+        # e.g. no VIEW DATABASE STATE permission: advise from the log alone
+        print(f"⚠️ Could not read the {label}: {e}")
+        return None
+
+
+def main():
+    load_dotenv()
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--log", default=WORKLOAD_LOG_PATH, help="workload log (JSONL)")
+    parser.add_argument("--top", type=int, default=ADVISOR_TOP_SHAPES, help="hottest shapes to tune for")
+    parser.add_argument("--since-hours", type=float, help="only statements logged in the last N hours")
+    parser.add_argument("--connect", action="store_true",
+                        help="also read missing-index DMVs, estimated plans and existing indexes")
+    parser.add_argument("--json", help="also write the recommendations to this file")
+    parser.add_argument("--server", default=os.getenv("SERVER"))
+    parser.add_argument("--database", default=os.getenv("DATABASE"))
+    parser.add_argument("--username", default=os.getenv("SQL_USERNAME"))
+    parser.add_argument("--password", default=os.getenv("SQL_PASSWORD"))
+    args = parser.parse_args()
+
+    since = time.time() - args.since_hours * 3600 if args.since_hours else None
+    records = list(read_workload(args.log))
+    shapes = summarize_shapes(records, args.database, since)
+    if not shapes:
+        print(f"No statements in {args.log}" + (f" for {args.database}" if args.database else ""))
+        sys.exit(1)
+
+    missing, plans, existing = (), None, None
+    if args.connect:
+        if not all([args.server, args.database, args.username, args.password]):
+            parser.error("--connect needs server, database, username and password (arguments or environment)")
+        conn = connect_to_database(args.server, args.database, args.username, args.password)
+        try:
+            missing = _fetch_or_warn("missing-index DMVs", fetch_missing_indexes, conn) or ()
+            existing = _fetch_or_warn("existing indexes", fetch_existing_indexes, conn)
+            plans = fetch_plans(conn, shapes[:args.top])
+        finally:
+            conn.close()
+
+    advice = advise(shapes, args.top, missing, plans, existing)
+    print(format_report(advice, len(records)))
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(advice, f, indent=2, default=str)
+        print(f"\n📝 Recommendations written to {args.json}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,439 @@
+import asyncio
+import contextvars
+import heapq
+import itertools
+import os
+import random
+import re
+import threading
+import time
+from concurrent.futures import Future, TimeoutError as FutureTimeout
+from contextlib import contextmanager
+
+from telemetry import record_span
+
+# Provider quota (gemini-1.5-flash, pay-as-you-go); 0 disables a limit.
+LLM_REQUESTS_PER_MINUTE = int(os.getenv("LLM_REQUESTS_PER_MINUTE", "2000"))
+LLM_TOKENS_PER_MINUTE = int(os.getenv("LLM_TOKENS_PER_MINUTE", "4000000"))
+# Calls in progress at once; the limit moves between these bounds with the
+# observed latency and halves on every rate-limit response.
+LLM_MIN_CONCURRENCY = int(os.getenv("LLM_MIN_CONCURRENCY", "1"))
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "16"))
+LLM_TARGET_LATENCY = float(os.getenv("LLM_TARGET_LATENCY", "10"))
+# Calls allowed to wait for a slot, and for how long, before LLMBusy is raised.
+LLM_QUEUE_SIZE = int(os.getenv("LLM_QUEUE_SIZE", "64"))
+LLM_QUEUE_TIMEOUT = float(os.getenv("LLM_QUEUE_TIMEOUT", "30"))
+# Retries of rate-limited or transient failures, with full-jitter exponential backoff.
+LLM_RETRIES = int(os.getenv("LLM_RETRIES", "3"))
+LLM_RETRY_BACKOFF = float(os.getenv("LLM_RETRY_BACKOFF", "1"))
+LLM_RETRY_MAX_BACKOFF = float(os.getenv("LLM_RETRY_MAX_BACKOFF", "30"))
+# Response tokens reserved per call until the real usage is known.
+LLM_RESPONSE_TOKENS = 300
+
+# Priorities: lower runs first
+INTERACTIVE = 0
+BATCH = 1
+
+_priority = contextvars.ContextVar("llm_priority", default=INTERACTIVE)
+
+# Errors are recognised by HTTP status (an attribute, or a code leading the
+# message / following "status" or "code"), by exception type (google.api_core,
+# openai, httpx) and by a few unambiguous phrases; never by bare digits, which
+# may just be a row count or an ID in the message.
+_RATE_LIMIT_STATUS = {429}
+_TRANSIENT_STATUS = {500, 502, 503, 504}
+_STATUS_IN_MESSAGE = re.compile(r"^\s*(\d{3})\b|\b(?:status|code)\b[\s:=]*(\d{3})\b")
+_RATE_LIMIT_TYPES = {"ResourceExhausted", "TooManyRequests", "RateLimitError"}
+_TRANSIENT_TYPES = {"ServiceUnavailable", "InternalServerError", "DeadlineExceeded", "BadGateway", "GatewayTimeout",
+                    "APIConnectionError", "APITimeoutError", "ConnectError", "ConnectTimeout", "ReadTimeout"}
+_RATE_LIMIT_PHRASES = ("resource exhausted", "resource has been exhausted", "quota", "rate limit",
+                       "too many requests")
+_TRANSIENT_PHRASES = ("service unavailable", "temporarily unavailable", "deadline exceeded", "timed out",
+                      "connection reset", "internal error")
+
+
+class LLMBusy(Exception):
+    """Raised when the model's queue is full or a call waited too long for a slot."""
+
+
+@contextmanager
+def llm_priority(priority):
+    """Runs the block's LLM calls (including tasks and threads started from it) at this priority."""
+    token = _priority.set(priority)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+def _status_code(error):
+    """The HTTP status of a provider error, or None."""
+    response = getattr(error, "response", None)
+    for value in (getattr(error, "status_code", None), getattr(error, "code", None),
+                  getattr(response, "status_code", None)):
+        if isinstance(value, int) and not isinstance(value, bool):
+            return value
+    match = _STATUS_IN_MESSAGE.search(str(error).lower())
+    return int(match.group(1) or match.group(2)) if match else None
+
+
+def classify_error(error):
+    """'rate_limited', 'transient' or None (not worth retrying)."""
+    if isinstance(error, LLMBusy):
+        return None
+    status = _status_code(error)
+    types = {cls.__name__ for cls in type(error).__mro__}
+    text = str(error).lower()
+    if status in _RATE_LIMIT_STATUS or types & _RATE_LIMIT_TYPES \
+            or any(phrase in text for phrase in _RATE_LIMIT_PHRASES):
+        return "rate_limited"
+    if status in _TRANSIENT_STATUS or isinstance(error, (TimeoutError, ConnectionError)) \
+            or types & _TRANSIENT_TYPES or any(phrase in text for phrase in _TRANSIENT_PHRASES):
+        return "transient"
+    return None
+
+
+def response_tokens(response, estimate):
+    """Tokens a call used: provider-reported usage when available, else the estimate."""
+    usage = getattr(response, "usage_metadata", None)
+    if usage and usage.get("total_tokens") is not None:
+        return usage["total_tokens"]
+    return estimate
+
+
+class TokenBucket:
+    """Refills at ``per_minute`` / 60 per second up to ``per_minute``; per_minute=0 is unlimited."""
+
+    def __init__(self, per_minute, clock=time.monotonic):
+        self.capacity = float(per_minute)
+        self.rate = per_minute / 60.0
+        self.level = self.capacity
+        self.updated = clock()
+
+    def _refill(self, now):
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount, now):
+        """Seconds until ``amount`` can be taken (0 when it can be now)."""
+        if not self.capacity:
+            return 0.0
+        self._refill(now)
+        amount = min(amount, self.capacity)
+        return 0.0 if self.level >= amount else (amount - self.level) / self.rate
+
+    def take(self, amount):
+        if self.capacity:
+            self.level -= min(amount, self.capacity)
+
+    def give(self, amount):
+        """Returns (or, when negative, charges) tokens after the real cost is known."""
+        if self.capacity:
+            self.level = min(self.capacity, self.level + amount)
+
+
+class _Ticket:
+    __slots__ = ("priority", "seq", "tokens", "future", "enqueued", "state")
+
+    def __init__(self, priority, seq, tokens):
+        self.priority = priority
+        self.seq = seq
+        self.tokens = tokens
+        self.future = Future()
+        self.enqueued = time.perf_counter()
+        self.state = "queued"
+
+    def __lt__(self, other):
+        return (self.priority, self.seq) < (other.priority, other.seq)
+
+
+class LLMScheduler:
+    """
+    Admission control in front of every LLM call of the process.
+
+    A call waits in a priority queue (interactive before batch, first come
+    first served within a priority) until a concurrency slot is free and the
+    request and token buckets allow it. The queue is bounded: when it is
+    full a new call gets LLMBusy at once, except that an interactive call
+    pushes out the newest waiting batch call. Rate-limited and transient
+    failures are retried with full-jitter exponential backoff; a rate-limit
+    response also halves the concurrency limit and pauses dispatching
+    briefly. Otherwise the limit grows by one per limit's worth of calls
+    answered within ``target_latency`` and shrinks by 10% when they are slower.
+    ``clock`` (seconds, monotonic) times the buckets, pauses and call latency.
+    """
+
+    def __init__(self, requests_per_minute=LLM_REQUESTS_PER_MINUTE, tokens_per_minute=LLM_TOKENS_PER_MINUTE,
+                 min_concurrency=LLM_MIN_CONCURRENCY, max_concurrency=LLM_MAX_CONCURRENCY,
+                 target_latency=LLM_TARGET_LATENCY, queue_size=LLM_QUEUE_SIZE, queue_timeout=LLM_QUEUE_TIMEOUT,
+                 retries=LLM_RETRIES, backoff=LLM_RETRY_BACKOFF, max_backoff=LLM_RETRY_MAX_BACKOFF,
+                 clock=time.monotonic):
+        self._clock = clock
+        self.requests = TokenBucket(requests_per_minute, clock)
+        self.tokens = TokenBucket(tokens_per_minute, clock)
+        self.min_concurrency = max(1, min_concurrency)
+        self.max_concurrency = max(self.min_concurrency, max_concurrency)
+        self.limit = float(self.max_concurrency) / 2 if self.max_concurrency > 1 else 1.0
+        self.target_latency = target_latency
+        self.queue_size = queue_size
+        self.queue_timeout = queue_timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.active = 0
+        self.paused_until = 0.0
+        self.granted = 0
+        self.busy = 0
+        self.retried = 0
+        self.rate_limited = 0
+        self.failed = 0
+        self._queue = []
+        self._queued = 0
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._dispatcher_pid = None
+
+    # --- dispatching -----------------------------------------------------
+
+    def _ensure_dispatcher(self):
+        """Starts the dispatcher thread (again in a forked child, which doesn't inherit it). Lock held."""
+        if self._dispatcher_pid != os.getpid():
+            self._dispatcher_pid = os.getpid()
+            threading.Thread(target=self._run, name="llm-scheduler", daemon=True).start()
+
+    def _run(self):
+        with self._cond:
+            while True:
+                self._cond.wait(self._dispatch())
+
+    def _dispatch(self):
+        """Grants queued tickets while limits allow; returns seconds until the next try (None: wait for a change)."""
+        while self._queue:
+            ticket = self._queue[0]
+            if ticket.state != "queued":
+                heapq.heappop(self._queue)
+                continue
+            if self.active >= max(1, int(self.limit)):
+                return None
+            now = self._clock()
+            wait = max(self.paused_until - now, self.requests.wait_time(1, now),
+                       self.tokens.wait_time(ticket.tokens, now))
+            if wait > 0:
+                return wait
+            heapq.heappop(self._queue)
+            self._queued -= 1
+            self.requests.take(1)
+            self.tokens.take(ticket.tokens)
+            self.active += 1
+            self.granted += 1
+            ticket.state = "granted"
+            ticket.future.set_result(None)
+        return None
+
+    def _enqueue(self, tokens, priority, seq=None):
+        """Queues a ticket; a retry keeps its place (``seq``) and is never refused."""
+        with self._cond:
+            self._ensure_dispatcher()
+            if seq is None and self._queued >= self.queue_size:
+                victim = max((t for t in self._queue if t.state == "queued"), default=None)
+                if victim is None or victim.priority <= priority:
+                    self.busy += 1
+                    raise LLMBusy(f"the model is busy ({self._queued} calls waiting); try again shortly")
+                self._drop(victim)
+                self.busy += 1
+                victim.future.set_exception(LLMBusy("the model is busy; batch call pushed out of the queue"))
+            ticket = _Ticket(priority, next(self._seq) if seq is None else seq, tokens)
+            heapq.heappush(self._queue, ticket)
+            self._queued += 1
+            self._cond.notify()
+            return ticket
+
+    def _drop(self, ticket):
+        # Removed lazily from the heap by _dispatch
+        ticket.state = "dropped"
+        self._queued -= 1
+
+    def _withdraw(self, ticket):
+        """Takes a waiting ticket out of the queue; False when it was granted meanwhile."""
+        with self._cond:
+            if ticket.state != "queued":
+                return False
+            self._drop(ticket)
+            return True
+
+    def _release(self, ticket, seconds=None, used_tokens=None, outcome=None):
+        """Frees the ticket's slot and adapts the limits to how the call went."""
+        with self._cond:
+            self.active -= 1
+            if used_tokens is not None:
+                self.tokens.give(ticket.tokens - used_tokens)
+            if outcome == "rate_limited":
+                self.rate_limited += 1
+                self.limit = max(self.min_concurrency, self.limit / 2)
+                pause = self.backoff * random.uniform(0.5, 1.0)
+                self.paused_until = max(self.paused_until, self._clock() + pause)
+            elif outcome == "transient":
+                self.limit = max(self.min_concurrency, self.limit * 0.9)
+            elif seconds is not None and outcome is None:
+                if seconds > self.target_latency:
+                    self.limit = max(self.min_concurrency, self.limit * 0.9)
+                else:
+                    self.limit = min(self.max_concurrency, self.limit + 1 / self.limit)
+            self._cond.notify()
+
+    def _waited(self, ticket, attempt):
+        record_span("llm.queue", time.perf_counter() - ticket.enqueued, priority=ticket.priority,
+                    attempt=attempt, tokens=ticket.tokens)
+
+    def _acquire(self, tokens, priority, attempt, seq=None):
+        ticket = self._enqueue(tokens, priority, seq)
+        try:
+            ticket.future.result(timeout=self.queue_timeout)
+        except FutureTimeout:
+            if self._withdraw(ticket):
+                with self._cond:
+                    self.busy += 1
+                raise LLMBusy(f"no model slot became free within {self.queue_timeout:.0f}s") from None
+        self._waited(ticket, attempt)
+        return ticket
+
+    async def _aacquire(self, tokens, priority, attempt, seq=None):
+        ticket = self._enqueue(tokens, priority, seq)
+        try:
+            # The shield keeps cancellation of this wait from cancelling the ticket's future
+            await asyncio.wait_for(asyncio.shield(asyncio.wrap_future(ticket.future)), self.queue_timeout)
+        except asyncio.TimeoutError:
+            if self._withdraw(ticket):
+                with self._cond:
+                    self.busy += 1
+                raise LLMBusy(f"no model slot became free within {self.queue_timeout:.0f}s") from None
+        except asyncio.CancelledError:
+            if not self._withdraw(ticket):
+                self._release(ticket)
+            raise
+        self._waited(ticket, attempt)
+        return ticket
+
+    def _retry_delay(self, ticket, error, seconds, attempt):
+        """Releases a failed call's slot; returns the backoff before retrying, or None to give up."""
+        outcome = classify_error(error)
+        self._release(ticket, seconds, outcome=outcome or "failed")
+        if outcome is None or attempt > self.retries:
+            with self._cond:
+                self.failed += 1
+            return None
+        with self._cond:
+            self.retried += 1
+        return random.uniform(0, min(self.max_backoff, self.backoff * 2 ** (attempt - 1)))
+
+    # --- calls -----------------------------------------------------------
+
+    def call(self, fn, tokens=0):
+        """Runs fn() (one model call of about ``tokens`` prompt tokens) under the limits, with retries."""
+        tokens += LLM_RESPONSE_TOKENS
+        priority, seq = _priority.get(), None
+        for attempt in itertools.count(1):
+            ticket = self._acquire(tokens, priority, attempt, seq)
+            seq = ticket.seq
+            started = self._clock()
+            try:
+                response = fn()
+            except Exception as e:
+                delay = self._retry_delay(ticket, e, self._clock() - started, attempt)
+                if delay is None:
+                    raise
+                time.sleep(delay)
+                continue
+            except BaseException:
+                self._release(ticket, outcome="cancelled")
+                raise
+            self._release(ticket, self._clock() - started, response_tokens(response, tokens))
+            return response
+
+    async def acall(self, fn, tokens=0):
+        """Async call: awaits fn() (a coroutine function)."""
+        tokens += LLM_RESPONSE_TOKENS
+        priority, seq = _priority.get(), None
+        for attempt in itertools.count(1):
+            ticket = await self._aacquire(tokens, priority, attempt, seq)
+            seq = ticket.seq
+            started = self._clock()
+            try:
+                response = await fn()
+            except Exception as e:
+                delay = self._retry_delay(ticket, e, self._clock() - started, attempt)
+                if delay is None:
+                    raise
+                await asyncio.sleep(delay)
+                continue
+            except BaseException:
+                self._release(ticket, outcome="cancelled")
+                raise
+            self._release(ticket, self._clock() - started, response_tokens(response, tokens))
+            return response
+
+    def stream(self, fn, tokens=0):
+        """
+        Yields the chunks of fn() (a streaming model call) under the limits.
+        A failure before the first chunk is retried; later ones are raised.
+        Latency is judged by the time to the first chunk.
+        """
+        tokens += LLM_RESPONSE_TOKENS
+        priority, seq = _priority.get(), None
+        for attempt in itertools.count(1):
+            ticket = self._acquire(tokens, priority, attempt, seq)
+            seq = ticket.seq
+            started = self._clock()
+            first_chunk = None
+            try:
+                for chunk in fn():
+                    if first_chunk is None:
+                        first_chunk = self._clock() - started
+                    yield chunk
+            except Exception as e:
+                if first_chunk is not None:
+                    self._release(ticket, outcome="failed")
+                    raise
+                delay = self._retry_delay(ticket, e, self._clock() - started, attempt)
+                if delay is None:
+                    raise
+                time.sleep(delay)
+                continue
+            except BaseException:
+                # Includes GeneratorExit when the consumer stops reading
+                self._release(ticket, outcome="cancelled")
+                raise
+            self._release(ticket, first_chunk)
+            return
+
+    def stats(self):
+        with self._cond:
+            now = self._clock()
+            self.requests.wait_time(0, now)
+            self.tokens.wait_time(0, now)
+            return {
+                "queued": self._queued,
+                "active": self.active,
+                "concurrency_limit": round(self.limit, 2),
+                "granted": self.granted,
+                "busy": self.busy,
+                "retried": self.retried,
+                "rate_limited": self.rate_limited,
+                "failed": self.failed,
+                "requests_available": round(self.requests.level, 1) if self.requests.capacity else -1,
+                "tokens_available": round(self.tokens.level) if self.tokens.capacity else -1,
+                "paused_seconds": round(max(0.0, self.paused_until - now), 3)
+            }
+
+
+_shared_scheduler = None
+_shared_lock = threading.Lock()
+
+
+def get_llm_scheduler():
+    """Returns the process-wide LLMScheduler."""
+    global _shared_scheduler
+    with _shared_lock:
+        if _shared_scheduler is None:
+            _shared_scheduler = LLMScheduler()
+        return _shared_scheduler
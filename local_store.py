@@ -0,0 +1,129 @@
+import os
+import sqlite3
+import threading
+import time
+
+# SQLite file shared by the worker processes on this host; empty keeps every
+# cache in process memory (the default for the Streamlit app).
+LOCAL_STORE_PATH = os.getenv("LOCAL_STORE_PATH", "")
+
+_SCHEMA = """
+    CREATE TABLE IF NOT EXISTS entries (
+        namespace  TEXT NOT NULL,
+        key        TEXT NOT NULL,
+        value      BLOB,
+        tags       TEXT NOT NULL DEFAULT '',
+        size       INTEGER NOT NULL DEFAULT 0,
+        expires_at REAL,
+        updated_at REAL NOT NULL,
+        PRIMARY KEY (namespace, key)
+    );
+    CREATE INDEX IF NOT EXISTS entries_updated ON entries (namespace, updated_at);
+"""
+
+
+class LocalStore:
+    """
+    Small key/value store in a SQLite file (WAL mode), so several processes on
+    one host can share caches and conversation state. Values are bytes; entries
+    can expire and carry tags (e.g. the tables a cached result reads) for bulk
+    invalidation. Each thread (and each forked process) gets its own SQLite
+    connection.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._local = threading.local()
+        self._conn().executescript(_SCHEMA)
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def get(self, namespace, key):
+        """Returns the value, or None when it is missing or expired."""
+        row = self._conn().execute(
+            "SELECT value, expires_at FROM entries WHERE namespace = ? AND key = ?", (namespace, key)
+        ).fetchone()
+        if row is None or (row[1] is not None and row[1] < time.time()):
+            return None
+        return row[0]
+
+    def put(self, namespace, key, value, ttl=None, tags=()):
+        now = time.time()
+        self._conn().execute(
+            "INSERT OR REPLACE INTO entries (namespace, key, value, tags, size, expires_at, updated_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (namespace, key, value, " ".join(tags), len(value or b""), now + ttl if ttl else None, now)
+        )
+
+    def delete(self, namespace, key):
+        self._conn().execute("DELETE FROM entries WHERE namespace = ? AND key = ?", (namespace, key))
+
+    def delete_tagged(self, namespace, tag):
+        """Deletes every entry carrying the tag; returns how many were removed."""
+        return self._conn().execute(
+            "DELETE FROM entries WHERE namespace = ? AND ' ' || tags || ' ' LIKE ?",
+            (namespace, f"% {tag} %")
+        ).rowcount
+
+    def changed_since(self, namespace, since):
+        """
+        (key, value, updated_at) for entries written at or after ``since``,
+        oldest first. Entries written in the same instant may be returned twice,
+        so applying them must be idempotent.
+        """
+        return self._conn().execute(
+            "SELECT key, value, updated_at FROM entries WHERE namespace = ? AND updated_at >= ? "
+            "ORDER BY updated_at", (namespace, since)
+        ).fetchall()
+
+    def trim(self, namespace, max_entries=None, max_bytes=None):
+        """Drops expired entries, then the least recently written ones beyond the limits."""
+        conn = self._conn()
+        conn.execute("DELETE FROM entries WHERE namespace = ? AND expires_at < ?", (namespace, time.time()))
+        if max_entries is not None:
+            conn.execute(
+                "DELETE FROM entries WHERE namespace = ? AND key IN (SELECT key FROM entries WHERE namespace = ? "
+                "ORDER BY updated_at DESC LIMIT -1 OFFSET ?)", (namespace, namespace, max_entries)
+            )
+        if max_bytes is not None:
+            conn.execute(
+                "DELETE FROM entries WHERE namespace = ? AND key IN (SELECT key FROM ("
+                "SELECT key, SUM(size) OVER (ORDER BY updated_at DESC) AS running FROM entries "
+                "WHERE namespace = ?) WHERE running > ?)", (namespace, namespace, max_bytes)
+            )
+
+    def stats(self, namespace):
+        count, size = self._conn().execute(
+            "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries WHERE namespace = ?", (namespace,)
+        ).fetchone()
+        return {"entries": count, "bytes": size}
+
+    def clear(self, namespace):
+        self._conn().execute("DELETE FROM entries WHERE namespace = ?", (namespace,))
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def get_local_store(path=None):
+    """
+    Returns the process-wide LocalStore for ``path`` (default LOCAL_STORE_PATH),
+    or None when no store is configured.
+    """
+    path = path or LOCAL_STORE_PATH
+    if not path:
+        return None
+    with _stores_lock:
+        if path not in _stores:
+            _stores[path] = LocalStore(path)
+        return _stores[path]
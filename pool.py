@@ -0,0 +1,257 @@
+import hashlib
+import threading
+import time
+from contextlib import contextmanager
+
+POOL_MIN_SIZE = 1
+POOL_MAX_SIZE = 8
+POOL_TIMEOUT = 30.0
+# Idle connections younger than this are handed out without a ping.
+POOL_VALIDATE_AFTER = 5.0
+
+VALIDATION_SQL = "SELECT 1"
+# ODBC SQLGetInfo code of the current database (pyodbc.SQL_DATABASE_NAME),
+# kept here so the pool does not import pyodbc
+SQL_DATABASE_NAME = 16
+
+
+class PoolTimeout(Exception):
+    """Raised when no connection becomes available within the checkout timeout."""
+
+
+class ConnectionPool:
+    """
+    Thread-safe pool of DB-API connections.
+
+    Connections are created by ``factory`` (which must return a connection or
+    raise), validated with a ping when they have been idle for more than
+    ``validate_after`` seconds, and replaced when the ping fails or a borrower
+    hits an error on a connection that turns out to be dead. When ``database``
+    is given, a connection a borrower switched to another database (``USE``)
+    is switched back before it is handed out again.
+    """
+
+    def __init__(self, factory, min_size=POOL_MIN_SIZE, max_size=POOL_MAX_SIZE,
+                 timeout=POOL_TIMEOUT, validate_after=POOL_VALIDATE_AFTER, name="pool", database=None):
+        self.factory = factory
+        self.database = database
+        self.min_size = min_size
+        self.max_size = max_size
+        self.timeout = timeout
+        self.validate_after = validate_after
+        self.name = name
+        self._idle = []  # (connection, last_used)
+        self._size = 0
+        self._waiting = 0
+        self._closed = False
+        self._cond = threading.Condition()
+        self.created = 0
+        self.replaced = 0
+        self.timeouts = 0
+        self.checkouts = 0
+        for _ in range(min_size):
+            self._idle.append((self._open(), time.monotonic()))
+            self._size += 1
+
+    def _open(self):
+        conn = self.factory()
+        if conn is None:
+            raise ConnectionError(f"Could not open a connection for {self.name}")
+        with self._cond:
+            self.created += 1
+        return conn
+
+    def _discard(self, conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+        with self._cond:
+            self._size -= 1
+            self._cond.notify()
+
+    @staticmethod
+    def is_alive(conn):
+        try:
+            cursor = conn.cursor()
+            cursor.execute(VALIDATION_SQL)
+            cursor.fetchall()
+            cursor.close()
+            return True
+        except Exception:
+            return False
+
+    def acquire(self, timeout=None):
+        """
+        Checks out a healthy connection, waiting up to ``timeout`` seconds
+        (the pool default when None) for one to become free.
+        """
+        timeout = self.timeout if timeout is None else timeout
+        deadline = time.monotonic() + timeout
+        while True:
+            conn, last_used = None, None
+            with self._cond:
+                if self._closed:
+                    raise RuntimeError(f"{self.name} is closed")
+                while not self._idle and self._size >= self.max_size:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self.timeouts += 1
+                        raise PoolTimeout(f"No connection available in {self.name} "
+                                          f"after {timeout:.1f}s ({self._size} in use)")
+                    self._waiting += 1
+                    try:
+                        self._cond.wait(remaining)
+                    finally:
+                        self._waiting -= 1
+                if self._idle:
+                    conn, last_used = self._idle.pop()
+                else:
+                    self._size += 1  # reserve the slot before connecting outside the lock
+
+            if conn is None:
+                try:
+                    conn = self._open()
+                except Exception:
+                    with self._cond:
+                        self._size -= 1
+                        self._cond.notify()
+                    raise
+                return self._checked_out(conn)
+
+            if time.monotonic() - last_used < self.validate_after or self.is_alive(conn):
+                return self._checked_out(conn)
+
+            print(f"♻️ Replacing dead connection in {self.name}")
+            with self._cond:
+                self.replaced += 1
+            self._discard(conn)
+
+    def _checked_out(self, conn):
+        with self._cond:
+            self.checkouts += 1
+        return conn
+
+    def _reset_database(self, conn):
+        """Switches the connection back to the pool's database if a borrower ran USE."""
+        try:
+            # Answered by the driver from its session state, no round trip
+            current = conn.getinfo(SQL_DATABASE_NAME)
+        except Exception:
+            current = None
+        if current is not None and current.lower() == self.database.lower():
+            return
+        cursor = conn.cursor()
+        try:
+            cursor.execute(f"USE [{self.database.replace(']', ']]')}]")
+        finally:
+            cursor.close()
+
+    def release(self, conn, broken=False):
+        """Returns a connection to the pool; broken ones are closed instead."""
+        if not broken:
+            try:
+                conn.rollback()  # don't leak an open transaction to the next borrower
+                if self.database:
+                    self._reset_database(conn)
+            except Exception:
+                broken = True
+        if broken or self._closed:
+            self._discard(conn)
+            return
+        with self._cond:
+            self._idle.append((conn, time.monotonic()))
+            self._cond.notify()
+
+    @contextmanager
+    def connection(self, timeout=None):
+        """Context manager that borrows a connection and always gives it back."""
+        conn = self.acquire(timeout)
+        broken = False
+        try:
+            yield conn
+        except Exception:
+            broken = not self.is_alive(conn)
+            raise
+        finally:
+            # Also on GeneratorExit / KeyboardInterrupt, e.g. a generator
+            # yielding from this block that the caller stops reading early
+            self.release(conn, broken=broken)
+
+    def stats(self):
+        with self._cond:
+            return {
+                "size": self._size,
+                "idle": len(self._idle),
+                "in_use": self._size - len(self._idle),
+                "waiting": self._waiting,
+                "max_size": self.max_size,
+                "created": self.created,
+                "replaced": self.replaced,
+                "timeouts": self.timeouts,
+                "checkouts": self.checkouts
+            }
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            idle, self._idle = self._idle, []
+            self._cond.notify_all()
+        for conn, _ in idle:
+            self._discard(conn)
+
+
+@contextmanager
+def borrow(conn_or_pool):
+    """
+    Yields a connection from a ConnectionPool, or the object itself when it
+    is already a plain connection. Lets the connect.py helpers accept either.
+    """
+    if isinstance(conn_or_pool, ConnectionPool):
+        with conn_or_pool.connection() as conn:
+            yield conn
+    else:
+        yield conn_or_pool
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+# One lock per pool key: a pool opens its first connections while only its own
+# key is locked, so a slow or unreachable server never holds up the others.
+_pool_creation_locks = {}
+
+
+def get_pool(server, database, username, password, **pool_options):
+    """
+    Returns the process-wide pool for server/database/user, creating it on
+    first use. The password is part of the key (hashed), so a wrong password
+    never reuses connections opened with the right one.
+    """
+    from connect import connect_to_database
+
+    secret = hashlib.sha256(password.encode("utf-8")).hexdigest()
+    key = (server.lower(), database.lower(), username.lower(), secret)
+    with _pools_lock:
+        pool = _pools.get(key)
+        if pool is not None:
+            return pool
+        creation_lock = _pool_creation_locks.setdefault(key, threading.Lock())
+    with creation_lock:
+        with _pools_lock:
+            pool = _pools.get(key)
+        if pool is None:
+            pool = ConnectionPool(
+                lambda: connect_to_database(server, database, username, password),
+                name=f"{username}@{server}/{database}",
+                database=database,
+                **pool_options
+            )
+            with _pools_lock:
+                _pools[key] = pool
+        return pool
+
+
+def all_pool_stats():
+    """Stats of every pool in the process, keyed by pool name."""
+    with _pools_lock:
+        return {pool.name: pool.stats() for pool in _pools.values()}
@@ -59,8 +59,11 @@ Ensure the final script:
 
 ## 📥 Input Example:
 
-- **Schema:** {schema_data}  
-- **Question:** {question}
+- **Question:** the first line of the user message  
+- **Schema:** the compact table list after "Schema:" in the user message, one table per line as
+  `db.schema.Table(Column TYPE [PK] [-> schema.RefTable.RefColumn], ...)`, optionally followed by an indented
+  profile line: approximate row count, then per column the most common values with their share, value ranges
+  and approximate distinct counts
 
 ## 📤 Output:
 
@@ -80,6 +83,14 @@ GROUP BY p.ProductName
 ORDER BY TotalRevenue DESC;
 """
 
+sql_repair_prompt = """
+The SQL script above was checked against the schema before running and has these problems:
+{problems}
+
+Fix them using only the tables and columns in the schema. Qualify column names with their table alias when more than one table is joined.
+Return the complete corrected script only — pure SQL, no explanation or markdown.
+"""
+
 explanation_prompt  = """
 # 🔍 SQL Query Business Summary
 
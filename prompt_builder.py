@@ -0,0 +1,210 @@
+import os
+import re
+
+# Total tokens for system prompt + history + question + schema.
+PROMPT_TOKEN_BUDGET = int(os.getenv("PROMPT_TOKEN_BUDGET", "8000"))
+# Share of what is left after system prompt and question that history may use.
+HISTORY_TOKEN_SHARE = float(os.getenv("HISTORY_TOKEN_SHARE", "0.25"))
+PROFILE_VALUE_CHARS = 40
+# Column summaries shown per table; low-cardinality columns come first.
+PROFILE_COLUMNS_PER_TABLE = 8
+# Columns with at most this many distinct values list their top values with shares.
+LOW_CARDINALITY = 20
+
+_TEXT_TYPES = ("CHAR", "VARCHAR", "NCHAR", "NVARCHAR", "UNIQUEIDENTIFIER")
+
+_COLUMN = re.compile(r"^\s+\[([^\]]+)\]\s+(.+?),?$")
+_PRIMARY_KEY = re.compile(r"^\s+PRIMARY KEY \((.+)\),?$")
+_FOREIGN_KEY = re.compile(r"^\s+FOREIGN KEY \(\[([^\]]+)\]\) REFERENCES ([^\s(]+)\(\[([^\]]+)\]\),?$")
+
+_encoding = None
+
+
+def count_tokens(text):
+    """
+    Token count with tiktoken's cl100k_base. Gemini tokenizes differently, so
+    this is an estimate; when tiktoken or its vocabulary is unavailable
+    (e.g. offline) it falls back to ~4 characters per token.
+    """
+    global _encoding
+    if _encoding is None:
+        try:
+            import tiktoken
+            _encoding = tiktoken.get_encoding("cl100k_base")
+        except Exception:
+            _encoding = False
+    if _encoding is False:
+        return (len(text) + 3) // 4
+    return len(_encoding.encode(text, disallowed_special=()))
+
+
+def _short(value, quoted=False):
+    text = str(value)
+    if len(text) > PROFILE_VALUE_CHARS:
+        text = text[:PROFILE_VALUE_CHARS - 1] + "…"
+    return f"'{text}'" if quoted else text
+
+
+def _column_summary(col, data_type, profile):
+    quoted = data_type.split("(")[0] in _TEXT_TYPES
+    distinct = profile.get("distinct") or 0
+    top = profile.get("top") or []
+    if top and distinct <= LOW_CARDINALITY:
+        values = ", ".join(f"{_short(value, quoted)} {share:.0%}" for value, share in top)
+        more = ", …" if distinct > len(top) else ""
+        return f"{col}: {values}{more}"
+    count = f"{distinct:,}" if profile.get("exact") else f"~{distinct:,}"
+    if profile.get("min") is not None and profile.get("max") is not None:
+        return f"{col}: {_short(profile['min'], quoted)}..{_short(profile['max'], quoted)}, {count} distinct"
+    if top:
+        return f"{col}: {count} distinct, e.g. {_short(top[0][0], quoted)}"
+    return None
+
+
+def profile_line(profile, columns, pk=()):
+    """
+    Compact summary of a table profile, e.g.
+
+        ~12,345 rows; Status: 'open' 61%, 'shipped' 39%; Total: 0.01..99.5, ~4,321 distinct
+    """
+    if not profile:
+        return ""
+    parts = [f"~{profile['rows']:,} rows"] if profile.get("rows") is not None else []
+    summaries = []
+    for col, data_type in columns:
+        column_profile = profile.get("columns", {}).get(col)
+        if col in pk or not column_profile:
+            continue
+        summary = _column_summary(col, data_type, column_profile)
+        if summary:
+            summaries.append(((column_profile.get("distinct") or 0) > LOW_CARDINALITY, summary))
+    # Stable sort: low-cardinality columns (the ones questions filter on) first, then table order
+    summaries.sort(key=lambda item: item[0])
+    parts.extend(summary for _, summary in summaries[:PROFILE_COLUMNS_PER_TABLE])
+    return "; ".join(parts)
+
+
+def parse_ddl(ddl):
+    """
+    Reads back a CREATE TABLE statement built by connect._build_ddl.
+
+    Returns:
+        tuple: ([(column, type)], primary key columns, {column: "schema.table.column"})
+    """
+    columns, pk, fks = [], set(), {}
+    for line in ddl.splitlines():
+        match = _PRIMARY_KEY.match(line)
+        if match:
+            pk.update(c.strip().strip("[]") for c in match.group(1).split(","))
+            continue
+        match = _FOREIGN_KEY.match(line)
+        if match:
+            fks[match.group(1)] = f"{match.group(2)}.{match.group(3)}"
+            continue
+        match = _COLUMN.match(line)
+        if match:
+            columns.append((match.group(1), match.group(2)))
+    return columns, pk, fks
+
+
+def compact_table(name, info, with_profile=True):
+    """
+    One table in the compact prompt format, e.g.
+
+        db.dbo.Orders(OrderID INT PK, CustomerID INT -> dbo.Customers.CustomerID, Total DECIMAL(10,2))
+          ~12,345 rows; Status: 'open' 61%, 'shipped' 39%; Total: 0.01..99.5, ~4,321 distinct
+    """
+    columns, pk, fks = parse_ddl(info["schema"])
+
+    parts = []
+    for col, data_type in columns:
+        part = f"{col} {data_type}"
+        if col in pk:
+            part += " PK"
+        if col in fks:
+            part += f" -> {fks[col]}"
+        parts.append(part)
+    text = f"{name}({', '.join(parts)})"
+
+    if with_profile:
+        line = profile_line(info.get("profile"), columns, pk)
+        if line:
+            text += "\n  " + line
+    return text
+
+
+def trim_history(history, budget):
+    """
+    Keeps the newest (human, ai) turns that fit in ``budget`` tokens.
+
+    Returns:
+        tuple: (kept history, tokens used)
+    """
+    kept, used = [], 0
+    for start in range(len(history) - 2, -2, -2):
+        turn = history[max(start, 0):start + 2]
+        cost = sum(count_tokens(text) for _, text in turn)
+        if used + cost > budget:
+            break
+        kept[:0] = turn
+        used += cost
+    return kept, used
+
+
+def build_schema_text(schema_data, budget):
+    """
+    Renders tables in the given (relevance) order until the budget is spent.
+    A table that doesn't fit with its profile is retried without it.
+
+    Returns:
+        tuple: (schema text, tokens used, tables dropped, tables without profiles)
+    """
+    lines, used = [], 0
+    dropped, profiles_dropped = 0, 0
+    for name, info in schema_data.items():
+        text = compact_table(name, info)
+        cost = count_tokens(text) + 1
+        if used + cost > budget and info.get("profile"):
+            text = compact_table(name, info, with_profile=False)
+            cost = count_tokens(text) + 1
+            profiles_dropped += 1
+        if used + cost > budget:
+            dropped += 1
+            continue
+        lines.append(text)
+        used += cost
+    return "\n".join(lines), used, dropped, profiles_dropped
+
+
+def build_sql_prompt(system_prompt, history, question, schema_data, budget=PROMPT_TOKEN_BUDGET):
+    """
+    Fits history, question and schema into a token budget.
+
+    The system prompt and question are always kept. History may take up to
+    HISTORY_TOKEN_SHARE of the rest (newest turns first) and the schema gets
+    whatever remains, tables in the order given.
+
+    Returns:
+        tuple: (trimmed history, schema text, token report per section)
+    """
+    system_tokens = count_tokens(system_prompt)
+    question_tokens = count_tokens(question)
+    remaining = max(budget - system_tokens - question_tokens, 0)
+
+    kept_history, history_tokens = trim_history(history, int(remaining * HISTORY_TOKEN_SHARE))
+    schema_text, schema_tokens, dropped, profiles_dropped = build_schema_text(
+        schema_data, remaining - history_tokens
+    )
+
+    report = {
+        "system": system_tokens,
+        "history": history_tokens,
+        "question": question_tokens,
+        "schema": schema_tokens,
+        "total": system_tokens + history_tokens + question_tokens + schema_tokens,
+        "budget": budget,
+        "history_turns_dropped": (len(history) - len(kept_history)) // 2,
+        "tables_dropped": dropped,
+        "profiles_dropped": profiles_dropped
+    }
+    return kept_history, schema_text, report
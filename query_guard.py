@@ -0,0 +1,227 @@
+import os
+import time
+import xml.etree.ElementTree as ET
+
+from connect import MAX_RESULT_ROWS, ExecuteQuery
+from pool import borrow
+from result_cache import is_write_statement
+from telemetry import record_span
+from tsql import atoms
+
+# Estimated rows above which a SELECT is capped with TOP (or blocked when it can't be).
+GUARD_MAX_ROWS = int(os.getenv("GUARD_MAX_ROWS", str(MAX_RESULT_ROWS)))
+# Estimated subtree cost (SQL Server optimizer units) above which a statement is blocked.
+GUARD_MAX_COST = float(os.getenv("GUARD_MAX_COST", "500"))
+# Seconds before a running statement is cancelled on the server.
+QUERY_TIMEOUT = float(os.getenv("QUERY_TIMEOUT", "60"))
+# INSERT/UPDATE/DELETE/DDL/EXEC... are refused unless this is set.
+GUARD_ALLOW_WRITES = os.getenv("GUARD_ALLOW_WRITES", "").lower() in ("1", "true", "yes")
+
+SHOWPLAN_NS = "{http://schemas.microsoft.com/sqlserver/2004/07/showplan}"
+
+
+class QueryBlocked(Exception):
+    """Raised by QueryGuard.execute; ``decision`` holds the reason and the estimates."""
+
+    def __init__(self, decision):
+        super().__init__(decision["reason"])
+        self.decision = decision
+
+
+def parse_showplan(xml_text):
+    """
+    Reads the per-statement estimates from a SHOWPLAN_XML document.
+
+    Returns:
+        list: {"type", "rows", "cost"} per statement
+    """
+    statements = []
+    for stmt in ET.fromstring(xml_text).iter(f"{SHOWPLAN_NS}StmtSimple"):
+        statements.append({
+            "type": stmt.get("StatementType"),
+            "rows": float(stmt.get("StatementEstRows") or 0),
+            "cost": float(stmt.get("StatementSubTreeCost") or 0)
+        })
+    return statements
+
+
+def showplan_xml(conn, sql, params=()):
+    """
+    Compiles (without running) the SQL under SET SHOWPLAN_XML ON and returns
+    its plan documents; ``params`` are bound to its ? markers.
+    """
+    with borrow(conn) as conn:
+        cursor = conn.cursor()
+        cursor.execute("SET SHOWPLAN_XML ON")
+        try:
+            cursor.execute(sql, params) if params else cursor.execute(sql)
+            plans = []
+            while True:
+                if cursor.description is not None:
+                    plans.extend(row[0] for row in cursor.fetchall())
+                if not cursor.nextset():
+                    break
+        finally:
+            try:
+                cursor.execute("SET SHOWPLAN_XML OFF")
+            except Exception:
+                # Never hand a connection stuck in showplan mode back to the pool
+                conn.close()
+                raise
+            cursor.close()
+    return plans
+
+
+def showplan_estimate(conn, sql):
+    """
+    Returns {"rows": largest statement estimate, "cost": total cost, "statements": [...]}
+    from the SQL's estimated plan (showplan_xml). This is the default plan
+    provider of QueryGuard.
+    """
+    statements = [statement for plan in showplan_xml(conn, sql) for statement in parse_showplan(plan)]
+    return {
+        "rows": max((s["rows"] for s in statements), default=0.0),
+        "cost": sum(s["cost"] for s in statements),
+        "statements": statements
+    }
+
+
+def inject_top(sql, limit):
+    """
+    Caps a single SELECT at ``limit`` rows by adding TOP (limit) or lowering
+    an existing larger TOP. Returns the SQL unchanged when it is already
+    capped at or below the limit, and None when it can't be capped safely
+    (several statements, UNION/EXCEPT/INTERSECT, CTEs, TOP PERCENT or a
+    variable TOP).
+    """
+    found = list(atoms(sql))
+    while found and found[-1][2] == ";":
+        found.pop()
+    if not found or found[0][2].lower() != "select":
+        return None
+
+    depth = 0
+    for _, _, text in found:
+        if text == "(":
+            depth += 1
+        elif text == ")":
+            depth -= 1
+        elif depth == 0 and (text == ";" or text.lower() in ("union", "except", "intersect")):
+            return None
+
+    idx = 1
+    if idx < len(found) and found[idx][2].lower() in ("distinct", "all"):
+        idx += 1
+    if idx < len(found) and found[idx][2].lower() == "top":
+        pos = idx + 1
+        parenthesised = pos < len(found) and found[pos][2] == "("
+        if parenthesised:
+            pos += 1
+        if pos >= len(found) or not found[pos][2].isdigit():
+            return None
+        after = pos + (2 if parenthesised else 1)
+        if after < len(found) and found[after][2].lower() == "percent":
+            return None
+        if int(found[pos][2]) <= limit:
+            return sql
+        start, end = found[pos][0], found[pos][1]
+        return f"{sql[:start]}{limit}{sql[end:]}"
+
+    insert_at = found[idx - 1][1]
+    return f"{sql[:insert_at]} TOP ({limit}){sql[insert_at:]}"
+
+
+class QueryGuard:
+    """
+    Checks generated SQL before it runs against the server.
+
+    - Writes (INSERT/UPDATE/DELETE/DDL/EXEC/SELECT INTO...) are blocked unless allowed.
+    - The estimated plan is fetched from ``plan_provider`` (SHOWPLAN_XML by
+      default; any ``f(conn, sql) -> {"rows", "cost"}`` works, e.g. a stub).
+    - SELECTs estimated above ``max_rows`` are rewritten with TOP (max_rows)
+      and re-estimated; if they can't be rewritten they are blocked
+      (``max_rows=None`` leaves them uncapped, as for exports).
+    - Statements whose (final) estimated cost is above ``max_cost`` are blocked.
+    - ``execute`` runs the approved SQL with a ``timeout`` after which it is
+      cancelled on the server.
+
+    Decisions are dicts: {"allowed", "sql", "reason", "rewritten",
+    "estimated_rows", "estimated_cost"}.
+    """
+
+    def __init__(self, plan_provider=showplan_estimate, max_rows=GUARD_MAX_ROWS, max_cost=GUARD_MAX_COST,
+                 timeout=QUERY_TIMEOUT, allow_writes=GUARD_ALLOW_WRITES):
+        self.plan_provider = plan_provider
+        self.max_rows = max_rows
+        self.max_cost = max_cost
+        self.timeout = timeout
+        self.allow_writes = allow_writes
+
+    def _decision(self, sql, allowed, reason=None, estimate=None, rewritten=False):
+        return {
+            "allowed": allowed,
+            "sql": sql,
+            "reason": reason,
+            "rewritten": rewritten,
+            "estimated_rows": estimate["rows"] if estimate else None,
+            "estimated_cost": estimate["cost"] if estimate else None
+        }
+
+    def check(self, conn, sql):
+        """Returns the decision for the SQL; ``decision["sql"]`` is what should run."""
+        started = time.perf_counter()
+        decision = self._check(conn, sql)
+        record_span("db.guard", time.perf_counter() - started, allowed=decision["allowed"],
+                    rewritten=decision["rewritten"], estimated_rows=decision["estimated_rows"],
+                    estimated_cost=decision["estimated_cost"], reason=decision["reason"])
+        return decision
+
+    def _check(self, conn, sql):
+        is_write = is_write_statement(sql)
+        if is_write and not self.allow_writes:
+            return self._decision(sql, False, "statement may modify data or schema, and writes are not allowed")
+
+        try:
+            estimate = self.plan_provider(conn, sql)
+        except Exception as e:
+            return self._decision(sql, False, f"could not estimate the query plan: {e}")
+
+        candidate, final, rewritten = sql, estimate, False
+        if self.max_rows is not None and estimate["rows"] > self.max_rows and not is_write:
+            capped = inject_top(sql, self.max_rows)
+            if capped is None:
+                return self._decision(sql, False, f"estimated {estimate['rows']:,.0f} rows exceed the limit of "
+                                                  f"{self.max_rows:,} and the query can't be capped with TOP",
+                                      estimate)
+            if capped != sql:
+                try:
+                    final = self.plan_provider(conn, capped)
+                except Exception as e:
+                    return self._decision(sql, False, f"could not estimate the capped query plan: {e}", estimate)
+                candidate, rewritten = capped, True
+
+        if final["cost"] > self.max_cost:
+            reason = f"estimated cost {final['cost']:.1f} exceeds the limit of {self.max_cost:.1f}"
+            if rewritten:
+                reason += f" even with TOP ({self.max_rows})"
+            return self._decision(candidate, False, reason, final, rewritten)
+        if rewritten:
+            return self._decision(candidate, True, f"capped at {self.max_rows:,} of ~{estimate['rows']:,.0f} "
+                                                   f"estimated rows", final, rewritten)
+        return self._decision(sql, True, None, final)
+
+    def execute(self, conn, sql, **execute_options):
+        """
+        Checks the SQL and runs the approved version with ExecuteQuery and the
+        guard's timeout. Raises QueryBlocked when the check fails; the decision
+        is stored in result.attrs["guard"].
+        """
+        decision = self.check(conn, sql)
+        if not decision["allowed"]:
+            raise QueryBlocked(decision)
+        execute_options.setdefault("timeout", self.timeout)
+        result = ExecuteQuery(conn, decision["sql"], **execute_options)
+        result.attrs["guard"] = decision
+        if decision["rewritten"] and result.attrs.get("rows", 0) >= self.max_rows:
+            result.attrs["truncated"] = True
+        return result
@@ -0,0 +1,255 @@
+import os
+import pickle
+import re
+import threading
+import time
+from collections import OrderedDict
+
+from local_store import get_local_store
+
+RESULT_CACHE_TTL = float(os.getenv("RESULT_CACHE_TTL", "300"))
+RESULT_CACHE_MAX_BYTES = int(os.getenv("RESULT_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+
+# Strings, bracketed identifiers and comments are matched first so keywords
+# inside them are never mistaken for SQL.
+_TOKENS = re.compile(
+    r"(?P<string>N?'(?:[^']|'')*')"
+    r"|(?P<ident>\[(?:[^\]]|\]\])*\]|\"[^\"]*\")"
+    r"|(?P<comment>--[^\n]*|/\*.*?\*/)"
+    r"|(?P<space>\s+)"
+    r"|(?P<other>[^\s'\"\[\-/]+|.)",
+    re.DOTALL
+)
+
+_WRITE_KEYWORDS = {"insert", "update", "delete", "merge", "create", "alter", "drop", "truncate",
+                   "exec", "execute", "grant", "revoke", "deny", "into", "bulk", "dbcc", "backup",
+                   "restore", "sp_executesql"}
+
+_TABLE_REF = re.compile(
+    r"\b(?:from|join|apply|update|into|merge)\s+"
+    r"((?:(?:\[[^\]]+\]|[\w#@$]+)\s*\.\s*){0,3}(?:\[[^\]]+\]|[\w#@$]+))",
+    re.IGNORECASE
+)
+
+
+def normalize_sql(sql):
+    """
+    Canonical form of a statement: comments removed, whitespace collapsed,
+    keywords and identifiers lowercased, string literals kept verbatim and
+    the trailing semicolon dropped.
+    """
+    parts = []
+    for match in _TOKENS.finditer(sql):
+        kind = match.lastgroup
+        if kind == "comment" or kind == "space":
+            if parts and parts[-1] != " ":
+                parts.append(" ")
+        elif kind == "string":
+            parts.append(match.group())
+        else:
+            parts.append(match.group().lower())
+    return "".join(parts).strip().rstrip(";").strip()
+
+
+def sql_tokens(sql):
+    """
+    Yields (kind, text, offset) for the tokens of a statement; kind is one of
+    'string', 'ident', 'comment', 'space' or 'other'.
+    """
+    for match in _TOKENS.finditer(sql):
+        yield match.lastgroup, match.group(), match.start()
+
+
+def _code_words(sql):
+    """Lowercased words outside strings, identifiers and comments."""
+    words = []
+    for match in _TOKENS.finditer(sql):
+        if match.lastgroup == "other":
+            words.extend(re.findall(r"[a-z_][a-z0-9_]*", match.group().lower()))
+    return words
+
+
+def is_write_statement(sql):
+    """True when the SQL may modify data or schema (SELECT ... INTO included)."""
+    return any(word in _WRITE_KEYWORDS for word in _code_words(sql))
+
+
+def _strip_literals(sql):
+    return "".join(" ''" if m.lastgroup == "string" else (" " if m.lastgroup == "comment" else m.group())
+                   for m in _TOKENS.finditer(sql))
+
+
+def referenced_tables(sql):
+    """
+    Returns the tables a statement reads or writes, as lowercase 'schema.table'
+    (schema defaults to dbo; database and server prefixes are dropped).
+    """
+    tables = set()
+    for ref in _TABLE_REF.findall(_strip_literals(sql)):
+        parts = [p.strip().strip("[]\"").lower() for p in ref.split(".")]
+        if parts[-1].startswith(("#", "@")) or parts[-1] in ("select", "("):
+            continue
+        schema = parts[-2] if len(parts) > 1 and parts[-2] else "dbo"
+        tables.add(f"{schema}.{parts[-1]}")
+    return tables
+
+
+def _frame_bytes(frame):
+    try:
+        return int(frame.memory_usage(index=True, deep=True).sum())
+    except Exception:
+        return 0
+
+
+class ResultCache:
+    """
+    Shared result-set cache keyed by (server, login, database, normalized
+    SQL), so sessions only share results they could have queried themselves.
+    Every entry has a TTL, the total size is kept under ``max_bytes`` by evicting least
+    recently used entries, and entries can be invalidated per table.
+    Cached frames are shared between sessions and must not be mutated.
+
+    With a LocalStore the entries live there (pickled, tagged with the tables
+    they read) instead of in process memory, so every worker process sees the
+    same results and invalidations.
+    """
+
+    STORE_NAMESPACE = "result"
+
+    def __init__(self, max_bytes=RESULT_CACHE_MAX_BYTES, ttl=RESULT_CACHE_TTL, store=None):
+        self.max_bytes = max_bytes
+        self.store = store
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.by_table = {}
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.bypassed = 0
+        self._lock = threading.Lock()
+
+    def _drop(self, key):
+        entry = self.entries.pop(key, None)
+        if entry is None:
+            return
+        self.total_bytes -= entry["bytes"]
+        for table in entry["tables"]:
+            keys = self.by_table.get(table)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self.by_table[table]
+
+    @staticmethod
+    def _key(sql, database, server, login):
+        return ((server or "").lower(), login or "", (database or "").lower(), normalize_sql(sql))
+
+    @staticmethod
+    def _table_tag(table, database, server):
+        # Tags leave the login out: a write invalidates what every login read
+        return f"{(server or '').lower()}/{(database or '').lower()}:{table}"
+
+    def get(self, sql, database, server=None, login=None):
+        """Returns the cached result for the statement, or None."""
+        if is_write_statement(sql):
+            self.bypassed += 1
+            return None
+        key = self._key(sql, database, server, login)
+        if self.store is not None:
+            data = self.store.get(self.STORE_NAMESPACE, "\n".join(key))
+            with self._lock:
+                if data is None:
+                    self.misses += 1
+                    return None
+                self.hits += 1
+            return pickle.loads(data)
+        with self._lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry["expires"] < time.monotonic():
+                self._drop(key)
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry["result"]
+
+    def put(self, sql, database, result, ttl=None, server=None, login=None):
+        """Stores a read-only result. Writes and oversized results are not cached."""
+        if is_write_statement(sql):
+            return
+        size = _frame_bytes(result)
+        if size > self.max_bytes:
+            return
+        key = self._key(sql, database, server, login)
+        tables = {self._table_tag(t, database, server) for t in referenced_tables(sql)}
+        if self.store is not None:
+            self.store.put(self.STORE_NAMESPACE, "\n".join(key), pickle.dumps(result, pickle.HIGHEST_PROTOCOL),
+                           ttl=self.ttl if ttl is None else ttl, tags=tables)
+            self.store.trim(self.STORE_NAMESPACE, max_bytes=self.max_bytes)
+            return
+        with self._lock:
+            self._drop(key)
+            self.entries[key] = {
+                "result": result,
+                "bytes": size,
+                "tables": tables,
+                "expires": time.monotonic() + (self.ttl if ttl is None else ttl)
+            }
+            self.total_bytes += size
+            for table in tables:
+                self.by_table.setdefault(table, set()).add(key)
+            while self.total_bytes > self.max_bytes and self.entries:
+                self._drop(next(iter(self.entries)))
+
+    def invalidate_table(self, table, database, server=None):
+        """Drops every cached result that reads the table ('schema.table' or 'table')."""
+        parts = [p.strip("[]").lower() for p in table.split(".")]
+        name = self._table_tag(f"{parts[-2] if len(parts) > 1 else 'dbo'}.{parts[-1]}", database, server)
+        if self.store is not None:
+            self.store.delete_tagged(self.STORE_NAMESPACE, name)
+            return
+        with self._lock:
+            for key in list(self.by_table.get(name, ())):
+                self._drop(key)
+
+    def invalidate_statement(self, sql, database, server=None):
+        """Invalidates every table a (write) statement touches."""
+        for table in referenced_tables(sql):
+            self.invalidate_table(table, database, server)
+
+    def clear(self):
+        if self.store is not None:
+            self.store.clear(self.STORE_NAMESPACE)
+        with self._lock:
+            self.entries.clear()
+            self.by_table.clear()
+            self.total_bytes = 0
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        stored = self.store.stats(self.STORE_NAMESPACE) if self.store is not None else {
+            "entries": len(self.entries), "bytes": self.total_bytes
+        }
+        return {
+            "entries": stored["entries"],
+            "bytes": stored["bytes"],
+            "hits": self.hits,
+            "misses": self.misses,
+            "bypassed": self.bypassed,
+            "hit_ratio": self.hits / lookups if lookups else 0.0
+        }
+
+
+_shared_cache = None
+_shared_lock = threading.Lock()
+
+
+def get_result_cache():
+    """Returns the process-wide ResultCache, backed by the LocalStore when one is configured."""
+    global _shared_cache
+    with _shared_lock:
+        if _shared_cache is None:
+            _shared_cache = ResultCache(store=get_local_store())
+        return _shared_cache
@@ -0,0 +1,228 @@
+import hashlib
+import json
+import os
+import threading
+import time
+
+from connect import get_database_schema_with_samples
+from local_store import get_local_store
+from pool import borrow
+
+SCHEMA_CACHE_DIR = os.getenv("SCHEMA_CACHE_DIR", ".schema_cache")
+# Bumped when the table entries change shape; older snapshots are rescanned.
+SNAPSHOT_FORMAT = 2
+
+# Seconds a loaded snapshot is trusted before the catalog is checked again.
+SCHEMA_CHECK_INTERVAL = float(os.getenv("SCHEMA_CHECK_INTERVAL", "30"))
+
+TABLE_VERSIONS_SQL = """
+    SELECT s.name, t.name, CONVERT(varchar(33), t.modify_date, 126)
+    FROM sys.tables t
+    JOIN sys.schemas s ON s.schema_id = t.schema_id
+    WHERE t.is_ms_shipped = 0;
+"""
+
+# One shared snapshot per (server, database) for the whole process.
+_snapshots = {}
+_locks = {}
+_registry_lock = threading.Lock()
+
+
+def _key_lock(key):
+    with _registry_lock:
+        return _locks.setdefault(key, threading.Lock())
+
+
+def snapshot_path(server, database):
+    """Returns the on-disk location of the snapshot for server + database."""
+    digest = hashlib.sha1(f"{server}|{database}".lower().encode("utf-8")).hexdigest()[:16]
+    return os.path.join(SCHEMA_CACHE_DIR, f"{digest}.json")
+
+
+def _version_of(modify_dates):
+    """Schema version: a hash over every table name and its modify_date."""
+    payload = "\n".join(f"{name}={stamp}" for name, stamp in sorted(modify_dates.items()))
+    return hashlib.sha1(payload.encode("utf-8")).hexdigest()[:12]
+
+
+def _read_snapshot(path):
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            snapshot = json.load(f)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError) as e:
+        print(f"⚠️ Ignoring unreadable schema snapshot {path}: {e}")
+        return None
+    if snapshot.get("format") != SNAPSHOT_FORMAT:
+        print(f"⚠️ Ignoring schema snapshot {path} from an older version; rescanning")
+        return None
+    return snapshot
+
+
+def _write_snapshot(path, snapshot):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        # Profile values are already text; anything else is stored stringified
+        json.dump(snapshot, f, default=str)
+    os.replace(tmp_path, path)
+
+
+def _read_newer_snapshot(path, checked_at):
+    """The snapshot on disk when another process wrote it after ``checked_at``, else None."""
+    try:
+        if os.path.getmtime(path) <= checked_at:
+            return None
+    except OSError:
+        return None
+    snapshot = _read_snapshot(path)
+    return snapshot if snapshot is not None and snapshot["checked_at"] > checked_at else None
+
+
+def _announce(key, checked_at):
+    """Tells the other processes sharing the LocalStore that tables were re-described."""
+    store = get_local_store()
+    if store is not None:
+        store.put("schema", "|".join(key), repr(checked_at).encode("ascii"))
+
+
+def announced_at(server, database):
+    """
+    checked_at of the latest snapshot a process sharing the LocalStore
+    re-described tables for (a scan, an incremental refresh or a forced
+    rescan), or None without a store.
+    """
+    store = get_local_store()
+    value = store.get("schema", f"{server.lower()}|{(database or '').lower()}") if store is not None else None
+    return float(value) if value is not None else None
+
+
+def _current_modify_dates(conn, database):
+    """Reads name -> modify_date for every user table in one round trip."""
+    with borrow(conn) as conn:
+        cursor = conn.cursor()
+        cursor.execute(f"USE [{database}]")
+        cursor.execute(TABLE_VERSIONS_SQL)
+        return {f"{database}.{schema}.{table}": stamp for schema, table, stamp in cursor.fetchall()}
+
+
+def load_schema(conn, server, database, conn_factory=None, refresh=False, stats=None, on_progress=None):
+    """
+    Returns the schema snapshot for server + database, shared by every caller
+    in the process and persisted to SCHEMA_CACHE_DIR.
+
+    The snapshot is reused as is while it is younger than SCHEMA_CHECK_INTERVAL.
+    After that the table modify_dates are compared with the stored ones and only
+    new or altered tables are introspected again; dropped tables are removed.
+    A newer snapshot written by another process (see announced_at) is picked
+    up from disk instead of being rescanned.
+
+    Args:
+        conn: Active pyodbc connection or ConnectionPool
+        server (str): Server name, part of the cache key
+        database (str): Database name, part of the cache key
+        conn_factory (callable): Passed through to get_database_schema_with_samples
+        refresh (bool): Ignore the stored snapshot and rescan everything
+        stats (dict): Optional dict that receives 'source', 'changed', 'removed' and 'seconds'
+        on_progress (callable): Passed through to get_database_schema_with_samples on a
+            full scan, so callers can use tables before the scan finishes
+
+    Returns:
+        dict: {"version": str, "tables": {db.schema.table: {"schema", "profile"}},
+               "modify_dates": {...}, "checked_at": float}
+        Treat it as read-only; refreshes replace the snapshot instead of mutating it.
+    """
+    stats = stats if stats is not None else {}
+    started = time.perf_counter()
+    key = (server.lower(), (database or "").lower())
+
+    with _key_lock(key):
+        snapshot = None if refresh else _snapshots.get(key)
+        source = "memory"
+        if snapshot is None and not refresh:
+            snapshot = _read_snapshot(snapshot_path(server, database))
+            source = "disk"
+        elif snapshot is not None and (time.time() - snapshot["checked_at"] >= SCHEMA_CHECK_INTERVAL
+                                       or (announced_at(server, database) or 0) > snapshot["checked_at"]):
+            newer = _read_newer_snapshot(snapshot_path(server, database), snapshot["checked_at"])
+            if newer is not None:
+                snapshot, source = newer, "disk"
+
+        if snapshot is not None and time.time() - snapshot["checked_at"] < SCHEMA_CHECK_INTERVAL:
+            stats.update({"source": source, "changed": 0, "removed": 0})
+        else:
+            modify_dates = _current_modify_dates(conn, database)
+            old_tables = snapshot["tables"] if snapshot else {}
+            old_dates = snapshot["modify_dates"] if snapshot else {}
+
+            changed = [name for name, stamp in modify_dates.items() if old_dates.get(name) != stamp]
+            removed = [name for name in old_dates if name not in modify_dates]
+
+            scan_stats = {}
+            if snapshot is None:
+                scanned = set(modify_dates)
+                tables = get_database_schema_with_samples(conn, database, conn_factory=conn_factory,
+                                                          stats=scan_stats, on_progress=on_progress)
+                source = "scan"
+            elif changed or removed:
+                scanned = set(changed)
+                tables = {name: info for name, info in old_tables.items() if name in modify_dates}
+                if changed:
+                    subset = [tuple(name.split(".", 1)[1].split(".", 1)) for name in changed]
+                    tables.update(get_database_schema_with_samples(conn, database, tables=subset,
+                                                                   stats=scan_stats))
+                source = "incremental"
+            else:
+                scanned = set()
+                tables = old_tables
+
+            if scanned and (scan_stats.get("databases") == 0 or not tables):
+                # The scan failed (get_database_schema_with_samples reports errors
+                # instead of raising): keep what we had and retry on the next check
+                if snapshot is None:
+                    previous = _snapshots.get(key)
+                    if previous is None:
+                        raise RuntimeError(f"Could not read the schema of '{database}'; nothing was saved")
+                    snapshot = previous
+                print(f"⚠️ Schema scan of {database} failed; keeping snapshot {snapshot['version']}")
+                # Not written to disk; only delays the next attempt by SCHEMA_CHECK_INTERVAL
+                snapshot = dict(snapshot, checked_at=time.time())
+                stats.update({"source": "stale", "changed": 0, "removed": 0})
+            else:
+                # A table that could not be described keeps its previous modify_date
+                # (or none), so it still shows up as changed at the next check
+                stored_dates = {name: stamp if name not in scanned or name in tables else old_dates.get(name)
+                                for name, stamp in modify_dates.items()}
+                stored_dates = {name: stamp for name, stamp in stored_dates.items() if stamp is not None}
+                snapshot = {
+                    "format": SNAPSHOT_FORMAT,
+                    "server": server,
+                    "database": database,
+                    "version": _version_of(stored_dates),
+                    "tables": tables,
+                    "modify_dates": stored_dates,
+                    "checked_at": time.time()
+                }
+                _write_snapshot(snapshot_path(server, database), snapshot)
+                if source in ("scan", "incremental"):
+                    _announce(key, snapshot["checked_at"])
+                stats.update({"source": source, "changed": len(changed), "removed": len(removed)})
+
+        _snapshots[key] = snapshot
+
+    stats["seconds"] = time.perf_counter() - started
+    print(f"🗂️ Schema snapshot {snapshot['version']} for {database} from {stats['source']} "
+          f"({len(snapshot['tables'])} tables, {stats['changed']} changed, {stats['seconds'] * 1000:.1f} ms)")
+    return snapshot
+
+
+def drop_snapshot(server, database):
+    """Forgets the in-memory and on-disk snapshot for server + database."""
+    key = (server.lower(), (database or "").lower())
+    with _key_lock(key):
+        _snapshots.pop(key, None)
+        try:
+            os.remove(snapshot_path(server, database))
+        except FileNotFoundError:
+            pass
@@ -0,0 +1,302 @@
+import glob
+import os
+import re
+import threading
+import time
+import zlib
+from collections import OrderedDict
+
+import numpy as np
+
+from schema_cache import snapshot_path
+
+try:
+    import faiss
+except ImportError:  # faiss-cpu is optional, numpy search is used instead
+    faiss = None
+
+# Tables kept in the prompt, before join partners are added.
+SCHEMA_TOP_K = int(os.getenv("SCHEMA_TOP_K", "8"))
+
+# sentence-transformers model (a local path or one already in the Hugging Face
+# cache; nothing is downloaded). Empty, the default, uses the hashing embedder.
+SCHEMA_EMBED_MODEL = os.getenv("SCHEMA_EMBED_MODEL", "")
+# Indexes kept in memory (one per database and schema version); least recently used go first.
+SCHEMA_INDEX_CACHE_SIZE = int(os.getenv("SCHEMA_INDEX_CACHE_SIZE", "8"))
+
+_REFERENCES = re.compile(r"REFERENCES\s+([^\s(]+)\(")
+_COLUMN = re.compile(r"^\s+\[([^\]]+)\]", re.MULTILINE)
+_CAMEL = re.compile(r"[A-Z]+(?=[A-Z][a-z])|[A-Z]?[a-z]+|[A-Z]+|\d+")
+
+
+def tokenize(text):
+    """Splits identifiers and prose into lowercase words (CustomerID -> customer, id)."""
+    words = []
+    for chunk in re.split(r"[^A-Za-z0-9]+", text):
+        for word in _CAMEL.findall(chunk):
+            word = word.lower()
+            if len(word) > 3 and word.endswith("s"):
+                word = word[:-1]
+            words.append(word)
+    return words
+
+
+class HashingEmbedder:
+    """
+    Offline embedder: TF-IDF weighted feature hashing of words and character
+    trigrams. Uses crc32 so vectors stay stable across processes.
+    """
+    name = "hashing"
+
+    def __init__(self, dim=1024, idf=None):
+        self.dim = dim
+        self.idf = idf
+
+    def _features(self, text):
+        feats = {}
+        for word in tokenize(text):
+            bucket = zlib.crc32(word.encode("utf-8")) % self.dim
+            feats[bucket] = feats.get(bucket, 0.0) + 1.0
+            padded = f"#{word}#"
+            for i in range(len(padded) - 2):
+                bucket = zlib.crc32(padded[i:i + 3].encode("utf-8")) % self.dim
+                feats[bucket] = feats.get(bucket, 0.0) + 0.3
+        return feats
+
+    def fit(self, texts):
+        doc_freq = np.zeros(self.dim, dtype=np.float32)
+        for text in texts:
+            doc_freq[list(self._features(text))] += 1
+        self.idf = np.log((1 + len(texts)) / (1 + doc_freq)).astype(np.float32) + 1.0
+        return self
+
+    def embed(self, texts):
+        matrix = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for bucket, weight in self._features(text).items():
+                matrix[row, bucket] = weight
+        if self.idf is not None:
+            matrix *= self.idf
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        return matrix / np.maximum(norms, 1e-9)
+
+
+class SentenceTransformerEmbedder:
+    """Dense embeddings from a locally available sentence-transformers model."""
+
+    def __init__(self, model_name):
+        from sentence_transformers import SentenceTransformer
+        self.name = f"st:{model_name}"
+        # Never reach out to the Hugging Face hub: a missing model falls back to hashing
+        self.model = SentenceTransformer(model_name, local_files_only=True)
+
+    def fit(self, texts):
+        return self
+
+    def embed(self, texts):
+        return np.asarray(self.model.encode(list(texts), normalize_embeddings=True), dtype=np.float32)
+
+
+_dense_embedders = {}
+
+
+def get_embedder(model_name=SCHEMA_EMBED_MODEL):
+    """
+    Returns the sentence-transformers embedder if it loads, else a fresh
+    hashing one. Dense models are loaded once per process.
+    """
+    if model_name:
+        if model_name not in _dense_embedders:
+            try:
+                _dense_embedders[model_name] = SentenceTransformerEmbedder(model_name)
+            except Exception as e:
+                print(f"⚠️ Falling back to hashing embedder ({e.__class__.__name__}: {e})")
+                _dense_embedders[model_name] = None
+        if _dense_embedders[model_name] is not None:
+            return _dense_embedders[model_name]
+    return HashingEmbedder()
+
+
+def table_document(name, info):
+    """Text indexed for one table: its name, columns and the tables it references."""
+    ddl = info["schema"]
+    columns = _COLUMN.findall(ddl)
+    refs = _REFERENCES.findall(ddl)
+    return f"{name} {' '.join(columns)} references {' '.join(refs)}"
+
+
+def foreign_key_neighbours(schema_data):
+    """Maps each table to the tables it references or is referenced by."""
+    by_short_name = {}
+    for name in schema_data:
+        by_short_name.setdefault(name.split(".", 1)[-1].lower(), []).append(name)
+
+    neighbours = {name: set() for name in schema_data}
+    for name, info in schema_data.items():
+        db = name.split(".", 1)[0]
+        for ref in _REFERENCES.findall(info["schema"]):
+            for target in by_short_name.get(ref.lower(), []):
+                if target.split(".", 1)[0] == db and target != name:
+                    neighbours[name].add(target)
+                    neighbours[target].add(name)
+    return neighbours
+
+
+class SchemaIndex:
+    """
+    Table-level retrieval index over a schema snapshot. ``select`` returns the
+    tables most relevant to a question plus their foreign-key join partners.
+    """
+
+    def __init__(self, names, vectors, embedder, neighbours):
+        self.names = names
+        self.vectors = vectors
+        self.embedder = embedder
+        self.neighbours = neighbours
+        self._faiss = None
+        if faiss is not None and len(names):
+            self._faiss = faiss.IndexFlatIP(vectors.shape[1])
+            self._faiss.add(vectors)
+
+    @classmethod
+    def build(cls, schema_data, embedder=None):
+        embedder = embedder or get_embedder()
+        names = list(schema_data)
+        docs = [table_document(name, schema_data[name]) for name in names]
+        embedder.fit(docs)
+        vectors = embedder.embed(docs) if docs else np.zeros((0, 1), dtype=np.float32)
+        return cls(names, vectors, embedder, foreign_key_neighbours(schema_data))
+
+    def search(self, question, k=SCHEMA_TOP_K):
+        """Returns up to k (table, score) pairs, best first."""
+        if not self.names:
+            return []
+        query = self.embedder.embed([question])
+        k = min(k, len(self.names))
+        if self._faiss is not None:
+            scores, idx = self._faiss.search(query, k)
+            return [(self.names[i], float(s)) for i, s in zip(idx[0], scores[0]) if i >= 0]
+        scores = self.vectors @ query[0]
+        best = np.argsort(-scores)[:k]
+        return [(self.names[i], float(scores[i])) for i in best]
+
+    def select(self, question, k=SCHEMA_TOP_K, max_partners=2 * SCHEMA_TOP_K):
+        """Top-k tables for the question followed by their direct join partners."""
+        hits = [name for name, _ in self.search(question, k)]
+        selected = list(hits)
+        for name in hits:
+            for partner in sorted(self.neighbours.get(name, ())):
+                if partner not in selected and len(selected) < k + max_partners:
+                    selected.append(partner)
+        return selected
+
+    def save(self, path):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp.npz"
+        idf = getattr(self.embedder, "idf", None)
+        np.savez(
+            tmp_path,
+            names=np.array(self.names, dtype=str),
+            vectors=self.vectors,
+            embedder=np.array(self.embedder.name),
+            idf=idf if idf is not None else np.zeros(0, dtype=np.float32)
+        )
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path, schema_data, embedder=None):
+        data = np.load(path)
+        stored_name = str(data["embedder"])
+        if stored_name == HashingEmbedder.name:
+            embedder = HashingEmbedder(dim=data["vectors"].shape[1], idf=data["idf"])
+        else:
+            embedder = embedder or get_embedder()
+            if embedder.name != stored_name:
+                raise ValueError(f"index was built with {stored_name}")
+        return cls([str(n) for n in data["names"]], data["vectors"], embedder, foreign_key_neighbours(schema_data))
+
+
+def index_path(snapshot):
+    """The index file lives next to its schema snapshot and carries its version."""
+    base = snapshot_path(snapshot["server"], snapshot["database"])
+    return f"{base[:-len('.json')]}.{snapshot['version']}.index.npz"
+
+
+def _prune_index_files(path, snapshot):
+    """Deletes the index files of the snapshot's older versions once ``path`` is written."""
+    base = snapshot_path(snapshot["server"], snapshot["database"])
+    for old_path in glob.glob(f"{glob.escape(base[:-len('.json')])}.*.index.npz"):
+        if old_path != path:
+            try:
+                os.remove(old_path)
+            except OSError:
+                pass
+
+
+_indexes = OrderedDict()
+_indexes_lock = threading.Lock()
+
+
+def load_or_build_index(snapshot, embedder=None):
+    """
+    Loads the persisted index for the snapshot version, or builds and saves it.
+    Indexes are shared in the process like the snapshots they belong to; the
+    SCHEMA_INDEX_CACHE_SIZE most recently used are kept in memory.
+
+    Returns:
+        SchemaIndex
+    """
+    path = index_path(snapshot)
+    with _indexes_lock:
+        index = _indexes.get(path)
+        if index is not None:
+            _indexes.move_to_end(path)
+            return index
+    index = _load_or_build(path, snapshot, embedder)
+    with _indexes_lock:
+        index = _indexes.setdefault(path, index)
+        _indexes.move_to_end(path)
+        while len(_indexes) > SCHEMA_INDEX_CACHE_SIZE:
+            _indexes.popitem(last=False)
+    return index
+
+
+def _load_or_build(path, snapshot, embedder):
+    started = time.perf_counter()
+    if os.path.exists(path):
+        try:
+            index = SchemaIndex.load(path, snapshot["tables"], embedder)
+            print(f"🧭 Loaded schema index ({len(index.names)} tables) in "
+                  f"{(time.perf_counter() - started) * 1000:.1f} ms")
+            return index
+        except Exception as e:
+            print(f"⚠️ Rebuilding schema index: {e}")
+
+    index = SchemaIndex.build(snapshot["tables"], embedder)
+    try:
+        index.save(path)
+        _prune_index_files(path, snapshot)
+    except OSError as e:
+        print(f"⚠️ Could not persist schema index: {e}")
+    print(f"🧭 Built schema index ({len(index.names)} tables, {index.embedder.name}) in "
+          f"{(time.perf_counter() - started) * 1000:.1f} ms")
+    return index
+
+
+def prune_schema(schema_data, index, question, k=SCHEMA_TOP_K):
+    """
+    Returns the part of schema_data relevant to the question, plus timing and
+    size numbers for the pruned schema.
+    """
+    started = time.perf_counter()
+    if index is None or len(schema_data) <= k:
+        pruned = schema_data
+    else:
+        pruned = {name: schema_data[name] for name in index.select(question, k) if name in schema_data}
+    stats = {
+        "tables_total": len(schema_data),
+        "tables_in_prompt": len(pruned),
+        "schema_chars": len(str(pruned)),
+        "retrieval_ms": (time.perf_counter() - started) * 1000
+    }
+    return pruned, stats
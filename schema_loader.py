@@ -0,0 +1,130 @@
+import os
+import threading
+import time
+
+from schema_cache import load_schema
+from telemetry import record_span
+
+# Seconds a question waits for the schema to become usable before giving up.
+SCHEMA_WAIT_TIMEOUT = float(os.getenv("SCHEMA_WAIT_TIMEOUT", "120"))
+
+
+class SchemaLoader:
+    """
+    Loads the schema snapshot for server + database on a background thread.
+
+    On a cold scan every table becomes usable as soon as the catalog batch has
+    been read (its DDL is known); column profiles are filled in after that,
+    from catalog statistics and then batch by batch from sample reads.
+    ``snapshot`` is set once the scan is finished and persisted.
+    Warm loads (memory or disk snapshot) finish almost immediately.
+
+    Two durations are recorded as spans: ``schema.interactive`` (start until
+    tables can be used for questions) and ``schema.load`` (start until the
+    full snapshot is ready).
+    """
+
+    def __init__(self, conn, server, database, conn_factory=None, refresh=False):
+        self.conn = conn
+        self.server = server
+        self.database = database
+        self.conn_factory = conn_factory
+        self.refresh = refresh
+        self.snapshot = None
+        self.error = None
+        self.stats = {}
+        self._tables = None
+        self._revision = 0
+        self._sampled = 0
+        self._started = None
+        self._interactive_seconds = None
+        self._ready_seconds = None
+        self._cond = threading.Condition()
+        self._thread = threading.Thread(target=self._run, name=f"schema-loader-{database}", daemon=True)
+
+    def start(self, background=True):
+        """Starts loading; with background=False the snapshot is loaded before this returns."""
+        self._started = time.perf_counter()
+        if background:
+            self._thread.start()
+        else:
+            self._run()
+        return self
+
+    def _publish(self, tables, sampled):
+        # Caller holds self._cond
+        self._tables = tables
+        self._sampled = sampled
+        self._revision += 1
+        if self._interactive_seconds is None:
+            self._interactive_seconds = time.perf_counter() - self._started
+            record_span("schema.interactive", self._interactive_seconds,
+                        database=self.database, tables=len(tables))
+        self._cond.notify_all()
+
+    def _on_progress(self, schema_info, sampled):
+        with self._cond:
+            self._publish(dict(schema_info), sampled)
+
+    def _run(self):
+        try:
+            snapshot = load_schema(self.conn, self.server, self.database, conn_factory=self.conn_factory,
+                                   refresh=self.refresh, stats=self.stats, on_progress=self._on_progress)
+        except Exception as e:
+            with self._cond:
+                self.error = e
+                self._cond.notify_all()
+            print(f"❌ Schema loading failed for {self.database}: {e}")
+            return
+
+        with self._cond:
+            self.snapshot = snapshot
+            self._publish(snapshot["tables"], len(snapshot["tables"]))
+            self._ready_seconds = time.perf_counter() - self._started
+        record_span("schema.load", self._ready_seconds, database=self.database,
+                    source=self.stats.get("source"), tables=len(snapshot["tables"]))
+
+    def usable_tables(self, timeout=SCHEMA_WAIT_TIMEOUT):
+        """
+        Blocks until every table has its DDL (profiles may still be loading).
+
+        Returns:
+            tuple: (tables, revision, snapshot) where revision changes whenever
+            newer tables are published and snapshot is None until loading is done
+        """
+        with self._cond:
+            if not self._cond.wait_for(lambda: self._tables is not None or self.error is not None, timeout):
+                raise TimeoutError(f"Schema for '{self.database}' is still loading after {timeout:.0f}s")
+            if self._tables is None:
+                raise RuntimeError(f"Schema loading failed for '{self.database}': {self.error}") from self.error
+            return self._tables, self._revision, self.snapshot
+
+    def wait(self, timeout=SCHEMA_WAIT_TIMEOUT):
+        """Blocks until the full snapshot is loaded and returns it."""
+        with self._cond:
+            if not self._cond.wait_for(lambda: self.snapshot is not None or self.error is not None, timeout):
+                raise TimeoutError(f"Schema for '{self.database}' is still loading after {timeout:.0f}s")
+            if self.snapshot is None:
+                raise RuntimeError(f"Schema loading failed for '{self.database}': {self.error}") from self.error
+            return self.snapshot
+
+    def progress(self):
+        """Loading state for display: phase, table counts and the two startup durations."""
+        with self._cond:
+            if self.snapshot is not None:
+                phase = "ready"
+            elif self.error is not None:
+                phase = "error"
+            elif self._tables is not None:
+                phase = "sampling"
+            else:
+                phase = "catalog"
+            return {
+                "phase": phase,
+                "tables": len(self._tables) if self._tables is not None else None,
+                "sampled": self._sampled,
+                "interactive_seconds": self._interactive_seconds,
+                "ready_seconds": self._ready_seconds,
+                "elapsed_seconds": time.perf_counter() - self._started if self._started else 0.0,
+                "error": str(self.error) if self.error is not None else None
+            }
@@ -0,0 +1,387 @@
+"""
+Headless HTTP API around SQLChatBot.
+
+    python service.py --port 8080 --workers 4
+
+Endpoints (JSON in, JSON out):
+    POST /ask             {"question": ..., "client_id": ...} -> sql, result, explanation, trace
+    POST /stream          same body; newline-delimited JSON events as the answer is produced
+    POST /export          {"question": ..., "format": "csv" | "parquet"}; newline-delimited JSON
+                          progress events, then the file name to fetch
+    GET  /exports/<name>  downloads an exported file
+    POST /schema/refresh  rescans the schema of the configured database (every worker switches to it)
+    POST /conversation/reset {"client_id": ...}
+    GET  /health          worker pid, schema loading state, pool stats
+    GET  /metrics         Prometheus text format (for the worker that answers)
+
+The database comes from the SERVER/DATABASE/SQL_USERNAME/SQL_PASSWORD environment
+variables (.env is read). Workers are forked processes sharing one listening
+socket; they share the schema snapshot (SCHEMA_CACHE_DIR) and, through the
+LocalStore file, the SQL cache, the result cache and the per-client
+conversations, so any worker can answer any request. The client id can also
+be sent as an X-Client-Id header.
+"""
+import argparse
+import json
+import os
+import signal
+import socket
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from dotenv import load_dotenv
+
+import local_store
+from batch import frame_payload
+from conversations import get_conversation_store
+from export import EXPORT_DIR, EXPORT_FORMATS
+from helper import SQLChatBot
+from llm_scheduler import LLMBusy
+from pool import all_pool_stats
+from schema_cache import SCHEMA_CACHE_DIR
+from telemetry import render_prometheus, run_in_context, trace
+
+SERVICE_HOST = os.getenv("SERVICE_HOST", "127.0.0.1")
+SERVICE_PORT = int(os.getenv("SERVICE_PORT", "8080"))
+SERVICE_WORKERS = int(os.getenv("SERVICE_WORKERS", "1"))
+# Result rows returned per answer (the row count is always returned).
+SERVICE_RESULT_ROWS = int(os.getenv("SERVICE_RESULT_ROWS", "1000"))
+MAX_REQUEST_BYTES = 1024 * 1024
+# Bytes read per write when an export file is sent
+EXPORT_CHUNK_BYTES = 1024 * 1024
+
+# Runs queries while /stream writes the explanation
+_query_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix="service-query")
+
+
+class BadRequest(Exception):
+    pass
+
+
+def bot_from_env():
+    """Default bot factory: the database configured in the environment, loading its schema in the background."""
+    server, database = os.getenv("SERVER"), os.getenv("DATABASE")
+    # Not USERNAME: on Windows that is always the OS account, and .env does not override it
+    username, password = os.getenv("SQL_USERNAME"), os.getenv("SQL_PASSWORD")
+    if not all([server, database, username, password]):
+        raise SystemExit("❌ SERVER, DATABASE, SQL_USERNAME and SQL_PASSWORD must be set for the service")
+    return SQLChatBot(server, database, username, password, background=True)
+
+
+def _result_payload(result):
+    if isinstance(result, str):
+        return {"error": result}
+    rows, truncated, records = frame_payload(result, SERVICE_RESULT_ROWS)
+    return {"rows": rows, "truncated": truncated, "columns": [str(c) for c in result.columns], "data": records}
+
+
+class ChatService:
+    """
+    The per-process side of the API: one shared SQLChatBot, forked for every
+    request with the client's conversation loaded from the ConversationStore.
+    """
+
+    def __init__(self, bot_factory=bot_from_env):
+        self.bot = bot_factory()
+        self.conversations = get_conversation_store()
+        self._schema_lock = threading.Lock()
+
+    def _worker(self, client_id):
+        # Prepare the schema index on the shared bot once, instead of in every fork; once
+        # loaded, this re-checks it in the background (interval or another worker's refresh)
+        with self._schema_lock:
+            self.bot._ensure_schema()
+        worker = self.bot.fork()
+        if client_id:
+            worker.chat_history = self.conversations.load(client_id)
+        return worker
+
+    def _remember(self, client_id, worker):
+        if client_id:
+            self.conversations.save(client_id, worker.chat_history)
+
+    def ask(self, question, client_id=None):
+        worker = self._worker(client_id)
+        response = worker.get_full_response(question)
+        self._remember(client_id, worker)
+        return {
+            "client_id": client_id,
+            "sql": response["sql"],
+            "result": _result_payload(response["result"]),
+            "explanation": response["explanation"],
+            "trace": response["trace"]
+        }
+
+    def stream(self, question, client_id, emit):
+        """Calls emit(event) for SQL text, the result and explanation text as they are produced."""
+        worker = self._worker(client_id)
+        with trace("question") as spans:
+            for chunk in worker.stream_sql_query(question):
+                emit({"event": "sql", "text": chunk})
+            sql = worker.last_sql
+            emit({"event": "sql_done", "sql": sql})
+
+            result_future = _query_executor.submit(run_in_context(worker.get_query_result), sql)
+            result_sent = False
+            for chunk in worker.stream_explanation(question, sql):
+                emit({"event": "explanation", "text": chunk})
+                if not result_sent and result_future.done():
+                    emit({"event": "result", **_result_payload(result_future.result())})
+                    result_sent = True
+            if not result_sent:
+                emit({"event": "result", **_result_payload(result_future.result())})
+        self._remember(client_id, worker)
+        emit({"event": "done", "trace": spans})
+
+    def export(self, question, client_id, output_format, emit):
+        """
+        Generates the SQL and streams its full result to a file in EXPORT_DIR,
+        calling emit(event) with the SQL, progress and the finished export.
+        """
+        worker = self._worker(client_id)
+        with trace("export") as spans:
+            sql = worker.get_sql_query(question)
+            emit({"event": "sql_done", "sql": sql})
+            export = worker.export_query_result(sql, output_format,
+                                                on_progress=lambda progress: emit({"event": "progress", **progress}))
+        self._remember(client_id, worker)
+        if isinstance(export, str):
+            emit({"event": "error", "error": export})
+            return
+        name = os.path.basename(export["path"])
+        emit({"event": "done", "file": name, "url": f"/exports/{name}", "trace": spans,
+              **{key: value for key, value in export.items() if key != "path"}})
+
+    def refresh_schema(self):
+        # The rescanned snapshot is announced through the LocalStore, so the
+        # other workers switch to it on their next request
+        with self._schema_lock:
+            self.bot.refresh_schema(background=True)
+        return {"status": "refreshing", "schema": self.bot.schema_loader.progress()}
+
+    def health(self):
+        return {
+            "status": "ok",
+            "worker": os.getpid(),
+            "database": self.bot.database,
+            "schema": self.bot.schema_loader.progress(),
+            "pools": all_pool_stats()
+        }
+
+
+class ChatRequestHandler(BaseHTTPRequestHandler):
+    server_version = "SQLChatBot"
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    @property
+    def service(self):
+        return self.server.service
+
+    def _send(self, status, body, content_type):
+        data = body.encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _send_json(self, status, payload):
+        self._send(status, json.dumps(payload, default=str), "application/json")
+
+    def _read_json(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        if length > MAX_REQUEST_BYTES:
+            raise BadRequest("request body too large")
+        try:
+            payload = json.loads(self.rfile.read(length) or b"{}")
+        except ValueError:
+            raise BadRequest("request body must be JSON") from None
+        if not isinstance(payload, dict):
+            raise BadRequest("request body must be a JSON object")
+        payload.setdefault("client_id", self.headers.get("X-Client-Id"))
+        return payload
+
+    def _question(self, payload):
+        question = str(payload.get("question") or "").strip()
+        if not question:
+            raise BadRequest("'question' is required")
+        return question
+
+    def do_GET(self):
+        path = self.path.split("?", 1)[0].rstrip("/")
+        if path == "/health":
+            self._send_json(200, self.service.health())
+        elif path == "/metrics":
+            self._send(200, render_prometheus(), "text/plain; version=0.0.4")
+        elif path.startswith("/exports/"):
+            self._send_file(os.path.basename(path))
+        else:
+            self._send_json(404, {"error": f"unknown path {path}"})
+
+    def do_POST(self):
+        path = self.path.split("?", 1)[0].rstrip("/")
+        try:
+            payload = self._read_json()
+            if path == "/ask":
+                self._send_json(200, self.service.ask(self._question(payload), payload["client_id"]))
+            elif path == "/stream":
+                self._stream(self._question(payload), payload["client_id"])
+            elif path == "/export":
+                output_format = payload.get("format") or "csv"
+                if output_format not in EXPORT_FORMATS:
+                    raise BadRequest(f"'format' must be one of {', '.join(EXPORT_FORMATS)}")
+                question = self._question(payload)
+                self._send_events(lambda emit: self.service.export(question, payload["client_id"], output_format,
+                                                                   emit))
+            elif path == "/schema/refresh":
+                self._send_json(202, self.service.refresh_schema())
+            elif path == "/conversation/reset":
+                if not payload["client_id"]:
+                    raise BadRequest("'client_id' is required")
+                self.service.conversations.clear(payload["client_id"])
+                self._send_json(200, {"status": "reset", "client_id": payload["client_id"]})
+            else:
+                self._send_json(404, {"error": f"unknown path {path}"})
+        except BadRequest as e:
+            self._send_json(400, {"error": str(e)})
+        except LLMBusy as e:
+            # Queue full: the client should back off and retry
+            self._send_json(503, {"error": str(e), "busy": True})
+        except Exception as e:
+            self._send_json(500, {"error": f"{e.__class__.__name__}: {e}"})
+
+    def _send_file(self, name):
+        """Sends an export file in chunks, without reading it into memory."""
+        path = os.path.join(EXPORT_DIR, name)
+        if not name or name.startswith(".") or not os.path.isfile(path):
+            self._send_json(404, {"error": f"unknown export {name}"})
+            return
+        content_type = "text/csv" if name.endswith(".csv") else "application/octet-stream"
+        with open(path, "rb") as f:
+            self.send_response(200)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(os.fstat(f.fileno()).st_size))
+            self.send_header("Content-Disposition", f'attachment; filename="{name}"')
+            self.end_headers()
+            while True:
+                chunk = f.read(EXPORT_CHUNK_BYTES)
+                if not chunk:
+                    break
+                self.wfile.write(chunk)
+
+    def _stream(self, question, client_id):
+        self._send_events(lambda emit: self.service.stream(question, client_id, emit))
+
+    def _send_events(self, produce):
+        """Sends the events produce(emit) emits as chunked newline-delimited JSON."""
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+        def emit(event):
+            data = (json.dumps(event, default=str) + "\n").encode("utf-8")
+            self.wfile.write(f"{len(data):X}\r\n".encode("ascii") + data + b"\r\n")
+            self.wfile.flush()
+
+        try:
+            produce(emit)
+        except Exception as e:
+            # Headers are already sent, so the error travels as the last event
+            emit({"event": "error", "error": f"{e.__class__.__name__}: {e}"})
+        self.wfile.write(b"0\r\n\r\n")
+
+
+def _run_worker(sock, bot_factory):
+    server = ThreadingHTTPServer(sock.getsockname()[:2], ChatRequestHandler, bind_and_activate=False)
+    server.socket.close()
+    server.socket = sock
+    server.server_name, server.server_port = sock.getsockname()[:2]
+    server.service = ChatService(bot_factory)
+    print(f"🟢 Worker {os.getpid()} serving on http://{server.server_name}:{server.server_port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+def _fork(target, *args):
+    pid = os.fork()
+    if pid == 0:
+        code = 0
+        try:
+            target(*args)
+        except BaseException:
+            code = 1
+            raise
+        finally:
+            os._exit(code)
+    return pid
+
+
+def _warm_schema(bot_factory):
+    """Child process: loads (or scans) the schema once, so workers start from the shared snapshot."""
+    bot_factory().schema_loader.wait()
+
+
+def serve(bot_factory=bot_from_env, host=SERVICE_HOST, port=SERVICE_PORT, workers=SERVICE_WORKERS):
+    """
+    Serves the API. With several workers the listening socket is opened here
+    and the workers are forked after it, so the kernel spreads connections
+    across them. Before forking, one short-lived child loads the schema so
+    the workers don't all scan the catalog at the same time.
+    """
+    if workers > 1 and not hasattr(os, "fork"):
+        print("⚠️ Multiple workers need os.fork (not available on this platform); starting one worker")
+        workers = 1
+    if workers > 1 and not local_store.LOCAL_STORE_PATH:
+        # Workers only share caches and conversations through a store file
+        local_store.LOCAL_STORE_PATH = os.path.join(SCHEMA_CACHE_DIR, "store.sqlite3")
+
+    sock = socket.create_server((host, port), backlog=128)
+    if workers == 1:
+        _run_worker(sock, bot_factory)
+        return
+
+    _, status = os.waitpid(_fork(_warm_schema, bot_factory), 0)
+    if status != 0:
+        print("⚠️ Schema warm-up failed; workers will load the schema themselves")
+    children = [_fork(_run_worker, sock, bot_factory) for _ in range(workers)]
+    # Process managers stop the service with SIGTERM; the workers are stopped with it
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    print(f"🚀 {workers} workers on http://{host}:{sock.getsockname()[1]} (store: {local_store.LOCAL_STORE_PATH})")
+    try:
+        for pid in children:
+            os.waitpid(pid, 0)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for pid in children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        sock.close()
+
+
+def main():
+    load_dotenv()
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default=SERVICE_HOST)
+    parser.add_argument("--port", type=int, default=SERVICE_PORT)
+    parser.add_argument("--workers", type=int, default=SERVICE_WORKERS)
+    parser.add_argument("--store", default=local_store.LOCAL_STORE_PATH,
+                        help="LocalStore file shared by the workers (default with several workers: "
+                             "<SCHEMA_CACHE_DIR>/store.sqlite3)")
+    args = parser.parse_args()
+    local_store.LOCAL_STORE_PATH = args.store
+    serve(host=args.host, port=args.port, workers=args.workers)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,172 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import Future
+
+from telemetry import record_span
+
+
+class FlightAbandoned(Exception):
+    """
+    The leader of a flight gave up without an answer (it was cancelled or
+    timed out). Raised by a flight's function to say so; followers then retry
+    rather than sharing the failure.
+    """
+
+
+class Flight:
+    """One in-flight call; followers wait on ``future``."""
+
+    def __init__(self, group, key):
+        self.group = group
+        self.key = key
+        self.future = Future()
+        self.followers = 0
+
+    def resolve(self, value):
+        if not self.future.done():
+            self.future.set_result(value)
+        self.group._land(self, "resolved")
+
+    def fail(self, error):
+        """
+        Shares the leader's exception with every follower. Cancellation
+        (BaseExceptions such as CancelledError or GeneratorExit, and
+        FlightAbandoned) abandons the flight instead, so followers retry.
+        """
+        if not isinstance(error, Exception) or isinstance(error, FlightAbandoned):
+            self.abandon()
+            return
+        if not self.future.done():
+            self.future.set_exception(error)
+        self.group._land(self, "failed")
+
+    def abandon(self):
+        if not self.future.done():
+            self.future.set_exception(FlightAbandoned(f"{self.group.name} call was abandoned by its leader"))
+        self.group._land(self, "abandoned")
+
+    def result(self):
+        """Waits for the leader's answer (raising its exception, or FlightAbandoned)."""
+        started = time.perf_counter()
+        try:
+            return self.future.result()
+        finally:
+            record_span("flight.wait", time.perf_counter() - started, group=self.group.name)
+
+    async def aresult(self):
+        started = time.perf_counter()
+        try:
+            # The shield keeps a cancelled follower from cancelling the shared future
+            return await asyncio.shield(asyncio.wrap_future(self.future))
+        finally:
+            record_span("flight.wait", time.perf_counter() - started, group=self.group.name)
+
+
+class SingleFlight:
+    """
+    Collapses concurrent identical calls within the process: the first caller
+    for a key (the leader) does the work, callers arriving while it runs
+    (followers) wait for its result or exception instead of repeating it.
+    Nothing is kept once the call finishes; caching is left to the caller.
+
+    A follower that is cancelled stops waiting without affecting the others.
+    When the leader is cancelled, the flight is abandoned and its followers
+    retry, one of them becoming the new leader.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self._flights = {}
+        self._lock = threading.Lock()
+        self.leaders = 0
+        self.collapsed = 0
+        self.failed = 0
+        self.abandoned = 0
+
+    def join(self, key):
+        """
+        Returns (flight, leader). A leader must finish the flight with
+        resolve, fail or abandon; a follower waits with result/aresult.
+        """
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight is not None:
+                flight.followers += 1
+                self.collapsed += 1
+                return flight, False
+            flight = self._flights[key] = Flight(self, key)
+            self.leaders += 1
+            return flight, True
+
+    def _land(self, flight, outcome):
+        with self._lock:
+            if self._flights.get(flight.key) is flight:
+                del self._flights[flight.key]
+                if outcome == "failed":
+                    self.failed += 1
+                elif outcome == "abandoned":
+                    self.abandoned += 1
+
+    def do(self, key, fn):
+        """Returns fn(), or the result of an identical call already in flight."""
+        while True:
+            flight, leader = self.join(key)
+            if not leader:
+                try:
+                    return flight.result()
+                except FlightAbandoned:
+                    continue
+            try:
+                value = fn()
+            except BaseException as e:
+                flight.fail(e)
+                raise
+            flight.resolve(value)
+            return value
+
+    async def ado(self, key, fn):
+        """Async do: awaits fn() (a coroutine function) or the identical call in flight."""
+        while True:
+            flight, leader = self.join(key)
+            if not leader:
+                try:
+                    return await flight.aresult()
+                except FlightAbandoned:
+                    continue
+            try:
+                value = await fn()
+            except BaseException as e:
+                flight.fail(e)
+                raise
+            flight.resolve(value)
+            return value
+
+    def stats(self):
+        with self._lock:
+            return {
+                "in_flight": len(self._flights),
+                "leaders": self.leaders,
+                "collapsed": self.collapsed,
+                "failed": self.failed,
+                "abandoned": self.abandoned
+            }
+
+
+_groups = {}
+_groups_lock = threading.Lock()
+
+
+def get_single_flight(name):
+    """Returns the process-wide SingleFlight group with this name."""
+    with _groups_lock:
+        group = _groups.get(name)
+        if group is None:
+            group = _groups[name] = SingleFlight(name)
+        return group
+
+
+def all_single_flight_stats():
+    """Stats of every group in the process, keyed by group name."""
+    with _groups_lock:
+        return {group.name: group.stats() for group in _groups.values()}
@@ -0,0 +1,204 @@
+import json
+import os
+import re
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from local_store import get_local_store
+from schema_cache import SCHEMA_CACHE_DIR
+from schema_index import HashingEmbedder
+
+# SQLite file the cache keeps its entries in when no shared LocalStore is
+# configured; empty keeps them in process memory only.
+SQL_CACHE_PATH = os.getenv("SQL_CACHE_PATH", os.path.join(SCHEMA_CACHE_DIR, "sql_cache.sqlite3"))
+SQL_CACHE_MAX_ENTRIES = int(os.getenv("SQL_CACHE_MAX_ENTRIES", "1000"))
+SQL_CACHE_THRESHOLD = float(os.getenv("SQL_CACHE_THRESHOLD", "0.92"))
+
+_FILLER = {"please", "pls", "kindly", "can", "could", "would", "you", "me", "show", "give",
+           "get", "list", "tell", "what", "are", "is", "the", "a", "an", "of", "all"}
+
+# Words that make a question depend on the previous answer ("and for those?").
+_REFERENTIAL = {"that", "those", "these", "it", "them", "same", "previous", "above", "again"}
+
+_LITERALS = re.compile(r"'[^']*'|\"[^\"]*\"|\d+(?:\.\d+)?")
+
+
+def normalize_question(question):
+    """Lowercases, strips punctuation and filler words so rewordings share a key."""
+    words = re.findall(r"[a-z0-9_.']+", question.lower())
+    kept = [w.strip(".'") for w in words if w.strip(".'") and w.strip(".'") not in _FILLER]
+    return " ".join(kept)
+
+
+def is_context_dependent(question):
+    """True when the question refers back to an earlier answer."""
+    return bool(_REFERENTIAL & set(re.findall(r"[a-z]+", question.lower())))
+
+
+def question_literals(question):
+    """Numbers and quoted values; two questions only match when these are equal."""
+    return sorted(_LITERALS.findall(question.lower()))
+
+
+class SQLCache:
+    """
+    Question -> SQL cache in front of the LLM. Lookups try the normalized
+    question first and fall back to embedding similarity above ``threshold``.
+    Entries are scoped to a schema snapshot version and evicted least recently
+    used beyond ``max_entries``.
+
+    Entries are persisted one row at a time in a LocalStore: ``store`` when
+    given, otherwise one opened at ``path`` (no persistence when both are
+    empty). Every lookup first picks up what other processes wrote since the
+    last one.
+    """
+
+    STORE_NAMESPACE = "sql"
+
+    def __init__(self, path=SQL_CACHE_PATH, max_entries=SQL_CACHE_MAX_ENTRIES,
+                 threshold=SQL_CACHE_THRESHOLD, embedder=None, store=None):
+        self.path = path
+        self.store = store
+        self.max_entries = max_entries
+        self.threshold = threshold
+        self.embedder = embedder or HashingEmbedder()
+        self.entries = OrderedDict()
+        self.vectors = {}
+        self.hits_exact = 0
+        self.hits_semantic = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._synced_at = 0.0
+        self._opened = store is not None
+
+    @staticmethod
+    def _store_key(key):
+        return f"{key[0]}\n{key[1]}"
+
+    def _open(self):
+        """Opens the store at ``path`` on first use, so building the cache stays cheap."""
+        if not self._opened:
+            self._opened = True
+            if self.path:
+                self.store = get_local_store(self.path)
+
+    def _sync(self):
+        """Applies entries other processes wrote to the store (empty values are invalidations)."""
+        for store_key, value, updated_at in self.store.changed_since(self.STORE_NAMESPACE, self._synced_at):
+            key = tuple(store_key.split("\n", 1))
+            self.vectors.pop(key, None)
+            if value:
+                self.entries[key] = json.loads(value)
+                self.entries.move_to_end(key)
+            else:
+                self.entries.pop(key, None)
+            self._synced_at = updated_at
+        while len(self.entries) > self.max_entries:
+            old_key, _ = self.entries.popitem(last=False)
+            self.vectors.pop(old_key, None)
+
+    def _persist(self, key):
+        if self.store is None:
+            return
+        entry = self.entries.get(key)
+        value = json.dumps(entry).encode("utf-8") if entry is not None else b""
+        self.store.put(self.STORE_NAMESPACE, self._store_key(key), value)
+        self.store.trim(self.STORE_NAMESPACE, max_entries=self.max_entries)
+
+    def _vector(self, key):
+        if key not in self.vectors:
+            self.vectors[key] = self.embedder.embed([key[1]])[0]
+        return self.vectors[key]
+
+    def get(self, question, version):
+        """
+        Returns the cached SQL for the question under this schema version, or None.
+        """
+        key = (version, normalize_question(question))
+        with self._lock:
+            self._open()
+            if self.store is not None:
+                self._sync()
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.entries.move_to_end(key)
+                self.hits_exact += 1
+                return entry["sql"]
+
+            literals = question_literals(question)
+            candidates = [k for k, e in self.entries.items()
+                          if k[0] == version and e["literals"] == literals]
+            if candidates:
+                query = self.embedder.embed([key[1]])[0]
+                scores = np.stack([self._vector(k) for k in candidates]) @ query
+                best = int(np.argmax(scores))
+                if scores[best] >= self.threshold:
+                    self.entries.move_to_end(candidates[best])
+                    self.hits_semantic += 1
+                    return self.entries[candidates[best]]["sql"]
+
+            self.misses += 1
+            return None
+
+    def put(self, question, version, sql):
+        key = (version, normalize_question(question))
+        with self._lock:
+            self._open()
+            self.entries[key] = {
+                "version": version,
+                "key": key[1],
+                "question": question,
+                "literals": question_literals(question),
+                "sql": sql
+            }
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                old_key, _ = self.entries.popitem(last=False)
+                self.vectors.pop(old_key, None)
+            self._persist(key)
+
+    def invalidate(self, question, version, sql=None):
+        """
+        Drops the entry for a question, e.g. when its SQL failed to run. With
+        ``sql``, every entry of that version holding that SQL is dropped instead
+        (the question may have been answered by a similar one's entry), and an
+        entry that has since been replaced with other SQL is kept.
+        """
+        key = (version, normalize_question(question))
+        with self._lock:
+            self._open()
+            if self.store is not None:
+                self._sync()
+            if sql is None:
+                keys = [key] if key in self.entries else []
+            else:
+                keys = [k for k, e in self.entries.items() if k[0] == version and e["sql"] == sql]
+            for key in keys:
+                del self.entries[key]
+                self.vectors.pop(key, None)
+                self._persist(key)
+
+    def stats(self):
+        lookups = self.hits_exact + self.hits_semantic + self.misses
+        return {
+            "entries": len(self.entries),
+            "hits_exact": self.hits_exact,
+            "hits_semantic": self.hits_semantic,
+            "misses": self.misses,
+            "hit_ratio": (self.hits_exact + self.hits_semantic) / lookups if lookups else 0.0
+        }
+
+
+_shared_cache = None
+_shared_lock = threading.Lock()
+
+
+def get_sql_cache():
+    """Returns the process-wide SQLCache, backed by the shared LocalStore when one is configured."""
+    global _shared_cache
+    with _shared_lock:
+        if _shared_cache is None:
+            _shared_cache = SQLCache(store=get_local_store())
+        return _shared_cache
@@ -0,0 +1,231 @@
+import re
+import time
+
+from prompt_builder import parse_ddl
+from result_cache import referenced_tables
+from telemetry import record_span
+
+# Schemas whose objects are not in the snapshot but always exist
+_SYSTEM_SCHEMAS = {"sys", "information_schema"}
+# Names defined by a WITH clause, for the table-only check
+_CTE_NAME = re.compile(r"(?:\bWITH|,)\s*\[?(\w+)\]?\s*(?:\([^)]*\)\s*)?AS\s*\(", re.IGNORECASE)
+
+_sqlglot = None
+
+
+def _parser():
+    """sqlglot, imported on first use; False when it isn't installed."""
+    global _sqlglot
+    if _sqlglot is None:
+        try:
+            import sqlglot
+            import sqlglot.optimizer.scope  # noqa: F401
+            _sqlglot = sqlglot
+        except ImportError:
+            _sqlglot = False
+    return _sqlglot
+
+
+class SchemaCatalog:
+    """
+    Tables and columns of a schema snapshot, for checking generated SQL.
+    Names are compared case-insensitively, as with SQL Server's default
+    collations.
+    """
+
+    def __init__(self, schema_data):
+        self.databases = set()
+        self.tables = {}
+        self.by_name = {}
+        for name, info in schema_data.items():
+            database, schema, table = name.lower().split(".", 2)
+            self.databases.add(database)
+            columns, _, _ = parse_ddl(info["schema"])
+            key = f"{schema}.{table}"
+            self.tables[key] = {col.lower() for col, _ in columns}
+            self.by_name.setdefault(table, []).append(key)
+
+    def resolve(self, table, schema=None, database=None):
+        """
+        Returns the 'schema.table' key, None for an unknown table, or "" when
+        the reference can't be checked (temporary tables, table variables,
+        system views, other databases).
+        """
+        table = table.lower()
+        if table.startswith(("#", "@")) or (schema or "").lower() in _SYSTEM_SCHEMAS:
+            return ""
+        if database and database.lower() not in self.databases:
+            return ""
+        if schema:
+            key = f"{schema.lower()}.{table}"
+            return key if key in self.tables else None
+        # Unqualified names resolve through the user's default schema, usually dbo
+        if f"dbo.{table}" in self.tables:
+            return f"dbo.{table}"
+        candidates = self.by_name.get(table, [])
+        return candidates[0] if candidates else None
+
+
+def _outputs(scope):
+    """Lowercased output column names of a derived table / CTE scope, or None when it selects *."""
+    from sqlglot import exp
+
+    query = scope.expression
+    if not isinstance(query, exp.Query):
+        # APPLY / table-valued function sources wrap the query they select from
+        query = query.find(exp.Query)
+        if query is None:
+            return None
+    # A column list (WITH c (a, b) AS ..., or (...) AS x (a, b)) renames the outputs
+    alias = query.parent.args.get("alias") if isinstance(query.parent, (exp.CTE, exp.Subquery)) else None
+    if alias is not None and alias.columns:
+        return {column.name.lower() for column in alias.columns}
+    names = set()
+    for select in query.selects:
+        if select.is_star:
+            return None
+        names.add(select.alias_or_name.lower())
+    return names
+
+
+def _table_name(table):
+    """The table's name with the # / @ prefix of temporary tables and table variables kept."""
+    from sqlglot import exp
+
+    if isinstance(table.this, exp.Parameter):
+        return f"@{table.name}"
+    if isinstance(table.this, exp.Identifier) and table.this.args.get("temporary"):
+        return f"#{table.name}"
+    return table.name
+
+
+class _ScopeChecker:
+    """Checks the column references of each query scope against its sources."""
+
+    def __init__(self, catalog, problems):
+        self.catalog = catalog
+        self.problems = problems
+        self._sources = {}
+
+    def sources(self, scope):
+        """alias -> set of column names (None when unknown) for a scope; reports unknown tables once."""
+        from sqlglot import exp
+
+        found = self._sources.get(id(scope))
+        if found is None:
+            found = self._sources[id(scope)] = {}
+            for alias, source in scope.sources.items():
+                if isinstance(source, exp.Table) and not isinstance(source.this, (exp.Identifier, exp.Parameter)):
+                    # Table-valued function such as STRING_SPLIT or OPENJSON
+                    found[alias.lower()] = None
+                elif isinstance(source, exp.Table):
+                    key = self.catalog.resolve(_table_name(source), source.db or None, source.catalog or None)
+                    if key is None:
+                        self.problems.append(f"unknown table {source.sql(dialect='tsql')}")
+                    found[alias.lower()] = self.catalog.tables.get(key) if key else None
+                else:
+                    found[alias.lower()] = _outputs(source)
+        return found
+
+    def _lookup(self, scope, column):
+        """
+        Columns of the source a qualified reference points to, searching the
+        enclosing scopes for correlated references. None when not checkable.
+        """
+        alias = column.table.lower()
+        while scope is not None:
+            sources = self.sources(scope)
+            if alias in sources:
+                return sources[alias]
+            scope = scope.parent
+        return None
+
+    def _matches(self, scope, name):
+        """
+        Aliases of the innermost scope whose sources have the column, or
+        None when some source's columns are unknown.
+        """
+        while scope is not None:
+            sources = self.sources(scope)
+            if any(columns is None for columns in sources.values()):
+                return None
+            matches = [alias for alias, columns in sources.items() if name in columns]
+            if matches:
+                return matches
+            scope = scope.parent
+        return []
+
+    def check(self, scope):
+        from sqlglot import exp
+
+        self.sources(scope)
+        aliases = {select.alias.lower() for select in getattr(scope.expression, "selects", []) if select.alias}
+        for column in scope.columns:
+            # Columns of nested queries are checked with their own scope
+            if column.find_ancestor(exp.Query) is not scope.expression:
+                continue
+            name = column.name.lower()
+            if column.table:
+                columns = self._lookup(scope, column)
+                if columns is not None and name not in columns:
+                    self.problems.append(f"unknown column {column.sql(dialect='tsql')}")
+                continue
+            if name in aliases or not self.sources(scope):
+                continue
+            matches = self._matches(scope, name)
+            if matches == []:
+                self.problems.append(f"unknown column '{column.name}'")
+            elif matches and len(matches) > 1:
+                self.problems.append(f"ambiguous column '{column.name}' (in {', '.join(sorted(matches))})")
+
+
+def validate_sql(sql, catalog):
+    """
+    Checks generated T-SQL against the schema without contacting the server:
+    unknown tables, unknown columns and ambiguous unqualified columns.
+
+    SQL is parsed with sqlglot's T-SQL dialect. Statements it can't parse
+    are not rejected (the parser doesn't cover every T-SQL construct);
+    without sqlglot only the referenced tables are checked.
+
+    Returns:
+        dict: {"status": "valid" | "invalid" | "unchecked", "problems": [...], "checker"}
+    """
+    started = time.perf_counter()
+    problems = []
+    sqlglot = _parser()
+    if sqlglot:
+        checker = "sqlglot"
+        try:
+            scopes = _ScopeChecker(catalog, problems)
+            for statement in sqlglot.parse(sql, read="tsql"):
+                if statement is None or isinstance(statement, (sqlglot.exp.Use, sqlglot.exp.Command)):
+                    continue
+                for scope in sqlglot.optimizer.scope.traverse_scope(statement):
+                    scopes.check(scope)
+        except sqlglot.errors.ParseError as e:
+            checker, problems = "unparsed", []
+            print(f"⚠️ Could not parse the generated SQL locally: {str(e).splitlines()[0]}")
+        except Exception as e:
+            # Never let a gap in the analysis block a query
+            checker, problems = "error", []
+            print(f"⚠️ Local SQL validation skipped: {e}")
+    else:
+        checker = "tables"
+        ctes = {name.lower() for name in _CTE_NAME.findall(sql)}
+        for table in sorted(referenced_tables(sql)):
+            schema, name = table.split(".", 1)
+            if name in ctes:
+                continue
+            # referenced_tables reports unqualified names as dbo
+            if catalog.resolve(name, None if schema == "dbo" else schema) is None:
+                problems.append(f"unknown table {table}")
+
+    problems = list(dict.fromkeys(problems))
+    if checker in ("unparsed", "error"):
+        status = "unchecked"
+    else:
+        status = "invalid" if problems else "valid"
+    record_span("sql.validate", time.perf_counter() - started, status=status, checker=checker,
+                problems=len(problems))
+    return {"status": status, "problems": problems, "checker": checker}
@@ -0,0 +1,194 @@
+import contextvars
+import json
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Where finished spans are appended, one JSON object per line (e.g. .telemetry/spans.jsonl);
+# off unless set, since every question writes several spans.
+TELEMETRY_PATH = os.getenv("TELEMETRY_PATH", "")
+# Size at which the span log is rotated to <path>.1 (the previous .1 is dropped).
+TELEMETRY_MAX_BYTES = int(os.getenv("TELEMETRY_MAX_BYTES", str(64 * 1024 * 1024)))
+
+# Span attributes summed into counters, and the spans they are taken from (so
+# e.g. rows are not counted again by every stage that reports them).
+COUNTED_ATTRIBUTES = {
+    "prompt_tokens": ("llm.sql", "llm.repair", "llm.explanation"),
+    "response_tokens": ("llm.sql", "llm.repair", "llm.explanation"),
+    "rows": ("db.fetch",),
+    "bytes": ("db.fetch",),
+}
+
+# Histogram buckets (seconds) for stage durations.
+STAGE_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+_current_trace = contextvars.ContextVar("sqlchatbot_trace", default=None)
+_lock = threading.Lock()
+_stages = {}
+_counters = {}
+_sources = {}
+
+
+def _observe(name, seconds, attrs):
+    with _lock:
+        stage = _stages.setdefault(name, {"count": 0, "sum": 0.0, "buckets": [0] * len(STAGE_BUCKETS)})
+        stage["count"] += 1
+        stage["sum"] += seconds
+        for idx, bound in enumerate(STAGE_BUCKETS):
+            if seconds <= bound:
+                stage["buckets"][idx] += 1
+        for key, stages in COUNTED_ATTRIBUTES.items():
+            if name in stages and isinstance(attrs.get(key), (int, float)):
+                counter = f"{key}_total"
+                _counters[counter] = _counters.get(counter, 0) + attrs[key]
+
+
+def _write(record):
+    if not TELEMETRY_PATH:
+        return
+    try:
+        line = json.dumps(record, default=str)
+        with _lock:
+            os.makedirs(os.path.dirname(TELEMETRY_PATH) or ".", exist_ok=True)
+            try:
+                if os.path.getsize(TELEMETRY_PATH) > TELEMETRY_MAX_BYTES:
+                    os.replace(TELEMETRY_PATH, TELEMETRY_PATH + ".1")
+            except FileNotFoundError:
+                pass
+            with open(TELEMETRY_PATH, "a", encoding="utf-8") as f:
+                f.write(line + "\n")
+    except OSError as e:
+        print(f"⚠️ Could not write telemetry: {e}")
+
+
+def record_span(name, seconds, **attrs):
+    """
+    Records a finished stage: updates the metrics, writes a JSONL line and
+    attaches it to the current trace (if any).
+    """
+    trace = _current_trace.get()
+    span = {
+        "trace_id": trace["id"] if trace else None,
+        "name": name,
+        "ms": round(seconds * 1000, 3),
+        "ts": time.time(),
+        **attrs
+    }
+    if trace is not None:
+        trace["spans"].append(span)
+    _observe(name, seconds, attrs)
+    _write(span)
+    return span
+
+
+@contextmanager
+def span(name, **attrs):
+    """
+    Times the block as a stage. Yields a dict; keys added to it (token
+    counts, rows, bytes...) are stored with the span.
+    """
+    started = time.perf_counter()
+    try:
+        yield attrs
+    except Exception as e:
+        attrs["error"] = f"{e.__class__.__name__}: {e}"
+        raise
+    finally:
+        record_span(name, time.perf_counter() - started, **attrs)
+
+
+@contextmanager
+def trace(name, **attrs):
+    """
+    Groups the spans recorded inside the block (including ones in asyncio tasks
+    and in threads started through ``run_in_context``) under one trace id.
+    Yields the list that collects them.
+    """
+    current = {"id": uuid.uuid4().hex[:16], "spans": []}
+    token = _current_trace.set(current)
+    started = time.perf_counter()
+    try:
+        yield current["spans"]
+    finally:
+        record_span(name, time.perf_counter() - started, **attrs)
+        _current_trace.reset(token)
+
+
+def run_in_context(fn):
+    """Wraps fn so it runs with the caller's context (and trace) in another thread."""
+    ctx = contextvars.copy_context()
+    return lambda *args, **kwargs: ctx.run(fn, *args, **kwargs)
+
+
+def increment(name, value=1):
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + value
+
+
+def register_source(name, fn):
+    """Adds a callable returning {metric: number} (e.g. cache stats) to every metrics render."""
+    _sources[name] = fn
+
+
+def render_prometheus():
+    """Current metrics in the Prometheus text exposition format."""
+    lines = ["# HELP sqlchatbot_stage_seconds Duration of each chatbot stage",
+             "# TYPE sqlchatbot_stage_seconds histogram"]
+    with _lock:
+        stages = {name: dict(stage, buckets=list(stage["buckets"])) for name, stage in _stages.items()}
+        counters = dict(_counters)
+    for name, stage in sorted(stages.items()):
+        for bound, count in zip(STAGE_BUCKETS, stage["buckets"]):
+            lines.append(f'sqlchatbot_stage_seconds_bucket{{stage="{name}",le="{bound}"}} {count}')
+        lines.append(f'sqlchatbot_stage_seconds_bucket{{stage="{name}",le="+Inf"}} {stage["count"]}')
+        lines.append(f'sqlchatbot_stage_seconds_sum{{stage="{name}"}} {stage["sum"]:.6f}')
+        lines.append(f'sqlchatbot_stage_seconds_count{{stage="{name}"}} {stage["count"]}')
+    for name, value in sorted(counters.items()):
+        lines.append(f"# TYPE sqlchatbot_{name} counter")
+        lines.append(f"sqlchatbot_{name} {value}")
+    for source, fn in sorted(_sources.items()):
+        try:
+            values = fn()
+        except Exception as e:
+            lines.append(f"# source {source} failed: {e}")
+            continue
+        for key, value in sorted(values.items()):
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                lines.append(f"sqlchatbot_{source}_{key} {value}")
+            elif isinstance(value, dict):  # e.g. one stats dict per connection pool
+                for sub_key, sub_value in sorted(value.items()):
+                    if isinstance(sub_value, (int, float)):
+                        lines.append(f'sqlchatbot_{source}_{sub_key}{{name="{key}"}} {sub_value}')
+    return "\n".join(lines) + "\n"
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.rstrip("/") != "/metrics":
+            self.send_error(404)
+            return
+        body = render_prometheus().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+_server = None
+
+
+def start_metrics_server(port=int(os.getenv("METRICS_PORT", "9464")), host="127.0.0.1"):
+    """Serves /metrics on a daemon thread; calling it again is a no-op."""
+    global _server
+    if _server is None:
+        _server = ThreadingHTTPServer((host, port), _MetricsHandler)
+        threading.Thread(target=_server.serve_forever, name="metrics", daemon=True).start()
+        print(f"📈 Metrics at http://{host}:{port}/metrics")
+    return _server
@@ -0,0 +1,16 @@
+import os
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# The modules live at the repository root, next to this folder; the offline
+# stand-ins for the model and pyodbc live in benchmarks/
+sys.path[:0] = [ROOT, os.path.join(ROOT, "benchmarks")]
+
+# Keep every on-disk cache and log out of the working tree before the app modules load
+_WORK_DIR = tempfile.mkdtemp(prefix="sqlchatbot-tests-")
+os.environ.setdefault("SCHEMA_CACHE_DIR", os.path.join(_WORK_DIR, "cache"))
+os.environ.setdefault("SQL_CACHE_PATH", "")
+os.environ.setdefault("WORKLOAD_LOG_PATH", "")
+os.environ.setdefault("SCHEMA_EMBED_MODEL", "")
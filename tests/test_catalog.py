@@ -0,0 +1,29 @@
+import os
+import sqlite3
+import subprocess
+import sys
+
+import connect
+from sqlite_adapter import connect_sqlite
+
+
+def test_composite_primary_key_is_listed_in_key_order(tmp_path):
+    path = str(tmp_path / "shop.sqlite")
+    raw = sqlite3.connect(path)
+    raw.execute("CREATE TABLE order_lines (order_id INTEGER, line_no INTEGER, sku VARCHAR(20), "
+                "PRIMARY KEY (line_no, order_id))")
+    raw.close()
+
+    tables, _ = connect._fetch_catalog(connect_sqlite(path).cursor(), {"round_trips": 0})
+    entry = tables[("dbo", "order_lines")]
+    assert [col[0] for col in entry["columns"]] == ["order_id", "line_no", "sku"]
+    assert entry["pk"] == ["line_no", "order_id"]
+    ddl = connect._build_ddl("dbo", "order_lines", entry["columns"], entry["pk"], [])
+    assert "PRIMARY KEY ([line_no], [order_id])" in ddl
+
+
+def test_importing_connect_loads_neither_numpy_nor_pandas():
+    code = "import sys, connect; print(sorted({'numpy', 'pandas'} & set(sys.modules)))"
+    output = subprocess.run([sys.executable, "-c", code], cwd=os.path.dirname(connect.__file__),
+                            capture_output=True, text=True, check=True).stdout
+    assert output.strip() == "[]"
@@ -0,0 +1,27 @@
+import pytest
+
+from explanations import explain_locally
+
+pytest.importorskip("sqlglot")
+
+
+@pytest.mark.parametrize("where, words", [
+    ("Discontinued = 1 OR Price < 5 AND Stock > 0",
+     "discontinued is 1 or (price is less than 5 and stock is greater than 0)."),
+    ("(Discontinued = 1 OR Price < 5) AND Stock > 0",
+     "(discontinued is 1 or price is less than 5) and stock is greater than 0."),
+    ("Discontinued = 1 AND Price < 5 AND Stock > 0",
+     "discontinued is 1 and price is less than 5 and stock is greater than 0."),
+    ("Discontinued = 1 OR (Price < 5 OR Stock > 0)",
+     "discontinued is 1 or price is less than 5 or stock is greater than 0."),
+    ("(Discontinued = 1 OR Price < 5) AND (Stock > 0 OR CategoryID = 2)",
+     "(discontinued is 1 or price is less than 5) and (stock is greater than 0 or category id is 2)."),
+])
+def test_mixed_and_or_keep_their_precedence(where, words):
+    explanation = explain_locally(f"SELECT * FROM Products WHERE {where}")
+    assert explanation.endswith(f"limited to records where {words}")
+
+
+def test_complex_queries_are_left_to_the_model():
+    assert explain_locally("WITH c AS (SELECT 1 AS a) SELECT a FROM c") is None
+    assert explain_locally("SELECT * FROM Products WHERE Price > (SELECT AVG(Price) FROM Products)") is None
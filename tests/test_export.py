@@ -0,0 +1,105 @@
+import csv
+import os
+import threading
+import time
+
+import pytest
+
+from export import ExportCancelled, export_path, export_query
+from sqlite_adapter import build_synthetic_database, connect_sqlite
+
+
+@pytest.fixture(scope="module")
+def database(tmp_path_factory):
+    path = str(tmp_path_factory.mktemp("db") / "shop.sqlite")
+    build_synthetic_database(path, 1, order_rows=1000)
+    return path
+
+
+def test_csv_export_streams_every_row(database, tmp_path):
+    path = export_path("csv", str(tmp_path))
+    progress = []
+    stats = export_query(connect_sqlite(database), "SELECT order_id, customer FROM orders", path, "csv",
+                         batch_size=300, on_progress=progress.append)
+    with open(path, newline="", encoding="utf-8") as f:
+        rows = list(csv.reader(f))
+    assert rows[0] == ["order_id", "customer"] and len(rows) == 1001
+    assert stats["rows"] == 1000 and stats["columns"] == ["order_id", "customer"]
+    assert [p["rows"] for p in progress] == [300, 600, 900, 1000]
+    assert os.listdir(tmp_path) == [os.path.basename(path)]
+
+
+def test_parquet_export(database, tmp_path):
+    pq = pytest.importorskip("pyarrow.parquet")
+    path = str(tmp_path / "orders.parquet")
+    export_query(connect_sqlite(database), "SELECT order_id, total FROM orders", path, "parquet", batch_size=400)
+    table = pq.read_table(path)
+    assert table.num_rows == 1000 and table.column_names == ["order_id", "total"]
+
+
+@pytest.mark.parametrize("output_format", ["csv", "parquet"])
+def test_cancel_removes_the_partial_file(database, tmp_path, output_format):
+    if output_format == "parquet":
+        pytest.importorskip("pyarrow")
+    cancelled = threading.Event()
+    path = str(tmp_path / f"orders.{output_format}")
+    with pytest.raises(ExportCancelled):
+        export_query(connect_sqlite(database), "SELECT * FROM orders", path, output_format, batch_size=100,
+                     on_progress=lambda progress: cancelled.set(), cancelled=cancelled)
+    assert os.listdir(tmp_path) == []
+
+
+class SlowCursor:
+    """Returns a batch every 20 ms until cancelled; then fails like pyodbc or runs dry like SQLite."""
+
+    description = [("n", int)]
+
+    def __init__(self, raise_on_cancel):
+        self.raise_on_cancel = raise_on_cancel
+        self.cancelled = False
+
+    def execute(self, sql):
+        return self
+
+    def fetchmany(self, size):
+        if self.cancelled:
+            if self.raise_on_cancel:
+                raise RuntimeError("Operation canceled")
+            return []
+        time.sleep(0.02)
+        return [(n,) for n in range(size)]
+
+    def cancel(self):
+        self.cancelled = True
+
+    def close(self):
+        pass
+
+
+class SlowConnection:
+    def __init__(self, raise_on_cancel):
+        self.raise_on_cancel = raise_on_cancel
+
+    def cursor(self):
+        return SlowCursor(self.raise_on_cancel)
+
+
+@pytest.mark.parametrize("raise_on_cancel", [True, False])
+def test_timeout_removes_the_partial_file(tmp_path, raise_on_cancel):
+    path = str(tmp_path / "slow.csv")
+    with pytest.raises(TimeoutError):
+        export_query(SlowConnection(raise_on_cancel), "SELECT n FROM numbers", path, "csv", batch_size=10,
+                     timeout=0.1)
+    assert os.listdir(tmp_path) == []
+
+
+def test_statement_without_result_set_leaves_nothing(database, tmp_path):
+    with pytest.raises(ValueError):
+        export_query(connect_sqlite(database), "UPDATE orders SET status = status WHERE 1 = 0",
+                     str(tmp_path / "none.csv"))
+    assert os.listdir(tmp_path) == []
+
+
+def test_unknown_format_is_rejected(tmp_path):
+    with pytest.raises(ValueError):
+        export_path("xlsx", str(tmp_path))
@@ -0,0 +1,137 @@
+import os
+import threading
+
+import pandas as pd
+import pytest
+
+import history_store
+from history_store import ChatHistory, ResultSpool
+from result_cache import _frame_bytes
+
+
+def frame(rows, start=0):
+    result = pd.DataFrame({"id": range(start, start + rows), "name": [f"n{i}" for i in range(rows)]})
+    result.attrs["rows"] = rows
+    return result
+
+
+@pytest.fixture
+def spool(tmp_path):
+    # Room for two of the 1,000-row frames below
+    return ResultSpool(memory_bytes=2 * _frame_bytes(frame(1000)) + 1, spill_dir=str(tmp_path))
+
+
+def spill_files(spool):
+    return os.listdir(spool._spill_dir) if spool._spill_dir else []
+
+
+def test_results_within_budget_stay_in_memory(spool):
+    ids = [spool.put(frame(1000)) for _ in range(2)]
+    assert spool.stats()["in_memory"] == 2 and spool.stats()["spilled"] == 0
+    assert all(not spool.info(result_id)["spilled"] for result_id in ids)
+    assert spill_files(spool) == []
+
+
+def test_least_recently_used_result_is_spilled_and_read_back(spool):
+    first = frame(1000)
+    first_id = spool.put(first)
+    second_id = spool.put(frame(1000, start=1000))
+    spool.get(first_id)
+    spool.put(frame(1000, start=2000))
+    assert spool.info(second_id)["spilled"] and not spool.info(first_id)["spilled"]
+    assert len(spill_files(spool)) == 1
+
+    restored = spool.get(second_id)
+    pd.testing.assert_frame_equal(restored, frame(1000, start=1000))
+    assert restored.attrs == {"rows": 1000}
+    # Reading it back made room by spilling the next least recently used one
+    stats = spool.stats()
+    assert (stats["spilled"], stats["loaded_back"]) == (2, 1)
+    assert stats["memory_bytes"] <= stats["memory_budget"]
+
+
+def test_page_of_a_spilled_result_is_read_without_loading_it(spool):
+    result_id = spool.put(frame(1000))
+    spool.put(frame(1000))
+    spool.put(frame(1000))
+    assert spool.info(result_id)["spilled"]
+    page = spool.page(result_id, 2, page_rows=300)
+    assert page["id"].tolist() == list(range(600, 900)) and list(page.index) == list(range(600, 900))
+    assert spool.page(result_id, 3, page_rows=300)["id"].tolist() == list(range(900, 1000))
+    assert spool.info(result_id)["spilled"] and spool.stats()["loaded_back"] == 0
+
+
+def test_frames_arrow_cannot_store_as_is_survive_a_spill(tmp_path):
+    spool = ResultSpool(memory_bytes=0, spill_dir=str(tmp_path))
+    duplicated = pd.DataFrame([[1, 2, 3]], columns=["a", "a", 7])
+    mixed = pd.DataFrame({"value": [1, "two", 3.0]})
+    ids = [spool.put(duplicated), spool.put(mixed)]
+    assert all(spool.info(result_id)["spilled"] for result_id in ids)
+    pd.testing.assert_frame_equal(spool.get(ids[0]), duplicated)
+    pd.testing.assert_frame_equal(spool.get(ids[1]), mixed)
+
+
+def test_release_deletes_spilled_files(spool):
+    ids = [spool.put(frame(1000)) for _ in range(3)]
+    assert len(spill_files(spool)) == 1
+    spool.release(ids)
+    assert spill_files(spool) == []
+    assert spool.stats()["results"] == 0 and spool.stats()["memory_bytes"] == 0
+
+
+def test_spill_is_written_outside_the_lock(spool, monkeypatch):
+    writing, finish = threading.Event(), threading.Event()
+    write_spill = history_store._write_spill
+
+    def slow_write(result, path):
+        writing.set()
+        finish.wait(5)
+        return write_spill(result, path)
+
+    monkeypatch.setattr(history_store, "_write_spill", slow_write)
+    evicted_id = spool.put(frame(1000))
+    other_id = spool.put(frame(1000, start=1000))
+    writer = threading.Thread(target=spool.put, args=(frame(1000, start=2000),))
+    writer.start()
+    assert writing.wait(5)
+
+    # While the file is being written, the spool keeps serving every result
+    assert spool.page(other_id, 0, page_rows=10)["id"].tolist() == list(range(1000, 1010))
+    assert spool.get(evicted_id)["id"].tolist() == list(range(1000))
+    finish.set()
+    writer.join(5)
+    assert spool.info(evicted_id)["spilled"] and spool.stats()["spilled"] == 1
+
+
+def test_result_released_while_being_written_leaves_no_file(spool, monkeypatch):
+    writing, finish = threading.Event(), threading.Event()
+    write_spill = history_store._write_spill
+
+    def slow_write(result, path):
+        writing.set()
+        finish.wait(5)
+        return write_spill(result, path)
+
+    monkeypatch.setattr(history_store, "_write_spill", slow_write)
+    evicted_id = spool.put(frame(1000))
+    spool.put(frame(1000))
+    writer = threading.Thread(target=spool.put, args=(frame(1000),))
+    writer.start()
+    assert writing.wait(5)
+    spool.release([evicted_id])
+    finish.set()
+    writer.join(5)
+    assert spill_files(spool) == []
+
+
+def test_chat_history_keeps_its_last_entries_and_releases_the_rest(spool):
+    history = ChatHistory(spool=spool, max_entries=2)
+    history.append("q1", "SELECT 1", frame(10), "e1")
+    history.append("q2", "SELECT 2", "❌ SQL Execution Error: boom", "e2")
+    third = history.append("q3", "SELECT 3", frame(5), "e3")
+    assert [entry["question"] for entry in history] == ["q2", "q3"]
+    assert history.result(history.entries[0]) == "❌ SQL Execution Error: boom"
+    assert history.page(third, 0, page_rows=2)["id"].tolist() == [0, 1]
+    assert spool.stats()["results"] == 1
+    history.clear()
+    assert spool.stats()["results"] == 0
@@ -0,0 +1,270 @@
+import threading
+import time
+
+import pytest
+
+from llm_scheduler import BATCH, INTERACTIVE, LLMBusy, LLMScheduler, TokenBucket, classify_error, llm_priority
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+    def advance(self, seconds):
+        self.now += seconds
+
+
+class Failing:
+    """Callable raising ``error`` for its first ``failures`` calls, then answering "ok"."""
+
+    def __init__(self, error, failures=float("inf")):
+        self.error = error
+        self.failures = failures
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        if self.calls <= self.failures:
+            raise self.error
+        return "ok"
+
+
+def scheduler(clock, **options):
+    options.setdefault("requests_per_minute", 0)
+    options.setdefault("tokens_per_minute", 0)
+    options.setdefault("backoff", 0)
+    options.setdefault("queue_timeout", 5)
+    return LLMScheduler(clock=clock, **options)
+
+
+def wake(sched):
+    """Lets the dispatcher re-check its limits after the fake clock moved."""
+    with sched._cond:
+        sched._cond.notify_all()
+
+
+def wait_until(predicate, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        assert time.monotonic() < deadline, "condition not reached"
+        time.sleep(0.005)
+
+
+def test_token_bucket_refills_with_the_clock():
+    clock = FakeClock()
+    bucket = TokenBucket(60, clock)
+    assert bucket.wait_time(60, clock()) == 0
+    bucket.take(60)
+    assert bucket.wait_time(1, clock()) == pytest.approx(1.0)
+    clock.advance(30)
+    assert bucket.wait_time(30, clock()) == 0
+    assert bucket.wait_time(31, clock()) == pytest.approx(1.0)
+    bucket.give(-100)  # charged more after the real usage was known
+    assert bucket.wait_time(1, clock()) == pytest.approx(71.0)
+
+
+def test_unlimited_bucket_never_waits():
+    bucket = TokenBucket(0, FakeClock())
+    bucket.take(10 ** 9)
+    assert bucket.wait_time(10 ** 9, 0) == 0
+
+
+def test_request_bucket_holds_calls_until_it_refills():
+    clock = FakeClock()
+    sched = scheduler(clock, requests_per_minute=2)
+    assert sched.call(lambda: 1) == 1
+    assert sched.call(lambda: 2) == 2
+
+    results = []
+    thread = threading.Thread(target=lambda: results.append(sched.call(lambda: 3)))
+    thread.start()
+    wait_until(lambda: sched.stats()["queued"] == 1)
+    time.sleep(0.05)
+    assert results == []  # the bucket is empty: 30s (fake) until the next request
+
+    clock.advance(30)
+    wake(sched)
+    thread.join(5)
+    assert results == [3]
+    assert sched.stats()["granted"] == 3
+
+
+def test_token_bucket_limits_large_prompts():
+    clock = FakeClock()
+    sched = scheduler(clock, tokens_per_minute=6000)
+    sched.call(lambda: "a", tokens=5000)  # 5000 + the reserved response tokens
+
+    done = threading.Event()
+    thread = threading.Thread(target=lambda: (sched.call(lambda: "b", tokens=2000), done.set()))
+    thread.start()
+    wait_until(lambda: sched.stats()["queued"] == 1)
+    assert not done.wait(0.05)
+    clock.advance(60)
+    wake(sched)
+    assert done.wait(5)
+    thread.join(5)
+
+
+def test_rate_limited_calls_are_retried_and_halve_the_limit():
+    sched = scheduler(FakeClock(), max_concurrency=8, retries=3)
+    fn = Failing(Exception("429 Resource has been exhausted (e.g. check quota)."), failures=2)
+    assert sched.call(fn) == "ok"
+    stats = sched.stats()
+    assert fn.calls == 3
+    assert stats["retried"] == 2 and stats["rate_limited"] == 2 and stats["failed"] == 0
+    assert stats["concurrency_limit"] == 2.0  # 4 -> 2 -> 1 on the 429s, + 1/limit for the answer
+    assert stats["active"] == 0
+
+
+def test_retries_stop_after_the_limit():
+    sched = scheduler(FakeClock(), retries=2)
+    fn = Failing(Exception("503 Service Unavailable"))
+    with pytest.raises(Exception, match="503"):
+        sched.call(fn)
+    assert fn.calls == 3
+    stats = sched.stats()
+    assert stats["retried"] == 2 and stats["failed"] == 1 and stats["active"] == 0
+
+
+def test_other_errors_are_not_retried():
+    sched = scheduler(FakeClock(), retries=5)
+    fn = Failing(ValueError("invalid prompt"))
+    with pytest.raises(ValueError):
+        sched.call(fn)
+    assert fn.calls == 1
+    assert sched.stats()["retried"] == 0
+
+
+def test_concurrency_limit_follows_latency():
+    clock = FakeClock()
+    sched = scheduler(clock, min_concurrency=1, max_concurrency=4, target_latency=10)
+    assert sched.limit == 2.0
+
+    def slow():
+        clock.advance(30)
+        return "slow"
+
+    sched.call(slow)
+    assert sched.limit == pytest.approx(1.8)
+    for _ in range(20):
+        sched.call(lambda: "fast")
+    assert sched.limit == pytest.approx(4.0)  # additive increase, capped at max_concurrency
+    for _ in range(50):
+        sched.call(slow)
+    assert sched.limit == pytest.approx(1.0)  # never below min_concurrency
+
+
+def test_full_queue_answers_busy():
+    sched = scheduler(FakeClock(), max_concurrency=1, queue_size=1)
+    release = threading.Event()
+    threads = [threading.Thread(target=sched.call, args=(release.wait,))]
+    threads[0].start()
+    wait_until(lambda: sched.stats()["active"] == 1)
+    threads.append(threading.Thread(target=sched.call, args=(lambda: None,)))
+    threads[1].start()
+    wait_until(lambda: sched.stats()["queued"] == 1)
+
+    with pytest.raises(LLMBusy):
+        sched.call(lambda: None)
+    assert sched.stats()["busy"] == 1
+    release.set()
+    for thread in threads:
+        thread.join(5)
+    assert sched.stats()["granted"] == 2
+
+
+def test_interactive_call_pushes_out_a_waiting_batch_call():
+    sched = scheduler(FakeClock(), max_concurrency=1, queue_size=1)
+    release = threading.Event()
+    holder = threading.Thread(target=sched.call, args=(release.wait,))
+    holder.start()
+    wait_until(lambda: sched.stats()["active"] == 1)
+
+    errors, results = [], []
+
+    def batch_call():
+        with llm_priority(BATCH):
+            try:
+                sched.call(lambda: "batch")
+            except LLMBusy as e:
+                errors.append(e)
+
+    def interactive_call():
+        with llm_priority(INTERACTIVE):
+            results.append(sched.call(lambda: "interactive"))
+
+    batch = threading.Thread(target=batch_call)
+    batch.start()
+    wait_until(lambda: sched.stats()["queued"] == 1)
+    interactive = threading.Thread(target=interactive_call)
+    interactive.start()
+    batch.join(5)
+    assert len(errors) == 1
+    release.set()
+    interactive.join(5)
+    holder.join(5)
+    assert results == ["interactive"]
+
+
+def test_queue_timeout_answers_busy():
+    sched = scheduler(FakeClock(), max_concurrency=1, queue_timeout=0.05)
+    release = threading.Event()
+    holder = threading.Thread(target=sched.call, args=(release.wait,))
+    holder.start()
+    wait_until(lambda: sched.stats()["active"] == 1)
+    with pytest.raises(LLMBusy):
+        sched.call(lambda: None)
+    release.set()
+    holder.join(5)
+    assert sched.stats()["queued"] == 0
+
+
+def test_classify_error():
+    assert classify_error(Exception("429 Too Many Requests")) == "rate_limited"
+    assert classify_error(TimeoutError()) == "transient"
+    assert classify_error(Exception("503 The service is currently unavailable")) == "transient"
+    assert classify_error(ValueError("bad request")) is None
+    assert classify_error(LLMBusy("busy")) is None
+
+
+class ServiceUnavailable(Exception):
+    """Named like google.api_core.exceptions.ServiceUnavailable."""
+
+
+class ResourceExhausted(Exception):
+    code = 429
+
+
+class HTTPError(Exception):
+    def __init__(self, status_code):
+        super().__init__("request failed")
+        self.status_code = status_code
+
+
+@pytest.mark.parametrize("error, kind", [
+    (ResourceExhausted("Resource has been exhausted (e.g. check quota)."), "rate_limited"),
+    (HTTPError(429), "rate_limited"),
+    (Exception("HTTP status code: 429"), "rate_limited"),
+    (ServiceUnavailable("try again"), "transient"),
+    (HTTPError(502), "transient"),
+    (Exception("500 Internal error encountered."), "transient"),
+    (Exception("upstream returned status=504"), "transient"),
+    (ConnectionResetError(), "transient"),
+    (HTTPError(400), None),
+])
+def test_classify_error_by_status_and_type(error, kind):
+    assert classify_error(error) == kind
+
+
+@pytest.mark.parametrize("message", [
+    "Invalid column name 'Total' in row 500",
+    "Customer 503 not found",
+    "Expected 2 columns, got 504 values",
+    "The prompt has 4290 tokens, over the 429-token limit for id 12429",
+    "Parameter query_timeout must be positive",
+])
+def test_numbers_in_messages_are_not_status_codes(message):
+    assert classify_error(ValueError(message)) is None
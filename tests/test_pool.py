@@ -0,0 +1,61 @@
+import threading
+
+import pytest
+
+import connect
+import pool
+
+
+class FakeConnection:
+    def __init__(self, server):
+        self.server = server
+
+    def close(self):
+        pass
+
+
+@pytest.fixture
+def slow_server(monkeypatch):
+    """connect_to_database blocks for server 'slow' until the event is set."""
+    release = threading.Event()
+
+    def connect_to_database(server, database, username, password):
+        if server == "slow":
+            release.wait(10)
+        return FakeConnection(server)
+
+    monkeypatch.setattr(connect, "connect_to_database", connect_to_database)
+    monkeypatch.setattr(pool, "_pools", {})
+    monkeypatch.setattr(pool, "_pool_creation_locks", {})
+    yield release
+    release.set()
+
+
+def test_slow_server_does_not_block_pools_for_other_servers(slow_server):
+    slow = threading.Thread(target=pool.get_pool, args=("slow", "Sales", "app", "secret"), daemon=True)
+    slow.start()
+    done = threading.Event()
+    result = {}
+
+    def fast():
+        result["pool"] = pool.get_pool("fast", "Sales", "app", "secret")
+        done.set()
+
+    threading.Thread(target=fast, daemon=True).start()
+    assert done.wait(2), "get_pool for another server waited for the slow one"
+    assert result["pool"].name == "app@fast/Sales"
+    assert slow.is_alive()
+    slow_server.set()
+    slow.join(5)
+
+
+def test_concurrent_callers_share_one_pool(slow_server):
+    pools = []
+    threads = [threading.Thread(target=lambda: pools.append(pool.get_pool("slow", "Sales", "app", "secret")))
+               for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    slow_server.set()
+    for thread in threads:
+        thread.join(5)
+    assert len(pools) == 4 and all(p is pools[0] for p in pools)
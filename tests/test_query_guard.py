@@ -0,0 +1,166 @@
+import pytest
+
+from query_guard import QueryGuard, inject_top, parse_showplan, showplan_estimate
+
+PLAN = """<?xml version="1.0" encoding="utf-16"?>
+<ShowPlanXML xmlns="http://schemas.microsoft.com/sqlserver/2004/07/showplan" Version="1.564" Build="16.0.1000.6">
+  <BatchSequence><Batch><Statements>
+    {statements}
+  </Statements></Batch></BatchSequence>
+</ShowPlanXML>"""
+
+STATEMENT = ('<StmtSimple StatementText="..." StatementId="{id}" StatementType="{type}" '
+             'StatementEstRows="{rows}" StatementSubTreeCost="{cost}"><QueryPlan /></StmtSimple>')
+
+
+def showplan(*statements):
+    """A SHOWPLAN_XML document with one StmtSimple per (type, rows, cost)."""
+    return PLAN.format(statements="\n".join(
+        STATEMENT.format(id=idx + 1, type=kind, rows=rows, cost=cost)
+        for idx, (kind, rows, cost) in enumerate(statements)
+    ))
+
+
+class FakeCursor:
+    """Answers every statement under SHOWPLAN_XML with the next canned plan."""
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.description = None
+        self._rows = []
+
+    def execute(self, sql, params=()):
+        self.connection.executed.append(sql)
+        if sql.upper().startswith("SET SHOWPLAN_XML"):
+            self.description, self._rows = None, []
+        else:
+            self.description, self._rows = [("Microsoft SQL Server 2005 XML Showplan", str)], \
+                [(self.connection.plans.pop(0),)]
+        return self
+
+    def fetchall(self):
+        rows, self._rows = self._rows, []
+        return rows
+
+    def nextset(self):
+        return False
+
+    def close(self):
+        pass
+
+
+class FakeConnection:
+    def __init__(self, *plans):
+        self.plans = list(plans)
+        self.executed = []
+
+    def cursor(self):
+        return FakeCursor(self)
+
+
+def canned(plans):
+    """A plan provider returning the estimate of the canned plan for each SQL text."""
+    calls = []
+
+    def provider(conn, sql):
+        calls.append(sql)
+        statements = parse_showplan(plans[sql])
+        return {"rows": max(s["rows"] for s in statements), "cost": sum(s["cost"] for s in statements)}
+
+    provider.calls = calls
+    return provider
+
+
+def test_parse_showplan_reads_every_statement():
+    statements = parse_showplan(showplan(("SELECT", "1250.5", "0.42"), ("SELECT", "3", "12")))
+    assert statements == [{"type": "SELECT", "rows": 1250.5, "cost": 0.42},
+                          {"type": "SELECT", "rows": 3.0, "cost": 12.0}]
+
+
+def test_showplan_estimate_compiles_under_showplan_xml():
+    conn = FakeConnection(showplan(("SELECT", "40", "1.5"), ("SELECT", "900", "2.5")))
+    estimate = showplan_estimate(conn, "SELECT 1; SELECT 2")
+    assert estimate["rows"] == 900.0
+    assert estimate["cost"] == 4.0
+    assert conn.executed == ["SET SHOWPLAN_XML ON", "SELECT 1; SELECT 2", "SET SHOWPLAN_XML OFF"]
+
+
+@pytest.mark.parametrize("sql, expected", [
+    ("SELECT name FROM dbo.customers", "SELECT TOP (100) name FROM dbo.customers"),
+    ("SELECT DISTINCT city FROM dbo.customers;", "SELECT DISTINCT TOP (100) city FROM dbo.customers;"),
+    ("SELECT TOP 5000 * FROM dbo.orders", "SELECT TOP 100 * FROM dbo.orders"),
+    ("SELECT TOP (50) * FROM dbo.orders", "SELECT TOP (50) * FROM dbo.orders"),
+    ("SELECT TOP (10) PERCENT * FROM dbo.orders", None),
+    ("SELECT a FROM t UNION SELECT a FROM u", None),
+    ("WITH c AS (SELECT 1 AS a) SELECT a FROM c", None),
+    ("SELECT 1; SELECT 2", None),
+])
+def test_inject_top(sql, expected):
+    assert inject_top(sql, 100) == expected
+
+
+def test_small_select_runs_unchanged():
+    sql = "SELECT name FROM dbo.customers WHERE id = 7"
+    guard = QueryGuard(plan_provider=canned({sql: showplan(("SELECT", "1", "0.0033"))}), max_rows=100, max_cost=50)
+    decision = guard.check(None, sql)
+    assert decision["allowed"] and not decision["rewritten"]
+    assert decision["sql"] == sql
+    assert decision["estimated_rows"] == 1.0
+
+
+def test_large_select_is_capped_and_estimated_again():
+    sql = "SELECT * FROM dbo.orders"
+    capped = "SELECT TOP (100) * FROM dbo.orders"
+    provider = canned({sql: showplan(("SELECT", "2500000", "180")), capped: showplan(("SELECT", "100", "0.8"))})
+    decision = QueryGuard(plan_provider=provider, max_rows=100, max_cost=50).check(None, sql)
+    assert decision["allowed"] and decision["rewritten"]
+    assert decision["sql"] == capped
+    assert decision["estimated_cost"] == 0.8
+    assert provider.calls == [sql, capped]
+
+
+def test_expensive_plan_is_blocked_even_when_capped():
+    sql = "SELECT customer, SUM(total) FROM dbo.orders GROUP BY customer"
+    capped = "SELECT TOP (100) customer, SUM(total) FROM dbo.orders GROUP BY customer"
+    provider = canned({sql: showplan(("SELECT", "90000", "640")), capped: showplan(("SELECT", "100", "610"))})
+    decision = QueryGuard(plan_provider=provider, max_rows=100, max_cost=500).check(None, sql)
+    assert not decision["allowed"]
+    assert "610.0 exceeds the limit of 500.0 even with TOP (100)" in decision["reason"]
+
+
+def test_cost_threshold_applies_without_capping():
+    sql = "SELECT COUNT(*) FROM dbo.orders o JOIN dbo.lines l ON l.order_id = o.id"
+    provider = canned({sql: showplan(("SELECT", "1", "501"))})
+    assert not QueryGuard(plan_provider=provider, max_rows=100, max_cost=500).check(None, sql)["allowed"]
+    assert QueryGuard(plan_provider=provider, max_rows=100, max_cost=502).check(None, sql)["allowed"]
+
+
+def test_uncappable_large_select_is_blocked():
+    sql = "SELECT a FROM t UNION ALL SELECT a FROM u"
+    provider = canned({sql: showplan(("SELECT", "5000", "3"))})
+    decision = QueryGuard(plan_provider=provider, max_rows=100, max_cost=500).check(None, sql)
+    assert not decision["allowed"]
+    assert "can't be capped with TOP" in decision["reason"]
+
+
+def test_without_row_limit_nothing_is_capped():
+    sql = "SELECT * FROM dbo.orders"
+    provider = canned({sql: showplan(("SELECT", "2500000", "180"))})
+    decision = QueryGuard(plan_provider=provider, max_rows=None, max_cost=500).check(None, sql)
+    assert decision["allowed"] and decision["sql"] == sql
+
+
+def test_writes_are_refused_before_any_plan_is_fetched():
+    provider = canned({})
+    decision = QueryGuard(plan_provider=provider).check(None, "DELETE FROM dbo.orders")
+    assert not decision["allowed"]
+    assert provider.calls == []
+
+
+def test_plan_failure_blocks_the_query():
+    def failing(conn, sql):
+        raise RuntimeError("Invalid object name 'dbo.nope'")
+
+    decision = QueryGuard(plan_provider=failing).check(None, "SELECT * FROM dbo.nope")
+    assert not decision["allowed"]
+    assert "could not estimate the query plan" in decision["reason"]
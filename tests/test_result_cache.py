@@ -0,0 +1,110 @@
+import pandas as pd
+import pytest
+
+from local_store import LocalStore
+from result_cache import ResultCache, _frame_bytes, referenced_tables
+
+SQL = "SELECT TOP 5 * FROM dbo.Orders"
+
+
+@pytest.fixture(params=["memory", "store"])
+def cache(request, tmp_path):
+    store = LocalStore(str(tmp_path / "store.sqlite3")) if request.param == "store" else None
+    return ResultCache(store=store)
+
+
+def frame(value):
+    return pd.DataFrame({"value": [value]})
+
+
+def test_hit_for_same_server_login_and_database(cache):
+    cache.put(SQL, "Sales", frame(1), server="SRV1", login="alice")
+    hit = cache.get(" select top 5 *\nfrom dbo.orders; ", "sales", server="srv1", login="alice")
+    assert hit is not None and hit["value"].tolist() == [1]
+
+
+def test_servers_with_the_same_database_name_get_separate_entries(cache):
+    cache.put(SQL, "Sales", frame(1), server="srv1", login="alice")
+    cache.put(SQL, "Sales", frame(2), server="srv2", login="alice")
+    assert cache.get(SQL, "Sales", server="srv1", login="alice")["value"].tolist() == [1]
+    assert cache.get(SQL, "Sales", server="srv2", login="alice")["value"].tolist() == [2]
+    assert cache.get(SQL, "Sales", server="srv3", login="alice") is None
+
+
+def test_logins_on_one_server_get_separate_entries(cache):
+    cache.put(SQL, "Sales", frame(1), server="srv1", login="admin")
+    assert cache.get(SQL, "Sales", server="srv1", login="reader") is None
+    cache.put(SQL, "Sales", frame(2), server="srv1", login="reader")
+    assert cache.get(SQL, "Sales", server="srv1", login="admin")["value"].tolist() == [1]
+    assert cache.get(SQL, "Sales", server="srv1", login="reader")["value"].tolist() == [2]
+
+
+def test_write_invalidates_every_login_on_its_server_only(cache):
+    for server, login in (("srv1", "admin"), ("srv1", "reader"), ("srv2", "admin")):
+        cache.put(SQL, "Sales", frame(1), server=server, login=login)
+    cache.invalidate_statement("UPDATE dbo.Orders SET Qty = 0", "Sales", server="SRV1")
+    assert cache.get(SQL, "Sales", server="srv1", login="admin") is None
+    assert cache.get(SQL, "Sales", server="srv1", login="reader") is None
+    assert cache.get(SQL, "Sales", server="srv2", login="admin") is not None
+
+
+@pytest.mark.parametrize("sql, tables", [
+    ("SELECT * FROM Orders", {"dbo.orders"}),
+    ("SELECT * FROM [Sales].[Orders] o JOIN dbo.Customers c ON c.id = o.customer_id",
+     {"sales.orders", "dbo.customers"}),
+    ("SELECT * FROM Shop.dbo.Orders o CROSS APPLY (SELECT TOP 1 * FROM dbo.Lines l WHERE l.order_id = o.id) x",
+     {"dbo.orders", "dbo.lines"}),
+    ("SELECT 'FROM Secret' AS s FROM Orders -- JOIN Ignored", {"dbo.orders"}),
+    ("SELECT * FROM #staging JOIN Orders ON 1 = 1", {"dbo.orders"}),
+    ("UPDATE dbo.Orders SET total = 0", {"dbo.orders"}),
+    ("INSERT INTO archive.Orders SELECT * FROM dbo.Orders", {"archive.orders", "dbo.orders"}),
+])
+def test_referenced_tables(sql, tables):
+    assert referenced_tables(sql) == tables
+
+
+def test_invalidating_a_table_drops_only_the_results_that_read_it(cache):
+    joined = "SELECT * FROM dbo.Orders o JOIN dbo.Customers c ON c.id = o.customer_id"
+    cache.put(SQL, "Sales", frame(1), server="srv1", login="app")
+    cache.put(joined, "Sales", frame(2), server="srv1", login="app")
+    cache.put("SELECT * FROM dbo.Customers", "Sales", frame(3), server="srv1", login="app")
+    cache.put(SQL, "Archive", frame(4), server="srv1", login="app")
+
+    cache.invalidate_table("[dbo].[Customers]", "SALES", server="srv1")
+    assert cache.get(SQL, "Sales", server="srv1", login="app") is not None
+    assert cache.get(joined, "Sales", server="srv1", login="app") is None
+    assert cache.get("SELECT * FROM dbo.Customers", "Sales", server="srv1", login="app") is None
+
+    # Unqualified names mean dbo; other databases are left alone
+    cache.invalidate_table("orders", "Sales", server="srv1")
+    assert cache.get(SQL, "Sales", server="srv1", login="app") is None
+    assert cache.get(SQL, "Archive", server="srv1", login="app") is not None
+
+
+def test_write_statements_bypass_the_cache_and_invalidate_what_they_touch(cache):
+    cache.put(SQL, "Sales", frame(1), server="srv1", login="app")
+    cache.put("SELECT * FROM sales.Targets", "Sales", frame(2), server="srv1", login="app")
+    write = "INSERT INTO dbo.Orders (total) SELECT amount FROM staging.Imports"
+    cache.put(write, "Sales", frame(3), server="srv1", login="app")
+    assert cache.get(write, "Sales", server="srv1", login="app") is None
+    assert cache.stats()["bypassed"] == 1
+
+    cache.invalidate_statement(write, "Sales", server="srv1")
+    assert cache.get(SQL, "Sales", server="srv1", login="app") is None
+    assert cache.get("SELECT * FROM sales.Targets", "Sales", server="srv1", login="app") is not None
+
+
+def test_expired_results_are_not_served(cache):
+    cache.put(SQL, "Sales", frame(1), ttl=-1, server="srv1", login="app")
+    assert cache.get(SQL, "Sales", server="srv1", login="app") is None
+
+
+def test_least_recently_used_results_go_first_beyond_max_bytes():
+    cache = ResultCache(max_bytes=3 * _frame_bytes(frame(1)))
+    for value in range(3):
+        cache.put(f"SELECT {value} AS v FROM dbo.Orders", "Sales", frame(value))
+    cache.get("SELECT 0 AS v FROM dbo.Orders", "Sales")
+    cache.put("SELECT 3 AS v FROM dbo.Orders", "Sales", frame(3))
+    assert cache.get("SELECT 0 AS v FROM dbo.Orders", "Sales") is not None
+    assert cache.get("SELECT 1 AS v FROM dbo.Orders", "Sales") is None
+    assert cache.stats()["entries"] == 3
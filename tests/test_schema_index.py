@@ -0,0 +1,37 @@
+import os
+
+import schema_cache
+import schema_index
+from schema_index import HashingEmbedder, get_embedder, index_path, load_or_build_index
+
+TABLES = {
+    "Shop.dbo.Customers": {"schema": "CREATE TABLE [dbo].[Customers] (\n    [CustomerID] int,\n    [Name] nvarchar\n)"},
+    "Shop.dbo.Orders": {"schema": "CREATE TABLE [dbo].[Orders] (\n    [OrderID] int,\n    [CustomerID] int "
+                                  "REFERENCES Customers(CustomerID)\n)"},
+}
+
+
+def snapshot(version):
+    return {"server": "srv", "database": "Shop", "version": version, "tables": TABLES}
+
+
+def test_default_embedder_is_the_offline_hashing_one():
+    assert schema_index.SCHEMA_EMBED_MODEL == ""
+    assert isinstance(get_embedder(), HashingEmbedder)
+
+
+def test_missing_model_falls_back_without_downloading(monkeypatch):
+    monkeypatch.setattr(schema_index, "_dense_embedders", {})
+    assert isinstance(get_embedder("no-such-local-model"), HashingEmbedder)
+
+
+def test_writing_a_new_version_deletes_older_index_files(tmp_path, monkeypatch):
+    monkeypatch.setattr(schema_cache, "SCHEMA_CACHE_DIR", str(tmp_path))
+    monkeypatch.setattr(schema_index, "_indexes", schema_index.OrderedDict())
+    other = {**snapshot("v1"), "database": "Other"}
+    load_or_build_index(other)
+    load_or_build_index(snapshot("v1"))
+    load_or_build_index(snapshot("v2"))
+    assert not os.path.exists(index_path(snapshot("v1")))
+    assert os.path.exists(index_path(snapshot("v2")))
+    assert os.path.exists(index_path(other))
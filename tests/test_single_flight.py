@@ -0,0 +1,155 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from single_flight import FlightAbandoned, SingleFlight
+
+
+def wait_until(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "condition not reached"
+        time.sleep(0.001)
+
+
+class Leader:
+    """A call that blocks until its gate is set, then returns or raises what it is given."""
+
+    def __init__(self, outcomes=("value",)):
+        self.calls = 0
+        self.outcomes = list(outcomes)
+        self.gates = [threading.Event() for _ in self.outcomes]
+
+    @property
+    def release(self):
+        return self.gates[0]
+
+    def __call__(self):
+        self.calls += 1
+        outcome, gate = self.outcomes[self.calls - 1], self.gates[self.calls - 1]
+        gate.wait(5)
+        if isinstance(outcome, BaseException):
+            raise outcome
+        return outcome
+
+
+def run_followers(group, key, fn, count):
+    """Starts the leader and ``count`` followers on threads; returns (threads, results)."""
+    results = []
+
+    def call():
+        try:
+            results.append(group.do(key, fn))
+        except Exception as e:
+            results.append(e)
+
+    leader = threading.Thread(target=call)
+    leader.start()
+    wait_until(lambda: group.stats()["in_flight"] == 1)
+    followers = [threading.Thread(target=call) for _ in range(count)]
+    for thread in followers:
+        thread.start()
+    wait_until(lambda: group.stats()["collapsed"] == count)
+    return [leader] + followers, results
+
+
+def test_followers_share_the_leaders_result():
+    group, fn = SingleFlight("test"), Leader()
+    threads, results = run_followers(group, "q", fn, 3)
+    fn.release.set()
+    for thread in threads:
+        thread.join(5)
+    assert results == ["value"] * 4
+    assert fn.calls == 1
+    assert group.stats() == {"in_flight": 0, "leaders": 1, "collapsed": 3, "failed": 0, "abandoned": 0}
+
+
+def test_followers_share_the_leaders_exception():
+    error = ValueError("bad SQL")
+    group, fn = SingleFlight("test"), Leader([error])
+    threads, results = run_followers(group, "q", fn, 2)
+    fn.release.set()
+    for thread in threads:
+        thread.join(5)
+    assert results == [error] * 3
+    assert fn.calls == 1 and group.stats()["failed"] == 1
+
+
+def test_abandoned_flight_is_retried_by_a_follower():
+    group, fn = SingleFlight("test"), Leader([FlightAbandoned("cancelled by its caller"), "retried"])
+    threads, results = run_followers(group, "q", fn, 2)
+    fn.gates[0].set()
+    # One follower leads the retry, the other follows it
+    wait_until(lambda: fn.calls == 2 and group.stats()["collapsed"] == 3)
+    fn.gates[1].set()
+    for thread in threads:
+        thread.join(5)
+    # The leader sees its own FlightAbandoned; both followers get the new leader's answer
+    assert sorted(map(str, results)) == ["cancelled by its caller", "retried", "retried"]
+    assert fn.calls == 2
+    stats = group.stats()
+    assert (stats["leaders"], stats["abandoned"], stats["in_flight"]) == (2, 1, 0)
+
+
+def test_different_keys_do_not_collapse():
+    group = SingleFlight("test")
+    assert group.do("a", lambda: 1) == 1
+    assert group.do("b", lambda: 2) == 2
+    assert group.stats()["collapsed"] == 0
+
+
+def test_cancelled_follower_stops_waiting_without_affecting_the_others():
+    async def scenario():
+        group, release, calls = SingleFlight("test"), asyncio.Event(), []
+
+        async def fn():
+            calls.append(1)
+            await release.wait()
+            return "value"
+
+        leader = asyncio.ensure_future(group.ado("q", fn))
+        await asyncio.sleep(0)
+        cancelled = asyncio.ensure_future(group.ado("q", fn))
+        waiting = asyncio.ensure_future(group.ado("q", fn))
+        await asyncio.sleep(0)
+        cancelled.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await cancelled
+        release.set()
+        assert await leader == "value" and await waiting == "value"
+        return group, calls
+
+    group, calls = asyncio.run(scenario())
+    assert len(calls) == 1
+    assert group.stats()["abandoned"] == 0
+
+
+def test_cancelled_leader_abandons_and_a_follower_takes_over():
+    async def scenario():
+        group, release, calls = SingleFlight("test"), asyncio.Event(), []
+
+        async def fn():
+            calls.append(1)
+            await release.wait()
+            return len(calls)
+
+        leader = asyncio.ensure_future(group.ado("q", fn))
+        await asyncio.sleep(0)
+        followers = [asyncio.ensure_future(group.ado("q", fn)) for _ in range(2)]
+        await asyncio.sleep(0)
+        leader.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await leader
+        for _ in range(100):
+            if group.stats()["collapsed"] == 3:
+                break
+            await asyncio.sleep(0)
+        release.set()
+        return group, await asyncio.gather(*followers)
+
+    group, answers = asyncio.run(scenario())
+    # Only one follower became the new leader; the other waited for it
+    assert answers == [2, 2]
+    assert group.stats()["abandoned"] == 1 and group.stats()["leaders"] == 2
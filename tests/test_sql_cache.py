@@ -0,0 +1,118 @@
+import sqlite3
+
+import pytest
+
+import helper
+import pool
+from fake_llm import FakeSQLChatModel
+from result_cache import ResultCache
+from sql_cache import SQLCache, is_context_dependent, normalize_question, question_literals
+from sqlite_adapter import DATABASE_NAME, build_synthetic_database, connect_sqlite
+
+QUESTION = "How many open orders are there?"
+SQL = "SELECT COUNT(*) AS open_orders FROM [dbo].[orders] WHERE status = 'open'"
+
+
+def test_rewordings_share_a_normalized_key():
+    assert normalize_question("Please show me all the open orders!") == normalize_question("open orders")
+    assert question_literals("Top 5 orders over 10.5 in 'EU'") == ["'eu'", "10.5", "5"]
+    assert is_context_dependent("And for those in Europe?")
+    assert not is_context_dependent("Orders in Europe")
+
+
+def test_exact_and_semantic_hits():
+    cache = SQLCache(path="")
+    cache.put(QUESTION, "v1", SQL)
+    assert cache.get("how many open orders are there", "v1") == SQL
+    assert cache.get("How many open order are there?", "v1") == SQL
+    assert cache.get("Which customers placed orders?", "v1") is None
+    stats = cache.stats()
+    assert (stats["hits_exact"], stats["hits_semantic"], stats["misses"]) == (1, 1, 1)
+
+
+def test_different_literals_or_schema_versions_never_match():
+    cache = SQLCache(path="")
+    cache.put("Top 5 customers by sales", "v1", "SELECT TOP 5 ...")
+    assert cache.get("Top 10 customers by sales", "v1") is None
+    assert cache.get("Top 5 customers by sales", "v2") is None
+
+
+def test_least_recently_used_entries_go_first():
+    cache = SQLCache(path="", max_entries=2)
+    cache.put("orders per region", "v1", "SELECT 1")
+    cache.put("customers per region", "v1", "SELECT 2")
+    cache.get("orders per region", "v1")
+    cache.put("products per category", "v1", "SELECT 3")
+    assert cache.get("orders per region", "v1") == "SELECT 1"
+    assert cache.get("customers per region", "v1") is None
+    assert cache.stats()["entries"] == 2
+
+
+def test_entries_persist_in_the_sqlite_file(tmp_path):
+    path = str(tmp_path / "sql_cache.sqlite3")
+    SQLCache(path=path).put(QUESTION, "v1", SQL)
+    assert SQLCache(path=path).get(QUESTION, "v1") == SQL
+    assert not (tmp_path / "sql_cache.json").exists()
+
+
+def test_invalidate_with_sql_drops_every_entry_holding_it():
+    cache = SQLCache(path="")
+    cache.put(QUESTION, "v1", SQL)
+    cache.put("Count the open orders", "v1", SQL)
+    cache.put("How many orders are there?", "v1", "SELECT COUNT(*) FROM [dbo].[orders]")
+    cache.put(QUESTION, "v2", SQL)
+    cache.invalidate("count open orders please", "v1", sql=SQL)
+    assert cache.get(QUESTION, "v1") is None
+    assert cache.get("Count the open orders", "v1") is None
+    assert cache.get("How many orders are there?", "v1") is not None
+    assert cache.get(QUESTION, "v2") == SQL
+
+
+def test_invalidate_with_sql_keeps_a_replaced_entry():
+    cache = SQLCache(path="")
+    cache.put(QUESTION, "v1", "SELECT 2")
+    cache.invalidate(QUESTION, "v1", sql=SQL)
+    assert cache.get(QUESTION, "v1") == "SELECT 2"
+
+
+def test_invalidate_is_shared_through_the_store(tmp_path):
+    path = str(tmp_path / "sql_cache.sqlite3")
+    writer, reader = SQLCache(path=path), SQLCache(path=path)
+    writer.put(QUESTION, "v1", SQL)
+    assert reader.get(QUESTION, "v1") == SQL
+    writer.invalidate(QUESTION, "v1", sql=SQL)
+    assert reader.get(QUESTION, "v1") is None
+
+
+@pytest.fixture
+def bot(tmp_path):
+    path = str(tmp_path / "shop.sqlite")
+    build_synthetic_database(path, 3, order_rows=20)
+    conn_pool = pool.ConnectionPool(lambda: connect_sqlite(path), name="sqlite:shop")
+    bot = helper.SQLChatBot("test", DATABASE_NAME, "test", "test", llm=FakeSQLChatModel(sql=SQL), conn=conn_pool)
+    bot.sql_cache = SQLCache(path="")
+    bot.result_cache = ResultCache()
+    bot.db_path = path
+    yield bot
+    conn_pool.close()
+
+
+def test_successful_query_keeps_its_sql_cached(bot):
+    sql = bot.get_sql_query(QUESTION)
+    assert not isinstance(bot.get_query_result(sql), str)
+    assert bot.sql_cache.get(QUESTION, bot.schema_version) == sql
+
+
+def test_failed_query_drops_its_sql_from_the_cache(bot):
+    # The UI and the service stream the SQL, then run it separately
+    for _ in bot.stream_sql_query(QUESTION):
+        pass
+    sql = bot.last_sql
+    assert bot.sql_cache.get(QUESTION, bot.schema_version) == sql
+    raw = sqlite3.connect(bot.db_path)
+    raw.execute("ALTER TABLE orders RENAME TO orders_old")
+    raw.commit()
+    raw.close()
+    result = bot.get_query_result(sql)
+    assert isinstance(result, str)
+    assert bot.sql_cache.get(QUESTION, bot.schema_version) is None
@@ -0,0 +1,77 @@
+import pytest
+
+import sql_validator
+from connect import _build_ddl
+from sql_validator import SchemaCatalog, validate_sql
+
+CUSTOMERS = [("CustomerID", "int", 4, 10, 0), ("Name", "nvarchar", 200, 0, 0), ("Region", "nvarchar", 100, 0, 0)]
+ORDERS = [("OrderID", "int", 4, 10, 0), ("CustomerID", "int", 4, 10, 0), ("OrderDate", "date", 3, 10, 0),
+          ("Total", "decimal", 9, 10, 2)]
+
+
+@pytest.fixture(scope="module")
+def catalog():
+    return SchemaCatalog({
+        "Shop.dbo.Customers": {"schema": _build_ddl("dbo", "Customers", CUSTOMERS, ["CustomerID"], [])},
+        "Shop.dbo.Orders": {"schema": _build_ddl("dbo", "Orders", ORDERS, ["OrderID"],
+                                                 [("CustomerID", "dbo", "Customers", "CustomerID")])},
+        "Shop.sales.Targets": {"schema": _build_ddl("sales", "Targets", [("Region", "nvarchar", 100, 0, 0)],
+                                                    [], [])},
+    })
+
+
+@pytest.mark.parametrize("sql", [
+    "SELECT TOP 5 c.Name, SUM(o.Total) AS spent FROM dbo.Customers c "
+    "JOIN dbo.Orders o ON o.CustomerID = c.CustomerID GROUP BY c.Name ORDER BY spent DESC",
+    "SELECT Name FROM customers WHERE region = 'EU'",
+    "SELECT t.Region FROM sales.Targets AS t",
+    "WITH recent AS (SELECT CustomerID, OrderDate AS placed FROM Orders) "
+    "SELECT r.placed, c.Name FROM recent r JOIN Customers c ON c.CustomerID = r.CustomerID",
+    "WITH totals (cust, amount) AS (SELECT CustomerID, SUM(Total) FROM Orders GROUP BY CustomerID) "
+    "SELECT cust FROM totals WHERE amount > 100",
+    "SELECT x.big FROM (SELECT OrderID AS big FROM Orders) x",
+    "SELECT x.id FROM (SELECT OrderID FROM Orders) AS x (id)",
+    "SELECT c.Name FROM Customers c WHERE EXISTS "
+    "(SELECT 1 FROM Orders o WHERE o.CustomerID = c.CustomerID AND o.Total > 10)",
+    "SELECT * INTO #recent FROM Orders; SELECT anything FROM #recent",
+    "SELECT name FROM sys.tables",
+])
+def test_valid(catalog, sql):
+    result = validate_sql(sql, catalog)
+    assert (result["status"], result["problems"]) == ("valid", [])
+
+
+@pytest.mark.parametrize("sql, problem", [
+    ("SELECT Name FROM dbo.Clients", "unknown table dbo.Clients"),
+    ("SELECT Region FROM dbo.Targets", "unknown table dbo.Targets"),
+    ("SELECT o.Nope FROM Orders o", "unknown column o.Nope"),
+    ("SELECT c.OrderDate FROM Orders o JOIN Customers c ON o.CustomerID = c.CustomerID",
+     "unknown column c.OrderDate"),
+    ("SELECT CustomerID FROM Orders o JOIN Customers c ON o.CustomerID = c.CustomerID",
+     "ambiguous column 'CustomerID' (in c, o)"),
+    ("WITH recent AS (SELECT CustomerID, OrderDate AS placed FROM Orders) SELECT OrderDate FROM recent",
+     "unknown column 'OrderDate'"),
+    ("SELECT x.OrderID FROM (SELECT OrderID AS big FROM Orders) x", "unknown column x.OrderID"),
+    ("WITH totals (cust, amount) AS (SELECT CustomerID, SUM(Total) FROM Orders GROUP BY CustomerID) "
+     "SELECT CustomerID FROM totals", "unknown column 'CustomerID'"),
+    ("SELECT Name FROM Customers c WHERE EXISTS (SELECT 1 FROM Orders o WHERE o.Shipped = 1)",
+     "unknown column o.Shipped"),
+])
+def test_invalid(catalog, sql, problem):
+    result = validate_sql(sql, catalog)
+    assert result["status"] == "invalid"
+    assert result["problems"] == [problem]
+
+
+@pytest.mark.parametrize("sql", ["SELECT * FROM Orders WHERE ((", "SELECT Total +"])
+def test_unparseable_sql_is_unchecked_not_rejected(catalog, sql):
+    result = validate_sql(sql, catalog)
+    assert result == {"status": "unchecked", "problems": [], "checker": "unparsed"}
+
+
+def test_without_sqlglot_only_tables_are_checked(catalog, monkeypatch):
+    monkeypatch.setattr(sql_validator, "_sqlglot", False)
+    cte = validate_sql("WITH recent AS (SELECT Nope FROM Orders) SELECT * FROM recent", catalog)
+    assert (cte["status"], cte["checker"]) == ("valid", "tables")
+    unknown = validate_sql("SELECT * FROM Orders o JOIN dbo.Clients c ON 1 = 1", catalog)
+    assert unknown["status"] == "invalid" and unknown["problems"] == ["unknown table dbo.clients"]
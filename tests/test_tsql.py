@@ -0,0 +1,82 @@
+import pytest
+
+from tsql import is_independent_read, split_batches, split_statements
+
+
+@pytest.mark.parametrize("script, expected", [
+    ("SELECT 1\nGO\nSELECT 2", ["SELECT 1", "SELECT 2"]),
+    ("select 1\ngo\nselect 2\n  GO  \n", ["select 1", "select 2"]),
+    ("SELECT 1\nGO 3\nSELECT 2", ["SELECT 1", "SELECT 1", "SELECT 1", "SELECT 2"]),
+    ("SELECT 1\nGO -- first batch\nSELECT 2", ["SELECT 1", "SELECT 2"]),
+    ("SELECT 1\r\nGO\r\nSELECT 2", ["SELECT 1", "SELECT 2"]),
+    ("GO\nSELECT 1\nGO\nGO", ["SELECT 1"]),
+])
+def test_split_batches_on_go_lines(script, expected):
+    assert split_batches(script) == expected
+
+
+@pytest.mark.parametrize("script", [
+    "SELECT 'first line\nGO\nlast line' AS s",
+    "SELECT N'it''s\nGO\n' AS s",
+    "/* setup\nGO\n*/\nSELECT 1",
+    "SELECT 1\n-- GO\nSELECT 2",
+    "SELECT 1 GO",
+    "SELECT [go]\nFROM t",
+    "SELECT 1 AS x\nGO2",
+])
+def test_go_inside_strings_comments_or_lines_does_not_split(script):
+    assert split_batches(script) == [script.strip()]
+
+
+def test_go_after_a_comment_containing_go_still_splits():
+    assert split_batches("SELECT 1 /* GO */\nGO\nSELECT 2") == ["SELECT 1 /* GO */", "SELECT 2"]
+
+
+@pytest.mark.parametrize("batch, expected", [
+    ("SELECT 1; SELECT 2;", ["SELECT 1", "SELECT 2"]),
+    ("SELECT ';' AS s; SELECT 2", ["SELECT ';' AS s", "SELECT 2"]),
+    ("SELECT [a;b] FROM t; -- done; really\nSELECT 2", ["SELECT [a;b] FROM t", "-- done; really\nSELECT 2"]),
+    ("SELECT * FROM (SELECT a FROM (SELECT 1 AS a) x) y; SELECT 2",
+     ["SELECT * FROM (SELECT a FROM (SELECT 1 AS a) x) y", "SELECT 2"]),
+    ("SELECT CASE WHEN a > 0 THEN 1 ELSE 0 END FROM t; SELECT 2",
+     ["SELECT CASE WHEN a > 0 THEN 1 ELSE 0 END FROM t", "SELECT 2"]),
+    ("IF 1 = 1 BEGIN SELECT 1; SELECT 2; END; SELECT 3",
+     ["IF 1 = 1 BEGIN SELECT 1; SELECT 2; END", "SELECT 3"]),
+    ("BEGIN TRAN; UPDATE t SET a = 1; COMMIT;", ["BEGIN TRAN", "UPDATE t SET a = 1", "COMMIT"]),
+    ("SELECT 1\nSELECT 2", ["SELECT 1\nSELECT 2"]),
+])
+def test_split_statements(batch, expected):
+    assert split_statements(batch) == expected
+
+
+def test_module_definitions_are_kept_whole():
+    batch = "CREATE PROCEDURE dbo.p AS\nBEGIN\n  SELECT 1;\n  SELECT 2;\nEND"
+    assert split_statements(batch) == [batch]
+
+
+@pytest.mark.parametrize("statement", [
+    "SELECT TOP 5 * FROM dbo.Orders",
+    "WITH c AS (SELECT 1 AS a) SELECT a FROM c",
+    "SELECT * FROM (SELECT a FROM (SELECT 1 AS a) x) y",
+    "SELECT (SELECT MAX(id) FROM (SELECT id FROM t) m) AS top_id",
+    "(SELECT 1) UNION ALL (SELECT 2)",
+    "((SELECT a FROM t)) ORDER BY a",
+    "SELECT '@not_a_variable', '#nor_a_temp_table'",
+])
+def test_independent_reads(statement):
+    assert is_independent_read(statement)
+
+
+@pytest.mark.parametrize("statement", [
+    "SELECT * FROM (SELECT a FROM (SELECT a FROM #staging) x) y",
+    "SELECT (SELECT MAX(id) FROM t WHERE id < @limit) AS top_id",
+    "((SELECT a FROM ##shared))",
+    "WITH c AS (SELECT 1 AS a) SELECT a INTO dbo.copy FROM c",
+    "(SELECT a INTO #t FROM t)",
+    "UPDATE t SET a = (SELECT 1)",
+    "DECLARE @x int",
+    "",
+    "( )",
+])
+def test_dependent_or_writing_statements(statement):
+    assert not is_independent_read(statement)
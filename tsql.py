@@ -0,0 +1,98 @@
+import re
+
+from result_cache import is_write_statement, sql_tokens
+
+_WORD = re.compile(r"[A-Za-z_@#$][\w@#$]*|\d+|\S")
+# Rest of a GO line: an optional repeat count and an optional comment
+_GO_TAIL = re.compile(r"[ \t]*(\d+)?[ \t]*(--[^\n]*)?\r?(\n|$)")
+# BEGIN forms that are not blocks closed by END
+_BEGIN_NOT_BLOCK = {"tran", "transaction", "distributed", "dialog", "conversation"}
+# Batches made of a single module definition; their body is never split
+_MODULE_OBJECTS = {"procedure", "proc", "function", "trigger", "view"}
+
+
+def atoms(sql):
+    """(start, end, text) for each word, number, bracketed name, string or symbol outside comments."""
+    for kind, text, offset in sql_tokens(sql):
+        if kind in ("string", "ident"):
+            yield offset, offset + len(text), text
+        elif kind == "other":
+            for match in _WORD.finditer(text):
+                yield offset + match.start(), offset + match.end(), match.group()
+
+
+def split_batches(script):
+    """
+    Splits a script on GO separators, the way sqlcmd and SSMS do: GO alone on
+    its line (outside strings and comments), optionally followed by a repeat
+    count. ``GO 3`` repeats the preceding batch three times.
+
+    Returns:
+        list of batch strings (without the GO lines); empty batches are dropped
+    """
+    batches, start = [], 0
+    for kind, text, offset in sql_tokens(script):
+        if kind != "other" or text.lower() != "go":
+            continue
+        line_start = script.rfind("\n", 0, offset) + 1
+        if script[line_start:offset].strip():
+            continue
+        tail = _GO_TAIL.match(script, offset + len(text))
+        if tail is None:
+            continue
+        batch = script[start:line_start].strip()
+        if batch:
+            batches.extend([batch] * int(tail.group(1) or 1))
+        start = tail.end()
+    batch = script[start:].strip()
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+def split_statements(batch):
+    """
+    Splits one batch on the semicolons that end statements: not inside
+    strings, comments, brackets, parentheses or BEGIN...END / CASE...END
+    blocks. A CREATE/ALTER PROCEDURE, FUNCTION, TRIGGER or VIEW batch is
+    returned whole. Statements separated only by whitespace stay together.
+    """
+    found = list(atoms(batch))
+    words = [text.lower() for _, _, text in found[:4]]
+    if words[:1] in (["create"], ["alter"]) and any(word in _MODULE_OBJECTS for word in words[1:4]):
+        return [batch.strip()]
+
+    statements, start, depth = [], 0, 0
+    for idx, (begin, end, text) in enumerate(found):
+        word = text.lower()
+        if text == "(" or word == "case":
+            depth += 1
+        elif word == "begin":
+            following = found[idx + 1][2].lower() if idx + 1 < len(found) else ""
+            if following not in _BEGIN_NOT_BLOCK:
+                depth += 1
+        elif text == ")" or word == "end":
+            depth = max(depth - 1, 0)
+        elif text == ";" and depth == 0:
+            statement = batch[start:begin].strip()
+            if statement:
+                statements.append(statement)
+            start = end
+    statement = batch[start:].strip()
+    if statement:
+        statements.append(statement)
+    return statements
+
+
+def is_independent_read(statement):
+    """
+    True for a statement that can run on its own connection: a SELECT (or
+    WITH ... SELECT) that writes nothing and uses no variables or temporary
+    tables, which would only exist in the session that declared them.
+    A query expression may open with parentheses: ``(SELECT ...) UNION (SELECT ...)``.
+    """
+    found = [text for _, _, text in atoms(statement)]
+    first = next((text.lower() for text in found if text != "("), "")
+    if first not in ("select", "with") or is_write_statement(statement):
+        return False
+    return not any(text.startswith(("@", "#")) for text in found)
@@ -0,0 +1,258 @@
+"""
+Workload log: every statement the bot sends to SQL Server is appended to a
+JSONL file with its normalized shape (literals replaced by ?), duration, row
+count and the tables and columns it uses, by role (equality / range
+predicates, joins, grouping, ordering, output). The statement itself is not
+stored, so no values from the questions end up in the log.
+index_advisor.py reads it to recommend indexes for the shapes the bot
+actually runs.
+"""
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+
+from result_cache import referenced_tables, sql_tokens
+from sql_validator import _parser, _table_name
+
+# Where executed statements are appended, one JSON object per line; empty disables the log.
+WORKLOAD_LOG_PATH = os.getenv("WORKLOAD_LOG_PATH", os.path.join(".telemetry", "workload.jsonl"))
+# Size at which the log is rotated to <path>.1 (the previous .1 is dropped).
+WORKLOAD_LOG_MAX_BYTES = int(os.getenv("WORKLOAD_LOG_MAX_BYTES", str(64 * 1024 * 1024)))
+# Described shapes kept in memory, so repeated shapes are parsed once.
+WORKLOAD_SHAPE_CACHE_SIZE = 2048
+
+ROLES = ("equality", "range", "join", "group", "order", "output")
+
+_NUMBER = re.compile(r"(?<![\w@#$.])(?:0x[0-9a-f]+|\d+(?:\.\d+)?(?:e[+-]?\d+)?)", re.IGNORECASE)
+_VALUE_LIST = re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)")
+_TOP_PLACEHOLDER = re.compile(r"\btop \?")
+# Quoted values in server error messages, e.g. "converting the varchar value 'abc' ..."
+_QUOTED = re.compile(r"'(?:[^']|'')*'")
+_KEY_VALUE = re.compile(r"(key value is )\(.*?\)(?=\.|$)")
+
+_lock = threading.Lock()
+_described = OrderedDict()
+
+
+def query_shape(sql):
+    """
+    The statement with comments and whitespace normalized, keywords and
+    identifiers lowercased and every literal replaced by ?, lists of
+    literals collapsed to (?): queries differing only in their values share
+    a shape.
+    """
+    parts = []
+    for kind, text, _ in sql_tokens(sql):
+        if kind in ("comment", "space"):
+            if parts and parts[-1] != " ":
+                parts.append(" ")
+        elif kind == "string":
+            parts.append("?")
+        elif kind == "ident":
+            parts.append(text.lower())
+        else:
+            parts.append(_NUMBER.sub("?", text.lower()))
+    return _VALUE_LIST.sub("(?)", "".join(parts).strip().rstrip(";").strip())
+
+
+def shape_id(shape):
+    return hashlib.sha1(shape.encode("utf-8")).hexdigest()[:12]
+
+
+def plan_statement(shape):
+    """
+    (sql, params) to compile a shape for its estimated plan: every ? becomes
+    a parameter (bound to NULL) and the statement is optimized for unknown
+    values, as no actual values are logged.
+    """
+    params = [None] * sum(text.count("?") for kind, text, _ in sql_tokens(shape)
+                          if kind not in ("string", "ident", "comment"))
+    sql = _TOP_PLACEHOLDER.sub("top (?)", shape)
+    if params and ";" not in sql and "option (" not in sql:
+        sql += " option (optimize for unknown)"
+    return sql, params
+
+
+def _role(column, query):
+    """How a column is used by its query: one of ROLES."""
+    from sqlglot import exp
+
+    def within(node):
+        return node is not None and node.find_ancestor(exp.Query) is query
+
+    clause = column.find_ancestor(exp.Where, exp.Join, exp.Group, exp.Order, exp.Having)
+    if not within(clause) or isinstance(clause, exp.Having):
+        return "output"
+    if isinstance(clause, exp.Group):
+        return "group"
+    if isinstance(clause, exp.Order):
+        return "order"
+    comparison = column.find_ancestor(exp.EQ, exp.NEQ, exp.GT, exp.GTE, exp.LT, exp.LTE, exp.Between,
+                                      exp.In, exp.Like, exp.Is)
+    if not within(comparison):
+        return "equality"  # e.g. a bit column used as a condition
+    if isinstance(clause, exp.Join) and isinstance(comparison, exp.EQ) \
+            and isinstance(comparison.this, exp.Column) and isinstance(comparison.expression, exp.Column):
+        return "join"
+    return "equality" if isinstance(comparison, (exp.EQ, exp.In, exp.Is)) else "range"
+
+
+def _describe_parsed(sqlglot, sql, catalog):
+    from sqlglot import exp
+
+    tables = {}
+    scope_sources = {}
+
+    def sources_of(scope):
+        """alias -> "schema.table" for the physical tables a scope reads."""
+        found = scope_sources.get(id(scope))
+        if found is None:
+            found = scope_sources[id(scope)] = {}
+            for alias, source in scope.sources.items():
+                if not isinstance(source, exp.Table) or not isinstance(source.this, exp.Identifier):
+                    continue
+                name = _table_name(source)
+                if name.startswith(("#", "@")) or (source.catalog and catalog is not None
+                                                   and source.catalog.lower() not in catalog.databases):
+                    continue
+                key = catalog.resolve(name, source.db or None) if catalog is not None else None
+                found[alias.lower()] = key or f"{(source.db or 'dbo').lower()}.{name.lower()}"
+        return found
+
+    for statement in sqlglot.parse(sql, read="tsql"):
+        if statement is None:
+            continue
+        for scope in sqlglot.optimizer.scope.traverse_scope(statement):
+            query = scope.expression
+            sources = sources_of(scope)
+            for key in sources.values():
+                tables.setdefault(key, {"star": False})
+            if sources and any(select.is_star for select in getattr(query, "selects", [])):
+                for key in sources.values():
+                    tables[key]["star"] = True
+            aliases = {select.alias.lower() for select in getattr(query, "selects", []) if select.alias}
+            # Not scope.columns: it leaves out HAVING / ORDER BY references
+            for column in query.find_all(exp.Column):
+                if column.find_ancestor(exp.Query) is not query or isinstance(column.this, exp.Star):
+                    continue
+                name = column.name.lower()
+                role = None
+                if column.table:
+                    key, outer = sources.get(column.table.lower()), scope.parent
+                    while key is None and outer is not None:
+                        # Correlated reference to an enclosing query's table
+                        key, role, outer = sources_of(outer).get(column.table.lower()), "join", outer.parent
+                elif name in aliases or not sources:
+                    continue
+                elif len(sources) == 1:
+                    key = next(iter(sources.values()))
+                else:
+                    # Unqualified column of a join: only attributable with the schema
+                    owners = [key for key in sources.values()
+                              if catalog is not None and name in catalog.tables.get(key, ())]
+                    key = owners[0] if len(owners) == 1 else None
+                if key is None:
+                    continue
+                tables.setdefault(key, {"star": False}).setdefault(role or _role(column, query), {})[name] = None
+    return {key: {"star": usage.pop("star"), **{role: list(usage[role]) for role in ROLES if role in usage}}
+            for key, usage in tables.items()}
+
+
+def describe_query(sql, catalog=None, schema_version=None):
+    """
+    The shape of a statement and the columns it uses per table:
+    {"shape_id", "shape", "tables": [...], "columns": {"schema.table": {role: [column, ...], "star"}}}.
+    ``catalog`` (a sql_validator.SchemaCatalog) resolves unqualified tables
+    and columns. Column roles need sqlglot; without it only tables are reported.
+    Results are cached per shape and ``schema_version`` (not cached for a
+    catalog without a version, e.g. while the schema is still loading).
+    """
+    shape = query_shape(sql)
+    key = (shape, schema_version) if catalog is None or schema_version is not None else None
+    with _lock:
+        described = _described.get(key) if key is not None else None
+        if described is not None:
+            _described.move_to_end(key)
+            return described
+
+    columns = {}
+    sqlglot = _parser()
+    if sqlglot:
+        try:
+            columns = _describe_parsed(sqlglot, sql, catalog)
+        except Exception:
+            columns = {}  # not parseable locally: keep the tables only
+    tables = sorted(set(columns) | referenced_tables(sql))
+    described = {"shape_id": shape_id(shape), "shape": shape, "tables": tables, "columns": columns}
+    if key is None:
+        return described
+    with _lock:
+        _described[key] = described
+        while len(_described) > WORKLOAD_SHAPE_CACHE_SIZE:
+            _described.popitem(last=False)
+    return described
+
+
+def _write(record):
+    if not WORKLOAD_LOG_PATH:
+        return
+    try:
+        line = json.dumps(record, default=str)
+        with _lock:
+            os.makedirs(os.path.dirname(WORKLOAD_LOG_PATH) or ".", exist_ok=True)
+            try:
+                if os.path.getsize(WORKLOAD_LOG_PATH) > WORKLOAD_LOG_MAX_BYTES:
+                    os.replace(WORKLOAD_LOG_PATH, WORKLOAD_LOG_PATH + ".1")
+            except FileNotFoundError:
+                pass
+            with open(WORKLOAD_LOG_PATH, "a", encoding="utf-8") as f:
+                f.write(line + "\n")
+    except OSError as e:
+        print(f"⚠️ Could not write the workload log: {e}")
+
+
+def _redact(error):
+    """An error message without the quoted or key values SQL Server puts in it."""
+    return _KEY_VALUE.sub(r"\1(?)", _QUOTED.sub("'?'", error))
+
+
+def log_query(database, sql, seconds, rows=None, status="ok", kind="query", catalog=None, error=None,
+              schema_version=None):
+    """
+    Appends an executed statement to the workload log: its shape and column
+    usage, never the statement with its values. ``kind`` is "query" for
+    answers and "export" for full-result exports; ``status`` is "ok" or
+    "error". ``catalog`` and ``schema_version`` are passed to describe_query.
+    """
+    if not WORKLOAD_LOG_PATH:
+        return
+    record = {
+        "ts": time.time(),
+        "database": database,
+        "kind": kind,
+        "status": status,
+        "ms": round(seconds * 1000, 3),
+        "rows": rows,
+        **describe_query(sql, catalog, schema_version)
+    }
+    if error is not None:
+        record["error"] = _redact(error)
+    _write(record)
+
+
+def read_workload(path=WORKLOAD_LOG_PATH):
+    """Yields the logged records, the rotated file (<path>.1) first."""
+    for name in (path + ".1", path):
+        try:
+            with open(name, encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        yield json.loads(line)
+                    except ValueError:
+                        continue  # a line cut short by a crash
+        except FileNotFoundError:
+            continue